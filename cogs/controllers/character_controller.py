@@ -1,17 +1,34 @@
+import os
+import tempfile
+from contextvars import copy_context
+from itertools import groupby
+from typing import Iterable, Iterator, List, Optional
+from discord import Forbidden
 from discord.ext import commands
-from discord.ext.commands import Bot, Context, guild_only
+from discord.ext.commands import Bot, Context, CommandError, BadArgument, MissingRequiredArgument, guild_only
+from pydantic import ValidationError
 # from cogs.services.character_service import CharacterService # FIXME: Delete
 # from cogs.services.game_service import GameService
-from cogs.services import GameService, CharacterService
+from cogs.services import GameService, CharacterService, RankingService, RankedCharacter, PlayerCharacter
+from converters import GameConverter, GameNotFoundError
 from models.character import Character
 from models.game import Game
-from util.embed_builder import COMMAND_PREFIX, info_embed, warning_embed, error_embed
+from util.embed_builder import COMMAND_PREFIX, info_embed, warning_embed, error_embed, send_generic_error, send_missing_arg_error
+from util.name_builder import create_search_name
+from util.attachments import save_attachment
+from util.sheet_parser import SheetRow, SheetRowError, parse_sheet
+from util.profiler import ProfiledCog
 
-class CharacterController(commands.Cog):
-    def __init__(self, bot: Bot, game_service: GameService, character_service: CharacterService):
+MAX_IMPORT_ERRORS_SHOWN = 10
+MAX_RANKING_SIZE = 25
+PLAYER_CHARACTERS_PAGE_SIZE = 20
+
+class CharacterController(ProfiledCog):
+    def __init__(self, bot: Bot, game_service: GameService, character_service: CharacterService, ranking_service: RankingService):
         self.bot = bot
         self.game_service = game_service
         self.character_service = character_service
+        self.ranking_service = ranking_service
 
     @commands.group(aliases=['character'])
     @guild_only()
@@ -34,3 +51,211 @@ class CharacterController(commands.Cog):
     @char.command(name='create')
     async def show(self, ctx: Context):
         return await ctx.send(embed=error_embed(title='Error, create not implemented yet'))  # FIXME: delete
+
+    @char.command(name='mine', aliases=['my'])
+    async def mine(self, ctx: Context, page: int = 1):
+        '''
+        List your characters in every server, sent to you by direct message
+        '''
+        entries = await self.character_service.find_by_player(ctx.author.id)
+        if not entries:
+            return await ctx.send(embed=info_embed(title="You don't have any characters yet"))
+
+        num_pages = (len(entries) + PLAYER_CHARACTERS_PAGE_SIZE - 1) // PLAYER_CHARACTERS_PAGE_SIZE
+        page = min(max(page, 1), num_pages)
+        embed = self._player_characters_embed(entries, page, num_pages)
+        try:
+            await ctx.author.send(embed=embed)
+        except Forbidden:
+            embed = error_embed(title="Error! I can't send you direct messages", description='Allow direct messages from server members and try again')
+            return await ctx.send(embed=embed)
+        return await ctx.send(embed=info_embed(title=f'Sent you page {page} of your characters'))
+
+    @mine.error
+    async def mine_error(self, ctx: Context, error: CommandError):
+        if isinstance(error, BadArgument):
+            return await ctx.send(embed=error_embed(title='Error! The page must be a whole number', description=f'For example `{COMMAND_PREFIX}char mine 2`'))
+        else:
+            return await send_generic_error(ctx, error=error)
+
+    @char.command(name='set')
+    async def set_attribute(self, ctx: Context, game: Optional[GameConverter], attribute: str, value: str, *, name: str):
+        '''
+        Set a character's attribute, adding it if the character doesn't have it yet, e.g. `char set hp 12 Gandalf`.
+        Give a maximum too with a value like `12/20`
+        '''
+        raw_value, _, raw_max_value = value.partition('/')
+        try:
+            new_value, max_value = int(raw_value), int(raw_max_value) if raw_max_value else None
+        except ValueError:
+            embed = error_embed(title=f'Error! {value} is not a number', description=f'Values look like `12`, or `12/20` with a maximum. For example `{COMMAND_PREFIX}char set hp 12/20 Gandalf`')
+            return await ctx.send(embed=embed)
+
+        game = game or await self.game_service.find_by_channel_or_category(ctx.channel)
+        if not game:
+            return await self._send_missing_game(ctx)
+        character = self.character_service.find_by_game_and_name(game, name)
+        if not character:
+            return await self._send_character_not_found(ctx, game, name)
+
+        try:
+            character = self.character_service.set_attribute(character, attribute, new_value, max_value)
+        except ValidationError:
+            return await ctx.send(embed=error_embed(title='Error! Attribute names must be between 2 and 64 characters long'))
+        saved = character.attributes[create_search_name(attribute)]
+        shown_value = f'{saved.value}/{saved.max_value}' if saved.max_value is not None else str(saved.value)
+        return await ctx.send(embed=info_embed(title=f'{character.display_name} now has {saved.display_name} {shown_value}'))
+
+    @set_attribute.error
+    async def set_attribute_error(self, ctx: Context, error: CommandError):
+        if isinstance(error, MissingRequiredArgument):
+            return await send_missing_arg_error(ctx, error)
+        else:
+            return await send_generic_error(ctx, error=error)
+
+    @char.command(name='import')
+    async def import_sheet(self, ctx: Context, game: Optional[GameConverter]):
+        '''
+        Create characters from a CSV or JSON character sheet attached to the message.
+        CSV sheets have a header row with a name column, an optional player column and one column per attribute, e.g. `Name,Player,HP,STR`.
+        Attribute values look like `12` or `12/20` for a value with a maximum.
+        Only server administrators can import characters for other players.
+        '''
+        if not game:
+            embed = error_embed(title='Error! Missing parameter game', description=f'Give the name of the game to add these characters to, or set a default with `{COMMAND_PREFIX}game channel use <game>`')
+            return await ctx.send(embed=embed)
+
+        if not ctx.message.attachments:
+            embed = error_embed(title='Error! Missing character sheet', description='Attach a `.csv` or `.json` character sheet to your message')
+            return await ctx.send(embed=embed)
+
+        attachment = ctx.message.attachments[0]
+        # Stream the sheet to disk and parse it lazily from there, so it never has to sit in memory as a whole
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, os.path.basename(attachment.filename))
+            await save_attachment(attachment, path)
+            with open(path, encoding='utf-8-sig', newline='') as lines:
+                rows = parse_sheet(lines, filename=attachment.filename)
+                if not ctx.author.guild_permissions.administrator:
+                    rows = self._own_rows(rows, ctx.author.id)
+                result = await self.bot.loop.run_in_executor(None, copy_context().run, self.character_service.import_sheet, game, rows)
+
+        num_created = len(result.created)
+        embed = info_embed(title=f'Imported {num_created} character{"s" if num_created != 1 else ""} into **{game.display_name}**')
+        renamed = [f'- {name} → **{display_name}**' for name, display_name in result.created if name != display_name]
+        if renamed:
+            embed.add_field(name='Renamed because the name was taken:', value='\n'.join(renamed)[:1000], inline=False)
+        if result.errors:
+            embed.add_field(name=f'{len(result.errors)} rows could not be imported:', value='\n'.join(result.errors[:MAX_IMPORT_ERRORS_SHOWN])[:1000], inline=False)
+        return await ctx.send(embed=embed)
+
+    def _own_rows(self, rows: Iterable[SheetRow | SheetRowError], player_id: int) -> Iterator[SheetRow | SheetRowError]:
+        '''Reject rows that give a character to another player'''
+        for row in rows:
+            if isinstance(row, SheetRow) and row.player_id not in (None, player_id):
+                yield SheetRowError(f'Row {row.line_number}: only server administrators can import characters for other players')
+            else:
+                yield row
+
+    @import_sheet.error
+    async def import_sheet_error(self, ctx: Context, error: CommandError):
+        if isinstance(error, GameNotFoundError):
+            return await error.send_error(ctx)
+        else:
+            return await send_generic_error(ctx, error=error)
+
+    @char.command(name='top', aliases=['highest'])
+    async def top(self, ctx: Context, game: Optional[GameConverter], attribute: str, count: int = 10):
+        '''
+        Characters with the highest value of an attribute, e.g. `char top initiative`
+        '''
+        game = game or await self.game_service.find_by_channel_or_category(ctx.channel)
+        if not game:
+            return await self._send_missing_game(ctx)
+        entries = self.ranking_service.find_top(game, create_search_name(attribute), limit=min(count, MAX_RANKING_SIZE))
+        return await self._send_ranking(ctx, f'Highest {attribute} in **{game.display_name}**', entries)
+
+    @char.command(name='bottom', aliases=['lowest'])
+    async def bottom(self, ctx: Context, game: Optional[GameConverter], attribute: str, count: int = 10):
+        '''
+        Characters with the lowest value of an attribute, e.g. `char bottom hp`
+        '''
+        game = game or await self.game_service.find_by_channel_or_category(ctx.channel)
+        if not game:
+            return await self._send_missing_game(ctx)
+        entries = self.ranking_service.find_top(game, create_search_name(attribute), limit=min(count, MAX_RANKING_SIZE), lowest_first=True)
+        return await self._send_ranking(ctx, f'Lowest {attribute} in **{game.display_name}**', entries)
+
+    @char.command(name='rank')
+    async def rank(self, ctx: Context, game: Optional[GameConverter], attribute: str, *, name: str):
+        '''
+        Where a character places for an attribute, e.g. `char rank initiative Gandalf`
+        '''
+        game = game or await self.game_service.find_by_channel_or_category(ctx.channel)
+        if not game:
+            return await self._send_missing_game(ctx)
+        character = self.character_service.find_by_game_and_name(game, name)
+        if not character:
+            return await self._send_character_not_found(ctx, game, name)
+
+        ranked = self.ranking_service.find_rank(game, create_search_name(attribute), character)
+        if not ranked:
+            return await ctx.send(embed=warning_embed(title=f'{character.display_name} has no {attribute}'))
+        return await ctx.send(embed=info_embed(title=f'{character.display_name} is #{ranked.rank} for {attribute} in **{game.display_name}**',
+            description=f'{attribute}: {ranked.value}'))
+
+    @char.command(name='range', aliases=['between'])
+    async def range(self, ctx: Context, game: Optional[GameConverter], attribute: str, min_value: int, max_value: int):
+        '''
+        Characters with an attribute between two values (inclusive), e.g. `char range hp 0 10`
+        '''
+        game = game or await self.game_service.find_by_channel_or_category(ctx.channel)
+        if not game:
+            return await self._send_missing_game(ctx)
+        entries = self.ranking_service.find_in_range(game, create_search_name(attribute), min(min_value, max_value), max(min_value, max_value),
+            limit=MAX_RANKING_SIZE)
+        return await self._send_ranking(ctx, f'{attribute} between {min_value} and {max_value} in **{game.display_name}**', entries)
+
+    @top.error
+    @bottom.error
+    @rank.error
+    @range.error
+    async def ranking_error(self, ctx: Context, error: CommandError):
+        if isinstance(error, MissingRequiredArgument):
+            return await send_missing_arg_error(ctx, error)
+        elif isinstance(error, BadArgument):
+            return await ctx.send(embed=error_embed(title='Error! Counts and values must be whole numbers', description=f'For example `{COMMAND_PREFIX}char top initiative 5`'))
+        else:
+            return await send_generic_error(ctx, error=error)
+
+    async def _send_missing_game(self, ctx: Context):
+        embed = error_embed(title='Error! Missing parameter game', description=f'Give the name of the game, or set a default with `{COMMAND_PREFIX}game channel use <game>`')
+        return await ctx.send(embed=embed)
+
+    async def _send_character_not_found(self, ctx: Context, game: Game, name: str):
+        embed = error_embed(title='Character not found!', description=f'Sorry! We could not find a character with the name **{name}** in **{game.display_name}**')
+        suggestions = self.character_service.suggest_names(game, name)
+        if suggestions:
+            embed.add_field(name='Did you mean:', value='\n'.join(f'- {suggestion}' for suggestion in suggestions), inline=False)
+        return await ctx.send(embed=embed)
+
+    def _player_characters_embed(self, entries: List[PlayerCharacter], page: int, num_pages: int):
+        start = (page - 1) * PLAYER_CHARACTERS_PAGE_SIZE
+        embed = info_embed(title=f'Your {len(entries)} character{"s" if len(entries) != 1 else ""}')
+        for guild_id, guild_entries in groupby(entries[start:start + PLAYER_CHARACTERS_PAGE_SIZE], key=lambda entry: entry.guild_id):
+            guild = self.bot.get_guild(guild_id)
+            lines = '\n'.join(f'- **{entry.display_name}** in {entry.game_name}' for entry in guild_entries)
+            embed.add_field(name=guild.name if guild else 'A server I have left', value=lines[:1024], inline=False)
+        if num_pages > 1:
+            embed.set_footer(text=f'Page {page} of {num_pages}. Type {COMMAND_PREFIX}char mine {page % num_pages + 1} to see more')
+        return embed
+
+    async def _send_ranking(self, ctx: Context, title: str, entries: List[RankedCharacter]):
+        if not entries:
+            return await ctx.send(embed=info_embed(title=title, description='No characters have this attribute yet'))
+        description = '\n'.join(f'**{entry.rank}.** {entry.display_name}: {entry.value}' for entry in entries)
+        return await ctx.send(embed=info_embed(title=title, description=description))
+
+def setup(bot: Bot):
+    '''Extension entry point. Needs the cogs.services extension loaded first'''
+    bot.add_cog(CharacterController(bot, bot.get_cog('GameService'), bot.get_cog('CharacterService'), bot.get_cog('RankingService')))
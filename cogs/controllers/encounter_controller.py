@@ -0,0 +1,118 @@
+from typing import Optional
+from discord import Member
+from discord.ext import commands
+from discord.ext.commands import Bot, Context, CommandError, BadArgument, MissingRequiredArgument, guild_only
+from cogs.services import EncounterService
+from models.encounter import Encounter
+from util.embed_builder import COMMAND_PREFIX, info_embed, warning_embed, error_embed, send_generic_error, send_missing_arg_error
+from util.profiler import ProfiledCog
+
+MIN_TURN_SECONDS = 10
+MAX_TURN_SECONDS = 24 * 60 * 60
+
+class EncounterController(ProfiledCog):
+    def __init__(self, bot: Bot, encounter_service: EncounterService):
+        self.bot = bot
+        self.encounter_service = encounter_service
+
+    @commands.group(aliases=['init'])
+    @guild_only()
+    async def encounter(self, ctx: Context):
+        '''
+        Track initiative and turns for a fight in this channel
+        '''
+        if ctx.invoked_subcommand is None:
+            embed = error_embed(title='Error! Missing subcommand', description=f'Try `{COMMAND_PREFIX}encounter start`')
+            return await ctx.send(embed=embed)
+
+    @encounter.command(name='start')
+    async def start(self, ctx: Context, turn_seconds: int = 0):
+        '''
+        Start an encounter in this channel, optionally with a time limit per turn, e.g. `encounter start 60`
+        '''
+        if self.encounter_service.find_by_channel(ctx.channel.id):
+            embed = warning_embed(title='An encounter is already running in this channel', description=f'End it first with `{COMMAND_PREFIX}encounter end`')
+            return await ctx.send(embed=embed)
+        if turn_seconds and not MIN_TURN_SECONDS <= turn_seconds <= MAX_TURN_SECONDS:
+            embed = error_embed(title=f'Error! Turn time limits must be between {MIN_TURN_SECONDS} and {MAX_TURN_SECONDS} seconds')
+            return await ctx.send(embed=embed)
+
+        self.encounter_service.start(ctx.guild.id, ctx.channel.id, turn_seconds)
+        limit = f' with {turn_seconds} seconds per turn' if turn_seconds else ''
+        embed = info_embed(title=f'Encounter started{limit}!', description=f'Add combatants with `{COMMAND_PREFIX}encounter add <initiative> <name>`, then begin with `{COMMAND_PREFIX}encounter next`')
+        return await ctx.send(embed=embed)
+
+    @encounter.command(name='add', aliases=['join'])
+    async def add(self, ctx: Context, initiative: int, player: Optional[Member] = None, *, name: str):
+        '''
+        Add a combatant to the turn order, e.g. `encounter add 17 Goblin` or `encounter add 12 @player Gandalf`
+        '''
+        encounter = await self._find_encounter(ctx)
+        if not encounter:
+            return
+        self.encounter_service.add_combatant(encounter, name, initiative, player.id if player else None)
+        return await ctx.send(embed=self._turn_order_embed(encounter, title=f'{name} joined with initiative {initiative}'))
+
+    @encounter.command(name='next')
+    async def next(self, ctx: Context):
+        '''
+        End the current turn and move on to the next combatant
+        '''
+        encounter = await self._find_encounter(ctx)
+        if not encounter:
+            return
+        current = self.encounter_service.next_turn(encounter)
+        if not current:
+            return await ctx.send(embed=warning_embed(title='Nobody has joined the encounter yet'))
+        embed = info_embed(title=f'Round {encounter.round}: {current.display_name}, your turn')
+        return await ctx.send(content=f'<@{current.player_id}>' if current.player_id else None, embed=embed)
+
+    @encounter.command(name='show', aliases=['order'])
+    async def show(self, ctx: Context):
+        '''
+        Show the turn order
+        '''
+        encounter = await self._find_encounter(ctx)
+        if not encounter:
+            return
+        return await ctx.send(embed=self._turn_order_embed(encounter, title=f'Round {encounter.round}'))
+
+    @encounter.command(name='end', aliases=['stop'])
+    async def end(self, ctx: Context):
+        '''
+        End the encounter in this channel
+        '''
+        encounter = await self._find_encounter(ctx)
+        if not encounter:
+            return
+        self.encounter_service.end(encounter)
+        return await ctx.send(embed=info_embed(title=f'Encounter ended after {encounter.round} rounds'))
+
+    @start.error
+    @add.error
+    async def encounter_error(self, ctx: Context, error: CommandError):
+        if isinstance(error, MissingRequiredArgument):
+            return await send_missing_arg_error(ctx, error)
+        elif isinstance(error, BadArgument):
+            return await ctx.send(embed=error_embed(title='Error! Initiative and turn times must be whole numbers', description=f'For example `{COMMAND_PREFIX}encounter add 17 Goblin`'))
+        else:
+            return await send_generic_error(ctx, error=error)
+
+    async def _find_encounter(self, ctx: Context) -> Optional[Encounter]:
+        encounter = self.encounter_service.find_by_channel(ctx.channel.id)
+        if not encounter:
+            embed = error_embed(title='No encounter in this channel', description=f'Start one with `{COMMAND_PREFIX}encounter start`')
+            await ctx.send(embed=embed)
+        return encounter
+
+    def _turn_order_embed(self, encounter: Encounter, title: str):
+        if not encounter.combatants:
+            return info_embed(title=title, description='Nobody has joined yet')
+        started = encounter.turn_count > 0
+        lines = [f'{"▶ " if started and i == encounter.turn_index else ""}**{combatant.initiative}** {combatant.display_name}'
+            for i, combatant in enumerate(encounter.combatants)]
+        return info_embed(title=title, description='\n'.join(lines))
+
+def setup(bot: Bot):
+    '''Extension entry point. Needs the cogs.services extension loaded first'''
+    bot.add_cog(EncounterController(bot, bot.get_cog('EncounterService')))
@@ -1,27 +1,49 @@
 import asyncio
+import re
 from discord import Message, TextChannel, CategoryChannel
 from discord import User
 from discord import Reaction
 from discord.ext import commands
-from discord.ext.commands import Bot, Context, MissingRequiredArgument, CommandError, guild_only
+from discord.ext.commands import Bot, Context, MissingRequiredArgument, CommandError, guild_only, has_guild_permissions
 from typing import List, Optional
 
 from pydantic import ValidationError
-from cogs.services import GameService
+from cogs.services import GameService, SummaryService, AuditService, BackupService, ArchivedGame
 from converters import GameConverter, GameNotFoundError, send_game_not_found
 from models.game import Game
-from subcogs import GameChannelController
+from subcogs import GameChannelController, GameBackupController
 from util.embed_builder import COMMAND_PREFIX, info_embed, warning_embed, error_embed, send_generic_error
-
-class GameController(commands.Cog):
-    def __init__(self, bot: Bot, game_service: GameService):
+from util.profiler import ProfiledCog
+
+HISTORY_PAGE_SIZE = 10
+HISTORY_ID_PATTERN = re.compile(r'\d+-\d+')  # Redis stream entry IDs
+HISTORY_ACTION_TEXT = {
+    'game.create': 'created game',
+    'game.delete': 'deleted game',
+    'game.archive': 'archived inactive game',
+    'game.restore': 'restored archived game',
+    'channel.use': 'set a default channel for',
+    'channel.delete': 'removed a default channel from',
+    'category.use': 'set a default category for',
+    'category.delete': 'removed a default category from',
+    'character.create': 'created a character in',
+    'character.import': 'imported characters into',
+    'guild.import': 'imported a backup',
+}
+
+class GameController(ProfiledCog):
+    def __init__(self, bot: Bot, game_service: GameService, summary_service: SummaryService, audit_service: AuditService, backup_service: BackupService):
         self.bot = bot
         self.game_service = game_service
+        self.summary_service = summary_service
+        self.audit_service = audit_service
         self.game_channel_controller = GameChannelController(bot=self.bot, game_service=self.game_service)
+        self.game_backup_controller = GameBackupController(bot=self.bot, backup_service=backup_service)
 
     async def cog_after_invoke(self, ctx: Context):
         '''Special function called after all commands in this cog'''
         await self.game_channel_controller.category_after_invoke(ctx)
+        await super().cog_after_invoke(ctx)
 
     @commands.group()
     @guild_only()
@@ -39,23 +61,27 @@ class GameController(commands.Cog):
         List all games on this server
         '''
         games = self.game_service.find_by_guild(ctx.guild)
-        if not games:
+        archived = self.game_service.find_archived(ctx.guild)
+        if not games and not archived:
             return await self._send_no_games(ctx)
-        return await self._send_games_list(ctx, games)
+        return await self._send_games_list(ctx, games, archived)
 
     @game.command(name='show', aliases=['about', 'display'])
     async def show(self, ctx: Context, game: Optional[GameConverter]):
         '''
         Get details about a game
         '''
+        summary = self.summary_service.find_by_game(game)
         created_ts_str = game.created_ts.strftime("%Y-%m-%d %H:%M:%S")
         description = f'_{created_ts_str}_'
 
         embed = info_embed(title=game.display_name, description=description)
         embed.add_field(name='Type', value=game.type, inline=True)
+        embed.add_field(name='Characters', value=str(summary.character_count), inline=True)
         embed.add_field(name='Default in',value='Default game in **{}** channels\nDefault game in **{}** categories'.format(
-            len(game.text_channel_ids) if game.text_channel_ids else 0,
-            len(game.category_ids) if game.category_ids else 0))
+            summary.channel_count, summary.category_count))
+        if summary.last_activity_ts:
+            embed.add_field(name='Last active', value=summary.last_activity_ts.strftime("%Y-%m-%d %H:%M:%S"), inline=True)
         embed.set_footer(text=f'ID: {game.pk}')
 
         return await ctx.send(embed=embed)
@@ -74,6 +100,53 @@ class GameController(commands.Cog):
             print("Command game show says help! Some totally different error here!", error)
             raise error
 
+    @game.command(name='stats', aliases=['summary'])
+    async def stats(self, ctx: Context):
+        '''
+        Get totals for all games on this server
+        '''
+        summary = self.summary_service.find_by_guild(ctx.guild.id)
+
+        embed = info_embed(title=f'Stats for {ctx.guild.name}')
+        embed.add_field(name='Games', value=str(summary.game_count), inline=True)
+        embed.add_field(name='Characters', value=str(summary.character_count), inline=True)
+        embed.add_field(name='Default in', value=f'**{summary.channel_count}** channels\n**{summary.category_count}** categories', inline=True)
+        if summary.last_activity_ts:
+            embed.set_footer(text='Last active ' + summary.last_activity_ts.strftime("%Y-%m-%d %H:%M:%S"))
+
+        return await ctx.send(embed=embed)
+
+    @game.command(name='history', aliases=['log', 'audit'])
+    async def history(self, ctx: Context, before: Optional[str]):
+        '''
+        Show recent changes to games on this server, newest first.
+        To see older changes, give the ID shown at the bottom of the previous page
+        '''
+        if before and not HISTORY_ID_PATTERN.fullmatch(before):
+            embed = error_embed(title=f'Error! {before} is not a history ID', description=f'Use the ID shown at the bottom of `{COMMAND_PREFIX}game history`')
+            return await ctx.send(embed=embed)
+
+        entries = await self.audit_service.find_by_guild(ctx.guild.id, before=before, page_size=HISTORY_PAGE_SIZE)
+        if not entries:
+            title = 'No changes recorded yet!' if not before else 'No older changes'
+            return await ctx.send(embed=info_embed(title=title))
+
+        lines = []
+        for entry in entries:
+            actor = f'<@{entry.actor_id}>' if entry.actor_id else 'Someone'
+            action = HISTORY_ACTION_TEXT.get(entry.action, entry.action)
+            line = f'<t:{int(entry.timestamp)}:f> {actor} {action}'
+            if entry.game_name:
+                line += f' **{entry.game_name}**'
+            if entry.details:
+                line += f': {entry.details}'
+            lines.append(line)
+
+        embed = info_embed(title=f'History for {ctx.guild.name}', description='\n'.join(lines)[:4000])
+        if len(entries) == HISTORY_PAGE_SIZE:
+            embed.set_footer(text=f'Type {COMMAND_PREFIX}game history {entries[-1].id} to see older changes')
+        return await ctx.send(embed=embed)
+
     @game.command(name='create', aliases=['add', 'new'])
     async def create(self, ctx: Context, name: Optional[str]):
         '''
@@ -132,13 +205,19 @@ class GameController(commands.Cog):
 
         user_response_message_task = asyncio.create_task(self.bot.wait_for('message', check=check_message))
         user_react_task = asyncio.create_task(self.bot.wait_for('reaction_add', check=check_cancelled))
-        task_options = {user_response_message_task, user_react_task}
+        # A shutdown doesn't wait out the confirmation, the user is told to try again instead
+        shutdown_task = asyncio.create_task(self.bot.wait_until_shutdown())
+        task_options = {user_response_message_task, user_react_task, shutdown_task}
         done_tasks, pending_tasks = await asyncio.wait(task_options, timeout=delete_confirm_timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending_tasks:
+            task.cancel()
 
         if user_response_message_task in done_tasks:
             user_response_message = user_response_message_task.result()
         elif user_react_task in done_tasks:
             await self._update_delete_cancelled(message=warning_message, game_name=display_name, cancel_reason=f'{delete_cancel_emoji} has been pressed.')    
+        elif shutdown_task in done_tasks:
+            await self._update_delete_cancelled(message=warning_message, game_name=display_name, cancel_reason="I'm restarting.")
         elif len(pending_tasks) == len(task_options):
             # No option chosen after timeout
             await self._update_delete_cancelled(message=warning_message, game_name=display_name, cancel_reason=f'No action taken after {delete_confirm_timeout} seconds.')
@@ -159,6 +238,30 @@ class GameController(commands.Cog):
         else:
             return await send_generic_error(ctx, error=error)
 
+    @game.command(name='export', aliases=['backup'])
+    @has_guild_permissions(administrator=True)
+    async def export_games(self, ctx: Context):
+        '''
+        Export all games and characters on this server to a file
+        '''
+        return await self.game_backup_controller.export_games(ctx)
+
+    @export_games.error
+    async def export_games_error(self, ctx: Context, error: CommandError):
+        return await self.game_backup_controller.backup_error(ctx=ctx, error=error)
+
+    @game.command(name='import', aliases=['restore'])
+    @has_guild_permissions(administrator=True)
+    async def import_games(self, ctx: Context):
+        '''
+        Import games and characters from a file attached to the message, made with the export command
+        '''
+        return await self.game_backup_controller.import_games(ctx)
+
+    @import_games.error
+    async def import_games_error(self, ctx: Context, error: CommandError):
+        return await self.game_backup_controller.backup_error(ctx=ctx, error=error)
+
     @game.group(name='channel', aliases=['textchannel'])
     async def channel(self, ctx: Context):
         '''Manage default games assigned per channel'''
@@ -256,14 +359,14 @@ class GameController(commands.Cog):
         embed.set_footer(text="See you real soon, pard'ner")
         await ctx.send(embed=embed)
     
-    async def _send_games_list(self, ctx: Context, games: List[Game]):
+    async def _send_games_list(self, ctx: Context, games: List[Game], archived: List[ArchivedGame]):
         # Guild name. Truncate to 20 characters if name is excessively long
         # FIXME: Extract into helper and apply universally
         guild_name = ctx.guild.name
         if len(guild_name) > 20:
             guild_name = guild_name[:17] + '...'
         
-        num_games = len(games)
+        num_games = len(games) + len(archived)
         title = f'{guild_name} has {num_games} game{"s" if num_games != 1 else ""}'
         description = 'Type `{}game show <name>` to learn more about a game\n'.format(COMMAND_PREFIX)
         embed = info_embed(title=title, description=description)
@@ -280,7 +383,13 @@ class GameController(commands.Cog):
                 footer = f"Wow that's a lot of games. Delete some with `{COMMAND_PREFIX}game delete <name>`"
                 break
 
-        embed.add_field(name=field_name, value=field_value, inline=False)
+        if field_value:
+            embed.add_field(name=field_name, value=field_value, inline=False)
+        if archived and not footer:
+            # Archived games come back as soon as they're used
+            archived_value = '\n'.join(f'- {game.display_name}' for game in archived)
+            if len(embed) + len(archived_value) <= 5930:
+                embed.add_field(name='Archived (inactive):', value=archived_value[:1024], inline=False)
 
         if footer:
             embed.set_footer(text=footer)
@@ -317,3 +426,7 @@ class GameController(commands.Cog):
         delete_stopped_embed = warning_embed(title=delete_stopped_title, description=delete_stopped_description)
         await message.edit(embed=delete_stopped_embed)
         await message.remove_reaction('🚫', self.bot.user)
+
+def setup(bot: Bot):
+    '''Extension entry point. Needs the cogs.services extension loaded first'''
+    bot.add_cog(GameController(bot, bot.get_cog('GameService'), bot.get_cog('SummaryService'), bot.get_cog('AuditService'), bot.get_cog('BackupService')))
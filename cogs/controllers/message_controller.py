@@ -37,3 +37,6 @@ class MessageController(commands.Cog):
         if response:
             return await message.channel.send(response)
 
+def setup(bot: Bot):
+    '''Extension entry point. Needs the cogs.services extension loaded first'''
+    bot.add_cog(MessageController(bot, bot.get_cog('SentimentService')))
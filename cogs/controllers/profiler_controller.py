@@ -0,0 +1,52 @@
+from discord.ext import commands
+from discord.ext.commands import Bot, Context
+from util.embed_builder import info_embed, warning_embed
+from util.profiler import profiler, profile_summary_embed, PROFILER_INTERVAL_MS, ProfiledCog
+
+class ProfilerController(commands.Cog):
+    '''Owner only commands to profile other commands on the live bot, see util.profiler'''
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+    async def cog_check(self, ctx: Context):
+        return await self.bot.is_owner(ctx.author)
+
+    @commands.group(name='profile', invoke_without_command=True)
+    async def profile(self, ctx: Context):
+        await self.profile_status(ctx)
+
+    @profile.command(name='start')
+    async def profile_start(self, ctx: Context, target: str, invocations: int = 10):
+        '''Profile the next invocations of a command (e.g. "game list") or of every command in a cog (e.g. GameController)'''
+        if profiler.enabled:
+            return await ctx.send(embed=warning_embed(title=f'Already profiling {profiler.target}', description='Stop it first'))
+        command = self.bot.get_command(target)
+        cog = command.cog if command else self.bot.get_cog(target)
+        if not command and not cog:
+            return await ctx.send(embed=warning_embed(title=f'There is no command or cog named {target}'))
+        if not isinstance(cog, ProfiledCog):
+            return await ctx.send(embed=warning_embed(title=f"{target} can't be profiled", description='Only commands of controllers extending ProfiledCog can'))
+
+        profiler.start(target, max(invocations, 1))
+        await ctx.send(embed=info_embed(title=f'Profiling the next {profiler.remaining} runs of {target}',
+            description=f'Sampling every {PROFILER_INTERVAL_MS:g}ms'))
+
+    @profile.command(name='stop')
+    async def profile_stop(self, ctx: Context):
+        if not profiler.enabled:
+            return await ctx.send(embed=warning_embed(title='Nothing is being profiled'))
+        path = await profiler.stop()
+        if path is None:
+            return await ctx.send(embed=info_embed(title='Profile stopped', description='No samples were taken'))
+        await ctx.send(embed=profile_summary_embed(path))
+
+    @profile.command(name='status')
+    async def profile_status(self, ctx: Context):
+        if not profiler.enabled:
+            return await ctx.send(embed=info_embed(title='Nothing is being profiled'))
+        await ctx.send(embed=info_embed(title=f'Profiling {profiler.target}',
+            description=f'{profiler.num_profiled} runs done, {profiler.remaining} to go, {sum(profiler.stacks.values())} samples'))
+
+def setup(bot: Bot):
+    '''Extension entry point'''
+    bot.add_cog(ProfilerController(bot))
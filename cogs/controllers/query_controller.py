@@ -0,0 +1,78 @@
+from discord import Embed
+from discord.ext import commands
+from discord.ext.commands import Bot, Context
+from util.embed_builder import info_embed, warning_embed
+from util.metrics import metrics
+from util.query_tracer import query_tracer, QUERY_SLOW_MS
+from util.profiler import ProfiledCog
+
+MAX_QUERIES_SHOWN = 10
+MAX_EMBED_LENGTH = 5930  # Discord's limit is 6000 characters per embed, leaving room for the footer
+SHAPE_SORT_KEYS = {'total': 'total', 'avg': 'average', 'average': 'average', 'max': 'max'}
+
+class QueryController(ProfiledCog):
+    '''Owner only commands to see which RediSearch queries are slow, see util.query_tracer'''
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+    async def cog_check(self, ctx: Context):
+        return await self.bot.is_owner(ctx.author)
+
+    @commands.group(name='queries', invoke_without_command=True)
+    async def queries(self, ctx: Context):
+        await self.queries_slow(ctx)
+
+    @queries.command(name='slow')
+    async def queries_slow(self, ctx: Context, count: int = MAX_QUERIES_SHOWN):
+        '''The slowest recent queries over QUERY_SLOW_MS, with their full query text'''
+        slow = query_tracer.slowest(min(count, MAX_QUERIES_SHOWN))
+        if not slow:
+            return await ctx.send(embed=info_embed(title=f'No queries slower than {QUERY_SLOW_MS:g}ms yet'))
+        embed = info_embed(title=f'Slowest queries over {QUERY_SLOW_MS:g}ms')
+        for shown, query in enumerate(slow):
+            name = f'{query.duration * 1000:.1f}ms {query.model}, {query.num_results} results <t:{int(query.timestamp)}:R>'
+            value = f'`{query.query[:900]}` {query.options}'
+            if not self._add_field(embed, name, value, num_left=len(slow) - shown):
+                break
+        await ctx.send(embed=embed)
+
+    @queries.command(name='top')
+    async def queries_top(self, ctx: Context, sort: str = 'total', count: int = MAX_QUERIES_SHOWN):
+        '''Queries grouped by shape, by total, avg or max time'''
+        key = SHAPE_SORT_KEYS.get(sort.casefold())
+        if key is None:
+            return await ctx.send(embed=warning_embed(title=f'Sort by one of {", ".join(SHAPE_SORT_KEYS)}'))
+        shapes = query_tracer.top_shapes(min(count, MAX_QUERIES_SHOWN), key=key)
+        if not shapes:
+            return await ctx.send(embed=info_embed(title='No queries traced yet'))
+        embed = info_embed(title=f'Queries by {sort} time')
+        for shown, shape in enumerate(shapes):
+            name = f'{shape.model}: {shape.count} runs, avg {shape.average * 1000:.1f}ms, max {shape.max * 1000:.1f}ms, ' \
+                f'{shape.num_results / shape.count:.1f} results'
+            if not self._add_field(embed, name, f'`{shape.shape[:900]}`', num_left=len(shapes) - shown):
+                break
+        await ctx.send(embed=embed)
+
+    @queries.command(name='stats')
+    async def queries_stats(self, ctx: Context):
+        '''Query metrics since startup'''
+        values = {name: value for name, value in metrics.snapshot().items() if name.startswith('query.')}
+        description = '\n'.join(f'{name}: {value:g}' for name, value in sorted(values.items()))
+        await ctx.send(embed=info_embed(title='Query metrics', description=description[:4000] or 'No queries traced yet'))
+
+    @queries.command(name='reset')
+    async def queries_reset(self, ctx: Context):
+        query_tracer.reset()
+        await ctx.send(embed=info_embed(title='Query traces cleared'))
+
+    def _add_field(self, embed: Embed, name: str, value: str, num_left: int) -> bool:
+        '''Add the field if the embed stays under Discord's length limit, otherwise say how many queries didn't fit'''
+        if len(embed) + len(name) + len(value) > MAX_EMBED_LENGTH:
+            embed.set_footer(text=f'{num_left} more not shown, they would not fit in one message')
+            return False
+        embed.add_field(name=name, value=value, inline=False)
+        return True
+
+def setup(bot: Bot):
+    '''Extension entry point'''
+    bot.add_cog(QueryController(bot))
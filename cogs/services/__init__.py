@@ -1,3 +1,49 @@
+from .summary_service import *
+from .ranking_service import *
+from .audit_service import *
+from .archive_service import *
+from .character_write_buffer import *
 from .game_service import *
 from .character_service import *
-from .sentiment_service import *
\ No newline at end of file
+from .sentiment_service import *
+from .backup_service import *
+from .timer_service import *
+from .encounter_service import *
+from .replica_service import *
+
+def setup(bot):
+    '''
+    Extension entry point for bot.load_extension('cogs.services').
+    Services depend on each other, so they are built here in dependency order. Load before any controller extensions.
+    Building them is cheap, none of them touch Redis or the network until used (SentimentService opens its HTTP session on
+    first use), so they aren't deferred. Start-up time goes on importing discord.py, pydantic and redis_om, which every service needs
+    '''
+    summary_service = SummaryService()
+    bot.add_cog(summary_service)
+    audit_service = AuditService()
+    bot.add_cog(audit_service)
+    bot.before_invoke(set_current_actor)
+    ranking_service = RankingService()
+    bot.add_cog(ranking_service)
+    write_buffer = None
+    if ATTRIBUTE_WRITE_BEHIND:
+        write_buffer = CharacterWriteBuffer(ranking_service, summary_service)
+        bot.add_cog(write_buffer)
+    archive_service = ArchiveService(summary_service, audit_service, ranking_service, write_buffer)
+    bot.add_cog(archive_service)
+    game_service = GameService(summary_service, audit_service, ranking_service, archive_service)
+    bot.add_cog(game_service)
+    character_service = CharacterService(bot, summary_service, audit_service, ranking_service, write_buffer)
+    bot.add_cog(character_service)
+    bot.add_cog(BackupService(summary_service, game_service, character_service, audit_service, ranking_service, archive_service))
+    bot.add_cog(SentimentService(bot))
+    timer_service = TimerService()
+    bot.add_cog(timer_service)
+    bot.add_cog(EncounterService(bot, timer_service))
+    if read_router.enabled:
+        bot.add_cog(ReplicaService())
+
+def teardown(bot):
+    '''Cogs from this package are removed by unload_extension, only the global hook is left to undo'''
+    if bot._before_invoke is set_current_actor:
+        bot._before_invoke = None
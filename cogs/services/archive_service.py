@@ -0,0 +1,260 @@
+'''
+Cold storage for games nobody has touched in ARCHIVE_AFTER_DAYS
+
+An archived game and its characters are compressed into one string key (pr:archive:game:<pk>) in the backup file format,
+and the documents, attribute hashes and rankings are deleted, which also drops them from the search indexes. A small stub per
+game (name and default channels) stays in a hash per guild (pr:archive:guild:<guild id>) so GameService can still find the
+game by name, channel or category, and restores it on first access.
+
+Activity comes from the game summary's last_activity_ts (see SummaryService), which every game, character and attribute
+write updates. Run python manage.py archive to archive by hand, tools/archive_bench.py to measure memory and restore time.
+'''
+import asyncio
+import base64
+import datetime
+import json
+import os
+import time
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from discord.ext import commands, tasks
+from redis import Redis, WatchError
+from redis_om import NotFoundError
+from cogs.services.audit_service import AuditService
+from cogs.services.character_write_buffer import CharacterWriteBuffer
+from cogs.services.ranking_service import RankingService
+from cogs.services.summary_service import SummaryService
+from models.attribute_store import HashAttributeStore, attribute_store
+from models.character import Character
+from models.game import Game
+from util.metrics import metrics
+
+ARCHIVE_KEY_PREFIX = 'pr:archive'
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', 180))  # 0 turns off automatic archiving
+ARCHIVE_INTERVAL_HOURS = float(os.getenv('ARCHIVE_INTERVAL_HOURS', 24))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 100))
+
+class ArchivedGame(NamedTuple):
+    '''What stays searchable of an archived game'''
+    pk: str
+    display_name: str
+    search_name: str
+    text_channel_ids: List[str]
+    category_ids: List[str]
+    last_activity_ts: float
+
+class ArchiveResult:
+    def __init__(self):
+        self.games = 0
+        self.bytes_reclaimed = 0
+
+class ArchiveService(commands.Cog):
+    def __init__(self, summary_service: SummaryService, audit_service: Optional[AuditService] = None,
+            ranking_service: Optional[RankingService] = None, write_buffer: Optional[CharacterWriteBuffer] = None):
+        self.summary_service = summary_service
+        self.audit_service = audit_service
+        self.ranking_service = ranking_service
+        self.write_buffer = write_buffer
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if ARCHIVE_AFTER_DAYS and not self.archive_loop.is_running():
+            self.archive_loop.start()
+
+    def cog_unload(self):
+        self.archive_loop.cancel()
+
+    def guild_key(self, guild_id: int) -> str:
+        return f'{ARCHIVE_KEY_PREFIX}:guild:{guild_id}'
+
+    def game_key(self, game_pk: str) -> str:
+        return f'{ARCHIVE_KEY_PREFIX}:game:{game_pk}'
+
+    def find_by_guild(self, guild_id: int) -> List[ArchivedGame]:
+        return self.parse_stubs(self._db().hgetall(self.guild_key(guild_id)))
+
+    def parse_stubs(self, fields: Dict[str, str]) -> List[ArchivedGame]:
+        '''Archived games from the fields of a guild's archive hash, for callers that fetched it themselves'''
+        return [ArchivedGame(pk=pk, **json.loads(stub)) for pk, stub in fields.items()]
+
+    def find_by_channel(self, stubs: List[ArchivedGame], channel_id: Optional[int], category_id: Optional[int] = None) -> Optional[ArchivedGame]:
+        '''The archived game using the channel as its default, falling back to the one using the category'''
+        for archived in stubs:
+            if str(channel_id) in archived.text_channel_ids:
+                return archived
+        if category_id:
+            for archived in stubs:
+                if str(category_id) in archived.category_ids:
+                    return archived
+        return None
+
+    @tasks.loop(hours=ARCHIVE_INTERVAL_HOURS)
+    async def archive_loop(self):
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, self.archive_inactive)
+        except Exception as error:
+            print(f'Error! Could not archive inactive games: {error}')
+            return
+        if result.games:
+            print(f'Archived {result.games} inactive games, reclaiming {result.bytes_reclaimed // 1024} KiB')
+
+    def archive_inactive(self, inactive_days: float = ARCHIVE_AFTER_DAYS, guild_id: Optional[int] = None) -> ArchiveResult:
+        '''Archive every game with no activity in the last inactive_days days'''
+        cutoff = time.time() - inactive_days * 24 * 60 * 60
+        query = Game.find(Game.guild_id == guild_id) if guild_id is not None else Game.find()
+
+        # Find every candidate before archiving any, since archiving removes games from the index and would shift the pages
+        candidates: List[Game] = []
+        offset = 0
+        while True:
+            games = query.copy(offset=offset, limit=ARCHIVE_BATCH_SIZE).execute(exhaust_results=False)
+            if not games:
+                break
+            candidates.extend(game for game in games if self._last_activity(game) < cutoff)
+            offset += ARCHIVE_BATCH_SIZE
+
+        result = ArchiveResult()
+        for game in candidates:
+            bytes_reclaimed = self.archive(game, cutoff)
+            if bytes_reclaimed is not None:
+                result.games += 1
+                result.bytes_reclaimed += bytes_reclaimed
+        return result
+
+    def archive(self, game: Game, inactive_since: Optional[float] = None) -> Optional[int]:
+        '''
+        Move the game and its characters into cold storage. Returns the bytes of Redis memory reclaimed, or None if the game
+        was changed or removed meanwhile, has been active after inactive_since, or has attribute changes not saved yet
+        '''
+        if self.write_buffer and self.write_buffer.has_changes(game.pk):
+            # Buffered changes don't touch the watched keys until they are saved, and would be saved outside the archive
+            return None
+        db = self._db()
+        summary_key = self.summary_service.game_key(game.pk)
+        with db.pipeline() as pipeline:
+            try:
+                # Any write to the game or its characters updates the game or its summary, which aborts the transaction
+                pipeline.watch(game.key(), summary_key)
+                if inactive_since is not None and self._last_activity(game) >= inactive_since:
+                    return None
+                characters = attribute_store.load(Character.find(Character.game_id == game.pk).all())
+                keys = [game.key()] + [character.key() for character in characters]
+                # Attribute hashes are removed whichever storage is in use, in case it was switched at some point
+                keys += [HashAttributeStore().key(character.pk) for character in characters]
+                if self.ranking_service:
+                    keys += [self.ranking_service.attributes_key(game.pk)] + \
+                        [self.ranking_service.key(game.pk, name) for name in db.smembers(self.ranking_service.attributes_key(game.pk))]
+                bytes_before = self._memory_usage(keys)
+
+                blob = self._pack(game, characters)
+                stub = {'display_name': game.display_name, 'search_name': game.search_name, 'text_channel_ids': game.text_channel_ids or [],
+                    'category_ids': game.category_ids or [], 'last_activity_ts': self._last_activity(game)}
+
+                pipeline.multi()
+                pipeline.set(self.game_key(game.pk), blob)
+                pipeline.hset(self.guild_key(game.guild_id), game.pk, json.dumps(stub))
+                self.summary_service.record_game_deleted(pipeline, game)
+                pipeline.delete(*keys)
+                pipeline.execute()
+            except WatchError:
+                return None
+
+        bytes_reclaimed = bytes_before - self._memory_usage([self.game_key(game.pk)])
+        metrics.increment('archive.games_archived')
+        metrics.increment('archive.bytes_reclaimed', bytes_reclaimed)
+        if self.audit_service:
+            self.audit_service.record(game.guild_id, 'game.archive', game=game)
+        return bytes_reclaimed
+
+    def restore(self, guild_id: int, game_pk: str) -> Optional[Game]:
+        '''Bring an archived game and its characters back. Returns None if the game isn't archived or doesn't exist'''
+        start = time.perf_counter()
+        db = self._db()
+        with db.pipeline() as pipeline:
+            try:
+                # Only one caller, in any process, gets to restore the game. The others find it already restored
+                pipeline.watch(self.game_key(game_pk))
+                blob = pipeline.get(self.game_key(game_pk))
+                if blob is None:
+                    game = self._find_restored(game_pk)
+                    if game is None:
+                        # The stub outlived its archive (e.g. the key was deleted by hand), drop it so it stops being listed
+                        db.hdel(self.guild_key(guild_id), game_pk)
+                    return game
+                game, characters = self._unpack(blob)
+
+                pipeline.multi()
+                game.save(pipeline=pipeline)
+                for character in characters:
+                    attribute_store.save(character, pipeline=pipeline)
+                    if self.ranking_service:
+                        self.ranking_service.record_character(pipeline, character)
+                self.summary_service.record_change(pipeline, game, games=1, characters=len(characters),
+                    channels=len(game.text_channel_ids or []), categories=len(game.category_ids or []))
+                pipeline.delete(self.game_key(game_pk))
+                pipeline.hdel(self.guild_key(guild_id), game_pk)
+                pipeline.execute()
+            except WatchError:
+                return self._find_restored(game_pk)
+
+        metrics.observe('archive.restore', time.perf_counter() - start)
+        if self.audit_service:
+            self.audit_service.record(guild_id, 'game.restore', game=game)
+        return game
+
+    def iter_documents(self, guild_id: int) -> Iterator[str]:
+        '''Backup file lines of every archived game in the guild and its characters, for exports'''
+        for archived in self.find_by_guild(guild_id):
+            blob = self._db().get(self.game_key(archived.pk))
+            if blob:
+                yield from zlib.decompress(base64.b64decode(blob)).decode('utf-8').splitlines()
+
+    def discard(self, guild_id: int, game_pks: List[str]):
+        '''Drop archived copies of games that have been saved again some other way, e.g. by a backup import'''
+        if not game_pks:
+            return
+        pipeline = self._db().pipeline()
+        pipeline.delete(*(self.game_key(game_pk) for game_pk in game_pks))
+        pipeline.hdel(self.guild_key(guild_id), *game_pks)
+        pipeline.execute()
+
+    def _pack(self, game: Game, characters: List[Character]) -> str:
+        # Same line format as backups, so exports can copy archived games out as they are
+        lines = [json.dumps({'model': 'game', 'document': json.loads(game.json())})]
+        lines += [json.dumps({'model': 'character', 'document': json.loads(character.json())}) for character in characters]
+        # Base64 since the connection decodes every response as text
+        return base64.b64encode(zlib.compress('\n'.join(lines).encode('utf-8'), 9)).decode('ascii')
+
+    def _unpack(self, blob: str):
+        game = None
+        characters = []
+        for line in zlib.decompress(base64.b64decode(blob)).decode('utf-8').splitlines():
+            entry = json.loads(line)
+            if entry['model'] == 'game':
+                game = Game.parse_obj(entry['document'])
+            else:
+                characters.append(Character.parse_obj(entry['document']))
+        return game, characters
+
+    def _find_restored(self, game_pk: str) -> Optional[Game]:
+        try:
+            return Game.get(game_pk)
+        except NotFoundError:
+            return None
+
+    def _memory_usage(self, keys: List[str]) -> int:
+        pipeline = self._db().pipeline(transaction=False)
+        for key in keys:
+            pipeline.memory_usage(key)
+        return sum(size or 0 for size in pipeline.execute())  # None for keys that don't exist
+
+    def _last_activity(self, game: Game) -> float:
+        last_activity = self._db().hget(self.summary_service.game_key(game.pk), 'last_activity_ts')
+        if last_activity:
+            return float(last_activity)
+        # Games from before summaries were added
+        created_ts = game.created_ts or datetime.datetime.now(datetime.timezone.utc)
+        return created_ts.timestamp()
+
+    def _db(self) -> Redis:
+        return Game.db()
@@ -0,0 +1,107 @@
+import collections
+import os
+import time
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+from discord.ext import commands, tasks
+from discord.ext.commands import Context
+from models.game import Game
+from util.async_redis import get_async_redis
+from util.metrics import metrics
+
+AUDIT_KEY_PREFIX = 'pr:audit'
+AUDIT_MAX_LENGTH = int(os.getenv('AUDIT_MAX_LENGTH', 1000))  # Entries kept per guild, older ones are trimmed
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0))  # Seconds
+AUDIT_MAX_BUFFER = int(os.getenv('AUDIT_MAX_BUFFER', 10000))  # Entries held in memory before the oldest are dropped
+
+current_actor: ContextVar[Optional[int]] = ContextVar('current_actor', default=None)
+'''ID of the user whose command is running. Set once per command so services don't need the user passed in'''
+
+async def set_current_actor(ctx: Context):
+    '''Global before_invoke hook. Remembers who ran the command so service writes can be attributed to them in the history'''
+    current_actor.set(ctx.author.id)
+
+class AuditEntry:
+    def __init__(self, entry_id: str, fields: Dict[str, str]):
+        self.id = entry_id
+        self.timestamp = int(entry_id.split('-')[0]) / 1000  # Stream IDs start with the time in milliseconds
+        self.actor_id = int(fields['actor_id']) if fields.get('actor_id') else None
+        self.action = fields.get('action', '')
+        self.game_name = fields.get('game_name')
+        self.details = fields.get('details')
+
+# Append-only history of changes per guild, kept in capped Redis streams
+class AuditService(commands.Cog):
+    def __init__(self):
+        self._buffer: Deque[Tuple[int, Dict[str, str]]] = collections.deque(maxlen=AUDIT_MAX_BUFFER)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.flush_loop.is_running():
+            self.flush_loop.start()
+
+    def cog_unload(self):
+        self.flush_loop.cancel()
+
+    def record(self, guild_id: int, action: str, game: Optional[Game] = None, details: Optional[str] = None):
+        '''
+        Queue an entry for the guild's history. Never touches Redis, the entry is written by the next flush.
+        Safe to call from executor threads
+        '''
+        start = time.perf_counter()
+        fields = {'action': action}
+        actor_id = current_actor.get()
+        if actor_id:
+            fields['actor_id'] = str(actor_id)
+        if game:
+            fields['game_id'] = game.pk
+            fields['game_name'] = game.display_name
+        if details:
+            fields['details'] = details
+
+        self._buffer.append((guild_id, fields))
+        metrics.observe('audit.record', time.perf_counter() - start)
+
+    async def find_by_guild(self, guild_id: int, before: Optional[str] = None, page_size: int = 10) -> List[AuditEntry]:
+        '''Get a page of the guild's history, newest first, starting after the entry ID before (the last entry of the previous page)'''
+        entries = await get_async_redis().xrevrange(self.key(guild_id), max=f'({before}' if before else '+', count=page_size)
+        return [AuditEntry(entry_id, fields) for entry_id, fields in entries]
+
+    def key(self, guild_id: int) -> str:
+        return f'{AUDIT_KEY_PREFIX}:{guild_id}'
+
+    @tasks.loop(seconds=AUDIT_FLUSH_INTERVAL)
+    async def flush_loop(self):
+        try:
+            await self.flush()
+        except Exception as error:
+            # History is best effort, never let a Redis hiccup stop future flushes
+            print(f'Error! Could not write audit entries: {error}')
+
+    async def flush(self):
+        '''
+        Write all buffered entries in one pipelined round trip.
+        If Redis can't be reached the entries go back to the front of the buffer for the next flush. Entries Redis itself
+        rejects would be rejected again, so those are dropped and counted in audit.entries_failed
+        '''
+        if not self._buffer:
+            return
+
+        start = time.perf_counter()
+        entries = [self._buffer.popleft() for _ in range(len(self._buffer))]
+        pipeline = get_async_redis().pipeline(transaction=False)
+        for guild_id, fields in entries:
+            pipeline.xadd(self.key(guild_id), fields, maxlen=AUDIT_MAX_LENGTH, approximate=True)
+        try:
+            results = await pipeline.execute(raise_on_error=False)
+        except Exception:
+            # When the buffer is full, putting these back drops the newest entries instead
+            self._buffer.extendleft(reversed(entries))
+            raise
+
+        num_failed = sum(isinstance(result, Exception) for result in results)
+        if num_failed:
+            metrics.increment('audit.entries_failed', num_failed)
+            print(f'Error! Redis rejected {num_failed} audit entries: {next(result for result in results if isinstance(result, Exception))}')
+        metrics.increment('audit.entries_written', len(entries) - num_failed)
+        metrics.observe('audit.flush', time.perf_counter() - start)
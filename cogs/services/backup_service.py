@@ -0,0 +1,289 @@
+import json
+import os
+import zlib
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple, Type
+from discord.ext import commands
+from pydantic import ValidationError
+from redis.exceptions import ResponseError
+from cogs.services.character_service import CharacterService
+from cogs.services.game_service import GameService
+from cogs.services.summary_service import SummaryService
+from cogs.services.audit_service import AuditService
+from cogs.services.ranking_service import RankingService
+from cogs.services.archive_service import ArchiveService
+from models.base_model import BaseModel
+from models.attribute_store import attribute_store
+from models.character import Character
+from models.game import Game
+from util.name_builder import create_search_name, create_unique_name
+
+BACKUP_FORMAT = 'prism-backup'
+BACKUP_VERSION = 1
+BACKUP_BATCH_SIZE = int(os.getenv('BACKUP_BATCH_SIZE', 100))
+
+class BackupFormatError(Exception):
+    def __init__(self, message: str):
+        super().__init__(f'Invalid backup file: {message}')
+
+class ImportResult:
+    def __init__(self):
+        self.games = 0
+        self.characters = 0
+        self.game_ids: Set[str] = set()
+        self.renamed: List[Tuple[str, str]] = []  # (name in the file, display name given)
+        self.errors: List[str] = []
+
+class TakenNames:
+    '''Search names in use in the guild and in each imported game, mapped to the pk of the game or character using them'''
+    def __init__(self, games: Dict[str, str]):
+        self.games = games
+        self.characters: Dict[str, Dict[str, str]] = {}  # Game pk -> character search name -> character pk
+
+# Streaming export and import of a guild's data as newline-delimited JSON
+class BackupService(commands.Cog):
+    def __init__(self, summary_service: SummaryService, game_service: Optional[GameService] = None, character_service: Optional[CharacterService] = None,
+            audit_service: Optional[AuditService] = None, ranking_service: Optional[RankingService] = None,
+            archive_service: Optional[ArchiveService] = None):
+        self.summary_service = summary_service
+        self.ranking_service = ranking_service
+        self.archive_service = archive_service
+        self.audit_service = audit_service
+        self.game_service = game_service
+        self.character_service = character_service
+
+    def export_guild(self, guild_id: int, out: IO[str]) -> int:
+        '''
+        Write every game in the guild followed by its characters to out, one JSON document per line.
+        Documents are read in batches through RediSearch cursors so memory stays constant regardless of guild size.
+        Archived games are copied out of the archive without restoring them.
+        Returns the number of documents written
+        '''
+        out.write(json.dumps({'format': BACKUP_FORMAT, 'version': BACKUP_VERSION, 'guild_id': guild_id}) + '\n')
+
+        num_documents = 0
+        for games in self._iter_documents(Game, Game.find(Game.guild_id == guild_id).query):
+            for game_document in games:
+                self._write_document(out, 'game', game_document)
+                num_documents += 1
+
+                game_pk = json.loads(game_document)['pk']
+                for characters in self._iter_documents(Character, Character.find(Character.game_id == game_pk).query):
+                    for character_document in attribute_store.fill_documents(characters):
+                        self._write_document(out, 'character', character_document)
+                        num_documents += 1
+
+        if self.archive_service:
+            for line in self.archive_service.iter_documents(guild_id):
+                out.write(line + '\n')
+                num_documents += 1
+
+        return num_documents
+
+    def import_guild(self, lines: IO[str], guild_id: Optional[int] = None) -> ImportResult:
+        '''
+        Read a backup written by export_guild and save every document.
+        If guild_id is provided, games are moved into that guild (for migrating between servers).
+        Games restored into their own guild keep their pks. Any game or character whose pk belongs to another guild, live or
+        archived, is saved under a new pk instead, so a backup can never overwrite someone else's data. Characters are only
+        accepted for games earlier in the same file. Games and characters whose name is taken by another one are renamed.
+        Documents are validated and saved in pipelined batches. Invalid documents are reported in the result and skipped.
+        Raises BackupFormatError if the file can't be read. Seekable files are read through once before anything is saved,
+        so a truncated or corrupt file is rejected without importing part of it
+        '''
+        if lines.seekable():
+            for _ in self._read_lines(lines):
+                pass
+            lines.seek(0)
+        lines = self._read_lines(lines)
+
+        header = self._read_header(lines)
+        target_guild_id = guild_id if guild_id is not None else header['guild_id']
+
+        result = ImportResult()
+        game_pks: Dict[str, str] = {}  # Game pk in the file -> pk it was saved under
+        names = self._find_taken_names(target_guild_id)
+        batch: List[Tuple[int, BaseModel]] = []
+        for line_number, line in enumerate(lines, start=2):
+            if not line.strip():
+                continue
+
+            try:
+                model = self._parse_document(line, target_guild_id)
+            except (ValueError, ValidationError, BackupFormatError) as error:
+                result.errors.append(f'Line {line_number}: {error}')
+                continue
+
+            batch.append((line_number, model))
+            if len(batch) >= BACKUP_BATCH_SIZE:
+                self._save_batch(batch, target_guild_id, game_pks, names, result)
+                batch = []
+
+        self._save_batch(batch, target_guild_id, game_pks, names, result)
+        self._rebuild_mappings(target_guild_id, result.game_ids)
+        if self.audit_service:
+            self.audit_service.record(target_guild_id, 'guild.import', details=f'{result.games} games, {result.characters} characters')
+        return result
+
+    def _iter_documents(self, model: Type[BaseModel], query: str) -> Iterator[List[str]]:
+        '''Yield batches of raw JSON documents matching the query, using an FT.AGGREGATE cursor to page through keys'''
+        db = model.db()
+        index_name = model.Meta.index_name
+        response, cursor = db.execute_command('FT.AGGREGATE', index_name, query, 'LOAD', 1, '@__key',
+            'WITHCURSOR', 'COUNT', BACKUP_BATCH_SIZE)
+
+        while True:
+            # First entry is the number of results, each following entry is a ['__key', key] row
+            keys = [row[1] for row in response[1:]]
+            if keys:
+                documents = db.execute_command('JSON.MGET', *keys, '.')
+                yield [document for document in documents if document]
+
+            if not cursor:
+                return
+            response, cursor = db.execute_command('FT.CURSOR', 'READ', index_name, cursor)
+
+    def _write_document(self, out: IO[str], model_name: str, document: str):
+        # Documents are already serialised JSON, so avoid decoding and re-encoding them
+        out.write(f'{{"model": "{model_name}", "document": {document}}}\n')
+
+    def _read_lines(self, lines: IO[str]) -> Iterator[str]:
+        '''Lines of the file, with errors from decompressing or decoding it raised as BackupFormatError'''
+        try:
+            yield from lines
+        except (OSError, EOFError, UnicodeDecodeError, zlib.error) as error:
+            raise BackupFormatError(f'could not be read ({error})')
+
+    def _read_header(self, lines: Iterator[str]) -> dict:
+        try:
+            header = json.loads(next(lines))
+        except (StopIteration, ValueError):
+            raise BackupFormatError('missing header line')
+
+        if header.get('format') != BACKUP_FORMAT:
+            raise BackupFormatError(f'expected format {BACKUP_FORMAT}')
+        if header.get('version') != BACKUP_VERSION:
+            raise BackupFormatError(f'unsupported version {header.get("version")}')
+        return header
+
+    def _parse_document(self, line: str, guild_id: int) -> BaseModel:
+        entry = json.loads(line)
+        model_name = entry.get('model')
+        if model_name == 'game':
+            game = Game.parse_obj(entry['document'])
+            game.guild_id = guild_id
+            return game
+        elif model_name == 'character':
+            return Character.parse_obj(entry['document'])
+        else:
+            raise BackupFormatError(f'unknown model {model_name}')
+
+    def _find_taken_names(self, guild_id: int) -> TakenNames:
+        '''Names of the guild's games, live and archived, since imported games must not share a name with either'''
+        games = {game.search_name: game.pk for game in Game.find(Game.guild_id == guild_id).all()}
+        if self.archive_service:
+            games.update((archived.search_name, archived.pk) for archived in self.archive_service.find_by_guild(guild_id))
+        return TakenNames(games)
+
+    def _save_batch(self, batch: List[Tuple[int, BaseModel]], guild_id: int, game_pks: Dict[str, str], names: TakenNames, result: ImportResult):
+        if not batch:
+            return
+
+        models = self._assign_pks(batch, guild_id, game_pks, names, result)
+        pipeline = Game.db().pipeline(transaction=False)
+        for model in models:
+            if isinstance(model, Character):
+                attribute_store.save(model, pipeline=pipeline)
+            else:
+                model.save(pipeline=pipeline)
+        pipeline.execute()
+
+        for model in models:
+            if isinstance(model, Game):
+                result.games += 1
+                result.game_ids.add(model.pk)
+            else:
+                result.characters += 1
+
+    def _assign_pks(self, batch: List[Tuple[int, BaseModel]], guild_id: int, game_pks: Dict[str, str], names: TakenNames,
+            result: ImportResult) -> List[BaseModel]:
+        '''
+        Give games and characters whose pk is taken outside the guild a new pk, and point characters at the pk their game was
+        saved under. Characters of games that aren't in the file are reported and dropped. Checks the whole batch in one round trip.
+        Then rename any game or character whose name is used by a different one
+        '''
+        pipeline = Game.primary_db().pipeline(transaction=False)
+        for _, model in batch:
+            if isinstance(model, Game):
+                pipeline.execute_command('JSON.GET', model.key(), 'guild_id')
+                if self.archive_service:
+                    pipeline.exists(self.archive_service.game_key(model.pk))
+                    pipeline.hexists(self.archive_service.guild_key(guild_id), model.pk)
+            else:
+                pipeline.execute_command('JSON.GET', model.key(), 'game_id')
+        responses = iter(pipeline.execute(raise_on_error=False))
+
+        models = []
+        for line_number, model in batch:
+            if isinstance(model, Game):
+                owner_guild_id = self._json_value(next(responses))
+                archived_elsewhere = False
+                if self.archive_service:
+                    # Archived games have no document, only a blob, so the guild's stubs tell whose they are
+                    is_archived, is_archived_here = next(responses), next(responses)
+                    archived_elsewhere = bool(is_archived) and not is_archived_here
+                file_pk = model.pk
+                if archived_elsewhere or owner_guild_id not in (None, guild_id):
+                    model.pk = self._new_pk(model)
+                    names.characters[model.pk] = {}
+                game_pks[file_pk] = model.pk
+                self._claim_name(model, names.games, result)
+            else:
+                owner_game_pk = self._json_value(next(responses))
+                game_pk = game_pks.get(model.game_id)
+                if game_pk is None:
+                    result.errors.append(f'Line {line_number}: character {model.display_name} is not for a game in this file')
+                    continue
+                if game_pk != model.game_id or owner_game_pk not in (None, game_pk):
+                    model.pk = self._new_pk(model)
+                model.game_id = game_pk
+                if game_pk not in names.characters:
+                    names.characters[game_pk] = {character.search_name: character.pk for character in Character.find(Character.game_id == game_pk).all()}
+                self._claim_name(model, names.characters[game_pk], result)
+            models.append(model)
+        return models
+
+    def _claim_name(self, model: Game | Character, taken: Dict[str, str], result: ImportResult):
+        '''Rename the game or character if a different one has its name, like create does, and mark the name as taken'''
+        if taken.get(model.search_name, model.pk) != model.pk:
+            display_name = create_unique_name(name_attempt=model.display_name, existing_names=set(taken), casefolded=True)
+            result.renamed.append((model.display_name, display_name))
+            model.display_name = display_name
+            model.search_name = create_search_name(display_name)
+        taken[model.search_name] = model.pk
+
+    def _json_value(self, response):
+        '''Value of a JSON.GET response. Errors count as a value, so the pk is treated as taken'''
+        if isinstance(response, ResponseError):
+            return response
+        return json.loads(response) if response is not None else None
+
+    def _new_pk(self, model: BaseModel) -> str:
+        return type(model)._meta.primary_key_creator_cls().create_pk()
+
+    def _rebuild_mappings(self, guild_id: int, game_ids: Set[str]):
+        '''
+        RediSearch indexes update themselves on save, so only the summaries, rankings and in-memory lookups need rebuilding.
+        The in-memory lookups are dropped here and rebuilt lazily on next use
+        '''
+        if self.archive_service:
+            # Imported games are live again, so any archived copies of them are out of date
+            self.archive_service.discard(guild_id, list(game_ids))
+        self.summary_service.rebuild_guild(guild_id)
+        if self.ranking_service:
+            for game_id in game_ids:
+                self.ranking_service.rebuild_game(game_id)
+        if self.game_service:
+            self.game_service.invalidate_name_index(guild_id)
+        if self.character_service:
+            for game_id in game_ids:
+                self.character_service.invalidate_name_index(game_id)
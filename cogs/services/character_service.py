@@ -1,46 +1,241 @@
-from typing import List
+import json
+import os
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from pydantic import ValidationError
 from redis_om import NotFoundError
 from discord.ext import commands
 from discord.ext.commands import Bot
 from discord import Member
-from models.character import Character
+from models.attribute_store import attribute_store
+from models.character import Attribute, Character
 from models.game import Game
+from cogs.services.summary_service import SummaryService
+from cogs.services.audit_service import AuditService
+from cogs.services.ranking_service import RankingService
+from cogs.services.character_write_buffer import CharacterWriteBuffer
+from util.async_redis import get_async_redis
+from util.metrics import metrics
 from util.name_builder import create_unique_name, create_search_name
+from util.name_index import NameIndex
+from util.query_tracer import query_tracer
+from util.read_replicas import read_router
+from util.sheet_parser import SheetRow, SheetRowError
+
+SHEET_IMPORT_BATCH_SIZE = int(os.getenv('SHEET_IMPORT_BATCH_SIZE', 25))
+PLAYER_CHARACTERS_SEARCH_SIZE = 1000
+
+class PlayerCharacter(NamedTuple):
+    guild_id: int
+    game_name: str
+    character_pk: str
+    display_name: str
+
+class SheetImportResult:
+    def __init__(self):
+        self.created: List[Tuple[str, str]] = []  # (name asked for, display name given)
+        self.errors: List[str] = []
 
 # Database management for all Game models
 class CharacterService(commands.Cog):
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, summary_service: SummaryService, audit_service: AuditService, ranking_service: RankingService,
+            write_buffer: Optional[CharacterWriteBuffer] = None):
         self.bot = bot
+        self.summary_service = summary_service
+        self.audit_service = audit_service
+        self.ranking_service = ranking_service
+        self.write_buffer = write_buffer
+        self._name_indexes: Dict[str, NameIndex] = {}  # Game pk -> character names in that game
 
     def find_by_member(self, member: Member) -> List[Character]:
-        return Character.find(Character.player_id == member.id).all()
+        return self._overlay(Character.find(Character.player_id == member.id).all())
+
+    async def find_by_player(self, player_id: int) -> List[PlayerCharacter]:
+        '''
+        Every character the player has in any guild, with its game, sorted by guild, game and character name.
+        Takes two round trips however many games the characters are spread over: one search for the characters, then
+        one JSON.MGET for all of their games. Players with more than PLAYER_CHARACTERS_SEARCH_SIZE characters take one more
+        search per page. Characters of archived games are left out
+        '''
+        redis = get_async_redis()
+        query = Character.find(Character.player_id == player_id).query
+        characters = []
+        num_searches = 0
+        while True:
+            offset = len(characters)
+            start = time.perf_counter()
+            response = await redis.execute_command('FT.SEARCH', Character.Meta.index_name, query, 'LIMIT', offset, PLAYER_CHARACTERS_SEARCH_SIZE)
+            query_tracer.record('Character', query, f'LIMIT {offset} {PLAYER_CHARACTERS_SEARCH_SIZE}', response[0], time.perf_counter() - start)
+            num_searches += 1
+            # First entry is the total number of results, then each key is followed by its ['$', document] fields.
+            # Only names are shown, so documents are read as plain JSON rather than validated into models
+            page = [json.loads(fields[1]) for fields in response[2::2]]
+            characters.extend(page)
+            if not page or len(characters) >= response[0]:
+                break
+        if not characters:
+            return []
+
+        game_pks = list({character['game_id'] for character in characters})
+        documents = await redis.execute_command('JSON.MGET', *(Game.make_primary_key(pk) for pk in game_pks), '.')
+        metrics.increment('character_service.player_lookup_round_trips', num_searches + 1)
+        games = {pk: json.loads(document) for pk, document in zip(game_pks, documents) if document}
+
+        found = [PlayerCharacter(games[character['game_id']]['guild_id'], games[character['game_id']]['display_name'], character['pk'],
+            character['display_name']) for character in characters if character['game_id'] in games]
+        return sorted(found, key=lambda entry: (entry.guild_id, entry.game_name.casefold(), entry.display_name.casefold()))
 
     def find_by_game(self, game: Game) -> List[Character]:
-        return Character.find(Character.game_id == game.pk).all()
+        return self._overlay(Character.find(Character.game_id == game.pk).all())
 
     def find_by_game_and_member(self, game: Game, member: Member) -> Character | None:
         try:
-            return Character.find((Character.game_id == game.pk) & (Character.player_id == member.id)).first()
+            return self._overlay([Character.find((Character.game_id == game.pk) & (Character.player_id == member.id)).first()])[0]
         except NotFoundError:
             return None
 
     def find_by_game_and_name(self, game: Game, name: str) -> Character | None:
         try:
-            return Character.find((Character.game_id == game.pk) & (Character.search_name == name.casefold())).first()
+            with read_router.replica_reads(game.guild_id, game.pk):
+                character = Character.find((Character.game_id == game.pk) & (Character.search_name == name.casefold())).first()
+            return self._overlay([character])[0]
         except NotFoundError:
             return None
 
+    def suggest_names(self, game: Game, name: str) -> List[str]:
+        '''Get display names of characters in this game that are close to the given name, closest first'''
+        return self._get_name_index(game).suggest(name)
+
     def create(self, game: Game, name: str) -> Character:
-        character_names = {char.display_name for char in self.find_by_game(game)}
+        characters = self.find_by_game(game)
+        character_names = {char.display_name for char in characters}
+        name_index = self._get_name_index(game, characters=characters)
         display_name = create_unique_name(name_attempt=name, existing_names=character_names)
 
         character = Character(game_id = game.pk,
             display_name=display_name,
             search_name=create_search_name(display_name),
             attributes={})
-        character.save()
 
-        # Add the character to the game
-        self.bot.get_cog("GameService").add_character()
+        pipeline = Character.db().pipeline()
+        attribute_store.save(character, pipeline=pipeline)
+        self.summary_service.record_change(pipeline, game, characters=1)
+        pipeline.execute()
+        self.audit_service.record(game.guild_id, 'character.create', game=game, details=character.display_name)
+        name_index.add(character.display_name)
+        return character
+
+    def set_attribute(self, character: Character, name: str, value: int, max_value: Optional[int] = None) -> Character:
+        '''
+        Set the value of a character's attribute, adding the attribute if the character doesn't have it yet.
+        If max_value is not provided, an existing attribute keeps its max value.
+        With write-behind enabled the change is saved on the next buffer flush, otherwise it is saved immediately.
+        Raises ValidationError if the attribute name is too short or too long
+        '''
+        search_name = create_search_name(name)
+        attribute = character.attributes.get(search_name)
+        if attribute:
+            attribute.value = value
+            if max_value is not None:
+                attribute.max_value = max_value
+        else:
+            attribute = Attribute(display_name=name, search_name=search_name, value=value, max_value=max_value)
+            character.attributes[search_name] = attribute
+
+        if self.write_buffer:
+            return self.write_buffer.stage(character, attribute)
 
+        pipeline = Character.db().pipeline()
+        attribute_store.save_attribute(character, attribute, pipeline=pipeline)
+        self.ranking_service.record_attribute(pipeline, character, attribute)
+        self.summary_service.record_game_activity(pipeline, character.game_id)
+        pipeline.execute()
         return character
+
+    def import_sheet(self, game: Game, rows: Iterable[SheetRow | SheetRowError]) -> SheetImportResult:
+        '''
+        Create a character for every row of a parsed character sheet.
+        Existing names are loaded once up front, rows are validated and saved in pipelined batches,
+        and rows that fail are reported in the result without stopping the rest of the import
+        '''
+        characters = self.find_by_game(game)
+        search_names = {char.search_name for char in characters}
+        name_index = self._get_name_index(game, characters=characters)
+
+        result = SheetImportResult()
+        batch: List[Tuple[SheetRow, Character]] = []
+        for row in rows:
+            if isinstance(row, SheetRowError):
+                result.errors.append(str(row))
+                continue
+
+            display_name = create_unique_name(name_attempt=row.name, existing_names=search_names, casefolded=True)
+            try:
+                character = self._character_from_row(game=game, row=row, display_name=display_name)
+            except ValidationError as error:
+                result.errors.append(f'Line {row.line_number}: could not create character {row.name}: ' +
+                    ', '.join(f'{".".join(str(loc) for loc in e["loc"])} {e["msg"]}' for e in error.errors()))
+                continue
+
+            search_names.add(character.search_name)
+            batch.append((row, character))
+            if len(batch) >= SHEET_IMPORT_BATCH_SIZE:
+                self._save_sheet_batch(game, batch, result, name_index)
+                batch = []
+
+        self._save_sheet_batch(game, batch, result, name_index)
+        self.audit_service.record(game.guild_id, 'character.import', game=game, details=f'{len(result.created)} characters')
+        return result
+
+    def _character_from_row(self, game: Game, row: SheetRow, display_name: str) -> Character:
+        attributes = {}
+        for attribute_name, (value, max_value) in row.attributes.items():
+            attribute = Attribute(display_name=attribute_name,
+                search_name=create_search_name(attribute_name),
+                value=value,
+                max_value=max_value)
+            attributes[attribute.search_name] = attribute
+
+        return Character(game_id=game.pk,
+            player_id=row.player_id,
+            display_name=display_name,
+            search_name=create_search_name(display_name),
+            attributes=attributes)
+
+    def _save_sheet_batch(self, game: Game, batch: List[Tuple[SheetRow, Character]], result: SheetImportResult, name_index: NameIndex):
+        if not batch:
+            return
+
+        pipeline = Character.db().pipeline()
+        for _, character in batch:
+            attribute_store.save(character, pipeline=pipeline)
+            self.ranking_service.record_character(pipeline, character)
+        self.summary_service.record_change(pipeline, game, characters=len(batch))
+        pipeline.execute()
+
+        for row, character in batch:
+            name_index.add(character.display_name)
+            result.created.append((row.name, character.display_name))
+
+    def _overlay(self, characters: List[Character]) -> List[Character]:
+        '''Load attributes kept outside the documents, then lay the write buffer's unsaved attribute changes over them'''
+        characters = attribute_store.load(characters)
+        if self.write_buffer:
+            characters = self.write_buffer.overlay(characters)
+        return characters
+
+    def invalidate_name_index(self, game_id: str):
+        '''Drop the cached name index for the game so it gets rebuilt from the database on next use'''
+        self._name_indexes.pop(game_id, None)
+
+    def _get_name_index(self, game: Game, characters: Optional[List[Character]] = None) -> NameIndex:
+        '''
+        Get the name index for the game, building it from the database on first use
+        If characters is provided, build from those characters instead of querying them again
+        '''
+        name_index = self._name_indexes.get(game.pk)
+        if name_index is None:
+            characters = characters if characters is not None else self.find_by_game(game)
+            name_index = NameIndex(character.display_name for character in characters)
+            self._name_indexes[game.pk] = name_index
+        return name_index
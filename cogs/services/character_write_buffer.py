@@ -0,0 +1,156 @@
+'''
+Opt-in write-behind buffer for character attribute changes (set ATTRIBUTE_WRITE_BEHIND=1)
+
+During combat the same few attributes change several times per turn. Instead of saving the character on every change,
+changed attributes are kept in memory, merged per attribute so the latest value of each wins, and saved once per
+ATTRIBUTE_FLUSH_INTERVAL. Characters read in the meantime get the unsaved attributes laid over what is stored, so two
+commands changing different attributes of the same character never undo each other.
+
+Durability: a clean shutdown flushes everything. If the process is killed without a shutdown (SIGKILL, power loss),
+up to ATTRIBUTE_FLUSH_INTERVAL seconds of attribute changes are lost. Other character and game writes are not buffered.
+Run tools/write_buffer_bench.py to measure the writes saved in a simulated combat.
+'''
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+from discord.ext import commands, tasks
+from models.attribute_store import attribute_store
+from models.character import Attribute, Character
+from cogs.services.ranking_service import RankingService
+from cogs.services.summary_service import SummaryService
+from util.metrics import metrics
+
+ATTRIBUTE_WRITE_BEHIND = os.getenv('ATTRIBUTE_WRITE_BEHIND', '').casefold() in ('1', 'true', 'yes')
+ATTRIBUTE_FLUSH_INTERVAL = float(os.getenv('ATTRIBUTE_FLUSH_INTERVAL', 2.0))  # Seconds
+
+class PendingCharacter:
+    '''Unsaved attribute changes of one character'''
+    __slots__ = ('game_id', 'attributes')
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        self.attributes: Dict[str, Attribute] = {}  # Search name -> latest value
+
+class CharacterWriteBuffer(commands.Cog):
+    def __init__(self, ranking_service: Optional[RankingService] = None, summary_service: Optional[SummaryService] = None):
+        self.ranking_service = ranking_service
+        self.summary_service = summary_service
+        self._pending: Dict[str, PendingCharacter] = {}  # Character pk -> changes not saved yet
+        self._flushing: Dict[str, PendingCharacter] = {}  # Character pk -> changes being saved by the running flush
+        self._lock = threading.Lock()  # Flushes run on executor threads
+        self._flush_lock = threading.Lock()  # One flush at a time
+        self._unload_flush: Optional[asyncio.Future] = None
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.flush_loop.is_running():
+            self.flush_loop.start()
+
+    def cog_unload(self):
+        self.flush_loop.cancel()
+        # cog_unload can't await, so whatever the flush doesn't save is reported when it finishes
+        self._unload_flush = asyncio.get_event_loop().run_in_executor(None, self.flush)
+        self._unload_flush.add_done_callback(self._report_unload_flush)
+
+    def _report_unload_flush(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            print(f'Error! Could not flush character attribute changes on unload, {len(self._pending)} characters were not saved: {future.exception()}')
+
+    def stage(self, character: Character, attribute: Attribute) -> Character:
+        '''Queue the attribute, already set on the character, to be saved on the next flush. Repeated changes are saved once'''
+        metrics.increment('character_write_buffer.writes_requested')
+        with self._lock:
+            pending = self._pending.get(character.pk)
+            if pending is None:
+                pending = self._pending[character.pk] = PendingCharacter(character.game_id)
+            pending.attributes[attribute.search_name] = attribute.copy()
+        return character
+
+    def overlay(self, characters: List[Character]) -> List[Character]:
+        '''Lay unsaved attribute changes over the stored attributes of the characters. Attributes must be loaded already'''
+        with self._lock:
+            for character in characters:
+                for changes in (self._flushing.get(character.pk), self._pending.get(character.pk)):
+                    if changes:
+                        character.attributes.update((name, attribute.copy()) for name, attribute in changes.attributes.items())
+        return characters
+
+    def has_changes(self, game_pk: str) -> bool:
+        '''Whether any character in the game has attribute changes that aren't saved yet'''
+        with self._lock:
+            return any(pending.game_id == game_pk for pending in (*self._pending.values(), *self._flushing.values()))
+
+    def discard(self, character: Character):
+        '''Forget unsaved changes, e.g. when the character is deleted'''
+        with self._lock:
+            self._pending.pop(character.pk, None)
+
+    @tasks.loop(seconds=ATTRIBUTE_FLUSH_INTERVAL)
+    async def flush_loop(self):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+        except Exception as error:
+            # Changes stay pending and are retried on the next flush
+            print(f'Error! Could not flush character attribute changes: {error}')
+
+    def flush(self) -> int:
+        '''
+        Save every character with unsaved changes in two round trips, one to read what is stored and one pipelined write.
+        Blocks, so run it in an executor from the event loop.
+        Returns the number of characters saved
+        '''
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+            flushing = self._flushing
+
+            try:
+                pipeline = Character.db().pipeline(transaction=False)
+                for character in self._merge_into_stored(flushing):
+                    attribute_store.save_attributes(character, flushing[character.pk].attributes.values(), pipeline=pipeline)
+                    if self.ranking_service:
+                        for attribute in flushing[character.pk].attributes.values():
+                            self.ranking_service.record_attribute(pipeline, character, attribute)
+                if self.summary_service:
+                    for game_pk in {pending.game_id for pending in flushing.values()}:
+                        self.summary_service.record_game_activity(pipeline, game_pk)
+                pipeline.execute()
+            except Exception:
+                with self._lock:
+                    # Put the changes back under anything staged since, which is newer
+                    for pk, pending in flushing.items():
+                        staged = self._pending.get(pk)
+                        if staged:
+                            pending.attributes.update(staged.attributes)
+                        self._pending[pk] = pending
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+        metrics.increment('character_write_buffer.writes_flushed', len(flushing))
+        return len(flushing)
+
+    def _merge_into_stored(self, flushing: Dict[str, PendingCharacter]) -> List[Character]:
+        '''Characters to save the changes of. Characters deleted or archived since their changes were staged are left out'''
+        pks = list(flushing)
+        if not attribute_store.saves_whole_character:
+            # Attributes are saved on their own, so the rest of the character isn't needed, only whether it still exists
+            pipeline = Character.db().pipeline(transaction=False)
+            for pk in pks:
+                pipeline.exists(Character.make_primary_key(pk))
+            return [Character.construct(pk=pk, game_id=flushing[pk].game_id, attributes={})
+                for pk, exists in zip(pks, pipeline.execute()) if exists]
+
+        documents = Character.db().execute_command('JSON.MGET', *(Character.make_primary_key(pk) for pk in pks), '.')
+        characters = []
+        for pk, document in zip(pks, documents):
+            if document:
+                character = Character.parse_obj(json.loads(document))
+                character.attributes.update(flushing[pk].attributes)
+                characters.append(character)
+        return characters
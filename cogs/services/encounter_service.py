@@ -0,0 +1,122 @@
+import os
+import time
+from typing import Optional
+from discord import Embed
+from discord.ext import commands
+from discord.ext.commands import Bot
+from redis_om import NotFoundError
+from cogs.services.timer_service import TimerService
+from models.encounter import Combatant, Encounter
+from util.embed_builder import info_embed, warning_embed
+
+ENCOUNTER_IDLE_HOURS = float(os.getenv('ENCOUNTER_IDLE_HOURS', 12))  # Encounters with no changes for this long are ended
+
+REMINDER_TIMER = 'encounter.reminder'
+TIMEOUT_TIMER = 'encounter.timeout'
+EXPIRE_TIMER = 'encounter.expire'
+
+# Turn reminders, turn timeouts and idle expiry all run on the shared TimerService, so they survive restarts
+class EncounterService(commands.Cog):
+    def __init__(self, bot: Bot, timer_service: TimerService):
+        self.bot = bot
+        self.timer_service = timer_service
+        timer_service.register_handler(REMINDER_TIMER, self._on_reminder)
+        timer_service.register_handler(TIMEOUT_TIMER, self._on_timeout)
+        timer_service.register_handler(EXPIRE_TIMER, self._on_expire)
+
+    def find_by_channel(self, channel_id: int) -> Optional[Encounter]:
+        try:
+            return Encounter.find(Encounter.channel_id == channel_id).first()
+        except NotFoundError:
+            return None
+
+    def start(self, guild_id: int, channel_id: int, turn_seconds: int = 0) -> Encounter:
+        encounter = Encounter(guild_id=guild_id, channel_id=channel_id, turn_seconds=turn_seconds)
+        encounter.save()
+        self._schedule_expiry(encounter)
+        return encounter
+
+    def add_combatant(self, encounter: Encounter, display_name: str, initiative: int, player_id: Optional[int] = None) -> Combatant:
+        '''Add to the turn order by initiative. Whoever's turn it is keeps their turn'''
+        current = encounter.current
+        combatant = Combatant(display_name=display_name, initiative=initiative, player_id=player_id)
+        encounter.combatants.append(combatant)
+        # Stable sort, so ties go to whoever joined first
+        encounter.combatants.sort(key=lambda c: c.initiative, reverse=True)
+        if current is not None and encounter.turn_count > 0:
+            encounter.turn_index = next(i for i, c in enumerate(encounter.combatants) if c is current)
+        encounter.save()
+        self._schedule_expiry(encounter)
+        return combatant
+
+    def next_turn(self, encounter: Encounter) -> Optional[Combatant]:
+        '''Move to the next combatant, or to the first one if the encounter hasn't started. Restarts the turn timers'''
+        if not encounter.combatants:
+            return None
+        if encounter.turn_count > 0:
+            encounter.turn_index += 1
+            if encounter.turn_index >= len(encounter.combatants):
+                encounter.turn_index = 0
+                encounter.round += 1
+        encounter.turn_count += 1
+        encounter.save()
+        self._schedule_turn(encounter)
+        self._schedule_expiry(encounter)
+        return encounter.current
+
+    def end(self, encounter: Encounter):
+        self.timer_service.cancel(*(self._timer_id(encounter, kind) for kind in (REMINDER_TIMER, TIMEOUT_TIMER, EXPIRE_TIMER)))
+        Encounter.delete(encounter.pk)
+
+    def _schedule_turn(self, encounter: Encounter):
+        if not encounter.turn_seconds:
+            return
+        now = time.time()
+        payload = {'encounter_pk': encounter.pk, 'turn_count': encounter.turn_count}
+        self.timer_service.schedule(self._timer_id(encounter, REMINDER_TIMER), REMINDER_TIMER, payload, now + encounter.turn_seconds / 2)
+        self.timer_service.schedule(self._timer_id(encounter, TIMEOUT_TIMER), TIMEOUT_TIMER, payload, now + encounter.turn_seconds)
+
+    def _schedule_expiry(self, encounter: Encounter):
+        '''Push back the idle expiry. Rescheduling the same timer ID moves it instead of adding another'''
+        self.timer_service.schedule(self._timer_id(encounter, EXPIRE_TIMER), EXPIRE_TIMER, {'encounter_pk': encounter.pk},
+            time.time() + ENCOUNTER_IDLE_HOURS * 3600)
+
+    def _timer_id(self, encounter: Encounter, kind: str) -> str:
+        return f'encounter:{encounter.pk}:{kind.split(".")[-1]}'
+
+    def _find_current_turn(self, payload: dict) -> Optional[Encounter]:
+        '''The encounter the timer was set for, or None if it has ended or moved on to another turn since'''
+        try:
+            encounter = Encounter.get(payload['encounter_pk'])
+        except NotFoundError:
+            return None
+        return encounter if encounter.turn_count == payload['turn_count'] else None
+
+    async def _on_reminder(self, payload: dict):
+        encounter = self._find_current_turn(payload)
+        if encounter is None or encounter.current is None:
+            return
+        remaining = encounter.turn_seconds - encounter.turn_seconds // 2
+        embed = warning_embed(title=f'{encounter.current.display_name}, {remaining} seconds left in your turn')
+        await self._send(encounter.channel_id, embed, mention=encounter.current.player_id)
+
+    async def _on_timeout(self, payload: dict):
+        encounter = self._find_current_turn(payload)
+        if encounter is None or encounter.current is None:
+            return
+        skipped = encounter.current
+        current = self.next_turn(encounter)
+        embed = info_embed(title=f"Time's up for {skipped.display_name}!", description=f'Round {encounter.round}: **{current.display_name}**, your turn')
+        await self._send(encounter.channel_id, embed, mention=current.player_id)
+
+    async def _on_expire(self, payload: dict):
+        try:
+            encounter = Encounter.get(payload['encounter_pk'])
+        except NotFoundError:
+            return
+        self.end(encounter)
+        await self._send(encounter.channel_id, info_embed(title='Encounter ended', description=f'Nothing happened for {ENCOUNTER_IDLE_HOURS:g} hours'))
+
+    async def _send(self, channel_id: int, embed: Embed, mention: Optional[int] = None):
+        channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+        await channel.send(content=f'<@{mention}>' if mention else None, embed=embed)
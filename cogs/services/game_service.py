@@ -1,38 +1,111 @@
-from typing import Optional, List
+import time
+from typing import Dict, Optional, List
 from redis_om import NotFoundError
 from discord.ext import commands
 from discord import Guild, TextChannel, CategoryChannel
 from models.game import Game
 from models.character import Character
+from cogs.services.summary_service import SummaryService
+from cogs.services.audit_service import AuditService
+from cogs.services.ranking_service import RankingService
+from cogs.services.archive_service import ArchiveService, ArchivedGame
+from util.metrics import metrics
 from util.name_builder import create_unique_name, create_search_name
+from util.name_index import NameIndex
+from util.query_tracer import query_tracer
+from util.read_replicas import read_router
+from util.single_flight import SingleFlight
 
 # Database management for all Game models
 class GameService(commands.Cog):
+    def __init__(self, summary_service: SummaryService, audit_service: AuditService, ranking_service: Optional[RankingService] = None,
+            archive_service: Optional[ArchiveService] = None):
+        self.summary_service = summary_service
+        self.audit_service = audit_service
+        self.ranking_service = ranking_service
+        self.archive_service = archive_service
+        self._name_indexes: Dict[int, NameIndex] = {}  # Guild ID -> game names in that guild
+        self._channel_lookups = SingleFlight('game_service.channel_lookups')
+
     def find_by_guild(self, guild: Guild) -> List[Game]:
-        return Game.find(Game.guild_id == guild.id).all()
+        with read_router.replica_reads(guild.id):
+            return Game.find(Game.guild_id == guild.id).all()
         
+    def find_archived(self, guild: Guild) -> List[ArchivedGame]:
+        return self.archive_service.find_by_guild(guild.id) if self.archive_service else []
+
     def find_by_guild_and_name(self, guild: Guild, name: str) -> Game:
-        games = Game.find((Game.guild_id == guild.id) & (Game.search_name == name.casefold())).all()
+        '''Restores the game if it has been archived'''
+        with read_router.replica_reads(guild.id):
+            games = Game.find((Game.guild_id == guild.id) & (Game.search_name == name.casefold())).all()
         if len(games) == 1:
             return games[0]
         elif len(games):
             # TODO: Throw some error about duplicate entries
             print(f'Error! {len(games)} with duplicate search name {name} found')
             return games[0]
-        else:
-            return None
+        archived = next((archived for archived in self.find_archived(guild) if archived.search_name == name.casefold()), None)
+        return self.archive_service.restore(guild.id, archived.pk) if archived else None
+
+    def suggest_names(self, guild: Guild, name: str) -> List[str]:
+        '''Get display names of games in this guild that are close to the given name, closest first'''
+        return self._get_name_index(guild.id).suggest(name)
 
     def find_by_channel(self, channel: TextChannel) -> Game | None:
+        '''Restores the game if it has been archived'''
         try:
-            return Game.find((Game.guild_id == channel.guild.id) & (Game.text_channel_ids << str(channel.id))).first()
+            with read_router.replica_reads(channel.guild.id):
+                return Game.find((Game.guild_id == channel.guild.id) & (Game.text_channel_ids << str(channel.id))).first()
         except NotFoundError:
-            return None
+            return self._restore_by_channel(channel.guild.id, self.find_archived(channel.guild), channel.id)
 
     def find_by_category(self, category: CategoryChannel) -> Game | None:
+        '''Restores the game if it has been archived'''
         try:
-            return Game.find((Game.guild_id == category.guild.id) & (Game.category_ids << str(category.id))).first()
+            with read_router.replica_reads(category.guild.id):
+                return Game.find((Game.guild_id == category.guild.id) & (Game.category_ids << str(category.id))).first()
         except NotFoundError:
-            return None
+            return self._restore_by_channel(category.guild.id, self.find_archived(category.guild), None, category.id)
+
+    async def find_by_channel_or_category(self, channel: TextChannel) -> Game | None:
+        '''
+        The game that uses this channel as its default, falling back to the game that uses the channel's category.
+        Both, and the guild's archived games, are looked up in one round trip without blocking the event loop, and callers
+        asking about the same channel at the same time share one lookup. Archived games are restored
+        '''
+        category = getattr(channel, 'category', None)  # Threads and voice channels may not have one
+        return await self._channel_lookups.do((channel.id, category.id if category else None),
+            lambda: self._fetch_channel_or_category(channel, category))
+
+    async def _fetch_channel_or_category(self, channel: TextChannel, category: Optional[CategoryChannel]) -> Game | None:
+        queries = [Game.find((Game.guild_id == channel.guild.id) & (Game.text_channel_ids << str(channel.id))).query]
+        if category:
+            queries.append(Game.find((Game.guild_id == channel.guild.id) & (Game.category_ids << str(category.id))).query)
+
+        pipeline = read_router.async_db(channel.guild.id).pipeline(transaction=False)
+        for query in queries:
+            pipeline.execute_command('FT.SEARCH', Game.Meta.index_name, query, 'LIMIT', 0, 1)
+        if self.archive_service:
+            pipeline.hgetall(self.archive_service.guild_key(channel.guild.id))
+        start = time.perf_counter()
+        responses = await pipeline.execute()
+        metrics.increment('game_service.channel_lookup_round_trips')
+        # Traced as one query since they share a round trip. Not with query_tracer.trace, which can't span an await
+        query_tracer.record('Game', ' ; '.join(queries), 'LIMIT 0 1 pipelined', sum(response[0] for response in responses[:len(queries)]),
+            time.perf_counter() - start)
+
+        for response in responses[:len(queries)]:
+            games = Game.from_redis(response)
+            if games:
+                return games[0]
+        if self.archive_service:
+            stubs = self.archive_service.parse_stubs(responses[-1])
+            return self._restore_by_channel(channel.guild.id, stubs, channel.id, category.id if category else None)
+        return None
+
+    def _restore_by_channel(self, guild_id: int, stubs: List[ArchivedGame], channel_id: Optional[int], category_id: Optional[int] = None) -> Game | None:
+        archived = self.archive_service.find_by_channel(stubs, channel_id, category_id) if stubs else None
+        return self.archive_service.restore(guild_id, archived.pk) if archived else None
 
     def create(self, guild: Guild, game_name: Optional[str] = None) -> Game:
         '''
@@ -40,7 +113,10 @@ class GameService(commands.Cog):
         If no game name is provided, will try to name it the first available name, such as Game, Game1, Game2, Game3 etc.
         Raises ValidationError if name is too short or too long
         '''
-        game_names = {game.display_name for game in self.find_by_guild(guild)}
+        games = self.find_by_guild(guild)
+        # Archived games keep their names, since they come back as soon as they're used
+        game_names = {game.display_name for game in games} | {archived.display_name for archived in self.find_archived(guild)}
+        name_index = self._get_name_index(guild.id, games=games)
         display_name = create_unique_name(name_attempt=game_name or 'Game', existing_names=game_names)
 
         game = Game(guild_id = guild.id,
@@ -48,11 +124,28 @@ class GameService(commands.Cog):
             search_name=create_search_name(display_name),
             text_channel_ids=[],
             category_ids=[])
-        game.save()
+
+        pipeline = Game.db().pipeline()
+        game.save(pipeline=pipeline)
+        self.summary_service.record_change(pipeline, game, games=1)
+        pipeline.execute()
+
+        name_index.add(game.display_name)
+        self.audit_service.record(guild.id, 'game.create', game=game)
         return game
 
     def delete(self, game: Game):
-        Game.delete(game.pk)
+        pipeline = Game.db().pipeline()
+        pipeline.delete(game.key())
+        self.summary_service.record_game_deleted(pipeline, game)
+        if self.ranking_service:
+            self.ranking_service.record_game_deleted(pipeline, game)
+        pipeline.execute()
+        self._channel_lookups.clear()
+        self.audit_service.record(game.guild_id, 'game.delete', game=game)
+
+        if game.guild_id in self._name_indexes:
+            self._name_indexes[game.guild_id].remove(game.display_name)
 
     def add_channel(self, game: Game, channel: TextChannel) -> Game | None:
         '''
@@ -61,42 +154,71 @@ class GameService(commands.Cog):
         If this channel already exists in this game, then just return the game with no changes.
         '''
         existing_game = self.find_by_channel(channel=channel)
-        if existing_game:
-            if existing_game == game:
-                return game
+        if existing_game and existing_game == game:
+            return game
 
+        # Moving the channel between games happens in one transaction so it can never end up in both or neither
+        pipeline = Game.db().pipeline()
+        if existing_game:
             existing_game.text_channel_ids.remove(str(channel.id))
-            existing_game.save()
+            existing_game.save(pipeline=pipeline)
+            self.summary_service.record_change(pipeline, existing_game, channels=-1)
 
         game.text_channel_ids = game.text_channel_ids or []
         game.text_channel_ids.append(str(channel.id))
-        game.save()
+        game.save(pipeline=pipeline)
+        self.summary_service.record_change(pipeline, game, channels=1)
+        pipeline.execute()
+        self._channel_lookups.clear()
+        self.audit_service.record(game.guild_id, 'channel.use', game=game, details=self._describe_move(channel, existing_game))
 
         return existing_game
 
     def delete_channel(self, game: Game, channel: TextChannel):
         game.text_channel_ids.remove(str(channel.id))
-        game.save()
+
+        pipeline = Game.db().pipeline()
+        game.save(pipeline=pipeline)
+        self.summary_service.record_change(pipeline, game, channels=-1)
+        pipeline.execute()
+        self._channel_lookups.clear()
+        self.audit_service.record(game.guild_id, 'channel.delete', game=game, details=channel.mention)
 
     def add_category(self, game: Game, category: CategoryChannel) -> Game | None:
         '''
         Adds the given category to this game's list of category IDs
         If this category exists in any other game, then remove the category from that game and return that game
+        If this category already exists in this game, then just return the game with no changes.
         '''
         existing_game = self.find_by_category(category=category)
+        if existing_game and existing_game == game:
+            return game
+
+        pipeline = Game.db().pipeline()
         if existing_game:
             existing_game.category_ids.remove(str(category.id))
-            existing_game.save()
+            existing_game.save(pipeline=pipeline)
+            self.summary_service.record_change(pipeline, existing_game, categories=-1)
 
         game.category_ids = game.category_ids or []
         game.category_ids.append(str(category.id))
-        game.save()
+        game.save(pipeline=pipeline)
+        self.summary_service.record_change(pipeline, game, categories=1)
+        pipeline.execute()
+        self._channel_lookups.clear()
+        self.audit_service.record(game.guild_id, 'category.use', game=game, details=self._describe_move(category, existing_game))
 
         return existing_game
 
     def delete_category(self, game: Game, category: CategoryChannel):
         game.category_ids.remove(str(category.id))
-        game.save()
+
+        pipeline = Game.db().pipeline()
+        game.save(pipeline=pipeline)
+        self.summary_service.record_change(pipeline, game, categories=-1)
+        pipeline.execute()
+        self._channel_lookups.clear()
+        self.audit_service.record(game.guild_id, 'category.delete', game=game, details=category.mention)
 
 
     def add_character(self, game: Game, character: Character):
@@ -110,4 +232,26 @@ class GameService(commands.Cog):
         if not game.char_ids or character.pk not in game.char_ids:
             return None
         game.char_ids.remove(character.pk)
-        return character
\ No newline at end of file
+        return character
+
+    def _describe_move(self, channel: TextChannel | CategoryChannel, previous_game: Optional[Game]) -> str:
+        if previous_game:
+            return f'{channel.mention} (was {previous_game.display_name})'
+        return channel.mention
+
+    def invalidate_name_index(self, guild_id: int):
+        '''Drop the cached name index for the guild so it gets rebuilt from the database on next use'''
+        self._name_indexes.pop(guild_id, None)
+
+    def _get_name_index(self, guild_id: int, games: Optional[List[Game]] = None) -> NameIndex:
+        '''
+        Get the name index for the guild, building it from the database on first use
+        If games is provided, build from those games instead of querying them again
+        '''
+        name_index = self._name_indexes.get(guild_id)
+        if name_index is None:
+            games = games if games is not None else Game.find(Game.guild_id == guild_id).all()
+            archived = self.archive_service.find_by_guild(guild_id) if self.archive_service else []
+            name_index = NameIndex([game.display_name for game in games] + [game.display_name for game in archived])
+            self._name_indexes[guild_id] = name_index
+        return name_index
@@ -0,0 +1,95 @@
+import json
+from typing import List, NamedTuple, Optional
+from discord.ext import commands
+from redis import Redis
+from redis.client import Pipeline
+from models.attribute_store import attribute_store
+from models.character import Attribute, Character
+from models.game import Game
+
+RANK_KEY_PREFIX = 'pr:rank'
+
+class RankedCharacter(NamedTuple):
+    rank: int  # 1 is the highest value, or the lowest for lowest first rankings
+    character_pk: str
+    display_name: str
+    value: int
+
+# Sorted set per game and attribute, scored by attribute value, kept next to the Character documents
+# so rankings never need to load every character in a game
+class RankingService(commands.Cog):
+    def key(self, game_pk: str, search_name: str) -> str:
+        return f'{RANK_KEY_PREFIX}:{game_pk}:{search_name}'
+
+    def attributes_key(self, game_pk: str) -> str:
+        '''Set of the attribute names ranked in the game, so its rankings can be found without scanning'''
+        return f'{RANK_KEY_PREFIX}:{game_pk}'
+
+    def record_attribute(self, pipeline: Pipeline, character: Character, attribute: Attribute):
+        '''Queue the attribute's new value on the pipeline. Add to the pipeline that saves the attribute'''
+        pipeline.zadd(self.key(character.game_id, attribute.search_name), {character.pk: attribute.value})
+        pipeline.sadd(self.attributes_key(character.game_id), attribute.search_name)
+
+    def record_character(self, pipeline: Pipeline, character: Character):
+        for attribute in character.attributes.values():
+            self.record_attribute(pipeline, character, attribute)
+
+    def record_game_deleted(self, pipeline: Pipeline, game: Game):
+        self._queue_delete(pipeline, game.pk)
+
+    def find_top(self, game: Game, search_name: str, limit: int = 10, lowest_first: bool = False) -> List[RankedCharacter]:
+        entries = self._db().zrange(self.key(game.pk, search_name), 0, limit - 1, desc=not lowest_first, withscores=True)
+        return self._with_names(entries, first_rank=1)
+
+    def find_rank(self, game: Game, search_name: str, character: Character, lowest_first: bool = False) -> Optional[RankedCharacter]:
+        '''The character's place in the ranking, or None if the character doesn't have the attribute'''
+        db = self._db()
+        key = self.key(game.pk, search_name)
+        pipeline = db.pipeline(transaction=False)
+        if lowest_first:
+            pipeline.zrank(key, character.pk)
+        else:
+            pipeline.zrevrank(key, character.pk)
+        pipeline.zscore(key, character.pk)
+        index, score = pipeline.execute()
+        if index is None:
+            return None
+        return RankedCharacter(index + 1, character.pk, character.display_name, int(score))
+
+    def find_in_range(self, game: Game, search_name: str, min_value: int, max_value: int, limit: int = 25) -> List[RankedCharacter]:
+        '''Characters with min_value <= value <= max_value, highest first'''
+        db = self._db()
+        key = self.key(game.pk, search_name)
+        entries = db.zrevrangebyscore(key, max_value, min_value, start=0, num=limit, withscores=True)
+        if not entries:
+            return []
+        # Rank of the first entry is the number of characters above max_value, plus one
+        first_rank = db.zcount(key, f'({max_value}', '+inf') + 1
+        return self._with_names(entries, first_rank=first_rank)
+
+    def rebuild_game(self, game_pk: str) -> int:
+        '''Recompute the game's rankings from the characters. Returns the number of characters ranked'''
+        characters = attribute_store.load(Character.find(Character.game_id == game_pk).all())
+        pipeline = self._db().pipeline()
+        self._queue_delete(pipeline, game_pk)
+        for character in characters:
+            self.record_character(pipeline, character)
+        pipeline.execute()
+        return len(characters)
+
+    def _queue_delete(self, pipeline: Pipeline, game_pk: str):
+        for search_name in self._db().smembers(self.attributes_key(game_pk)):
+            pipeline.delete(self.key(game_pk, search_name))
+        pipeline.delete(self.attributes_key(game_pk))
+
+    def _with_names(self, entries: List, first_rank: int) -> List[RankedCharacter]:
+        if not entries:
+            return []
+        keys = [Character.make_primary_key(pk) for pk, _ in entries]
+        # JSON.MGET with a JSONPath returns each result as a JSON array of matches
+        names = self._db().execute_command('JSON.MGET', *keys, '$.display_name')
+        return [RankedCharacter(first_rank + i, pk, json.loads(name)[0] if name else pk, int(score))
+            for i, ((pk, score), name) in enumerate(zip(entries, names))]
+
+    def _db(self) -> Redis:
+        return Character.db()
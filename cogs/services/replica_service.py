@@ -0,0 +1,22 @@
+import asyncio
+from discord.ext import commands, tasks
+from models.game import Game
+from util.read_replicas import REPLICA_CHECK_INTERVAL, read_router
+
+class ReplicaService(commands.Cog):
+    '''Keeps replica lag measurements fresh so util.read_replicas only reads from replicas within REPLICA_MAX_LAG'''
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.check_loop.is_running():
+            self.check_loop.start()
+
+    def cog_unload(self):
+        self.check_loop.cancel()
+
+    @tasks.loop(seconds=REPLICA_CHECK_INTERVAL)
+    async def check_loop(self):
+        try:
+            # In an executor since a replica that isn't answering blocks for up to REPLICA_TIMEOUT
+            await asyncio.get_running_loop().run_in_executor(None, read_router.check, Game.primary_db())
+        except Exception as error:
+            print(f'Error! Could not check replicas: {error}')
@@ -1,11 +1,12 @@
 import os
-from turtle import pos
+from typing import TYPE_CHECKING
 from discord.ext.commands import Cog, Bot, CommandError
 from dotenv import load_dotenv
-import requests
-from requests import Response
 import random
 
+if TYPE_CHECKING:
+    from requests import Response, Session
+
 load_dotenv()
 
 BOT_NAME = os.getenv('BOT_NAME') or 'Prism'
@@ -49,6 +50,7 @@ class MessageTooLongToAnalyzeError(Exception):
 class SentimentService(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
+        self._session: 'Session | None' = None
 
     def query_sentiment(self, content: str):
         if len(content) > IGNORE_SENTIMENT_MESSAGE_LENGTH:
@@ -56,7 +58,7 @@ class SentimentService(Cog):
 
         focused_content = self._focus_on_name(content=content)
         headers = {'Authorization': f'Bearer {HUGGING_FACE_API_TOKEN}'}
-        response = requests.post(API_URL, headers=headers, json=focused_content)
+        response = self._get_session().post(API_URL, headers=headers, json=focused_content)
         positivity = self._parse_response_positivity(response)
         return self._random_sentiment_response(positivity)
 
@@ -69,7 +71,14 @@ class SentimentService(Cog):
         end_index = min(name_index + name_length + int(max_outer_length / 2), len(content))
         return content[start_index:end_index].strip()
 
-    def _parse_response_positivity(self, response: Response) -> str:
+    def _get_session(self) -> 'Session':
+        '''Created on first use since the requests stack is slow to import and only needed once someone mentions the bot'''
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def _parse_response_positivity(self, response: 'Response') -> str:
         positivity_scores = response.json()[0]
         positive_score = next(entry['score'] for entry in positivity_scores if entry['label'] == 'POSITIVE')
         negative_score = next(entry['score'] for entry in positivity_scores if entry['label'] == 'NEGATIVE')
@@ -0,0 +1,183 @@
+import datetime
+import time
+from typing import Dict, List, Optional
+from discord.ext import commands
+from redis import Redis, WatchError
+from redis.client import Pipeline
+from models.character import Character
+from models.game import Game
+from util.async_redis import get_async_redis
+from util.query_tracer import query_tracer
+from util.read_replicas import read_router
+
+SUMMARY_KEY_PREFIX = 'pr:summary'
+COUNT_FIELDS = ['game_count', 'character_count', 'channel_count', 'category_count']
+BUILT_FIELD = 'built'  # Set on guild summaries computed from the documents. Guilds from before summaries don't have it yet
+
+# Takes a deleted game's counts off its guild with the values the game summary has when the transaction runs,
+# so changes queued or committed after the caller looked can't be lost or counted twice
+DELETE_GAME_SCRIPT = '''
+for _, field in ipairs({'character_count', 'channel_count', 'category_count'}) do
+    local count = tonumber(redis.call('HGET', KEYS[2], field) or '0')
+    if count ~= 0 then
+        redis.call('HINCRBY', KEYS[1], field, -count)
+    end
+end
+redis.call('HINCRBY', KEYS[1], 'game_count', -1)
+redis.call('HSET', KEYS[1], 'last_activity_ts', ARGV[1])
+redis.call('DEL', KEYS[2])
+return redis.call('INCR', KEYS[3])
+'''
+
+class Summary:
+    '''Counts and last activity for a guild or a game, read from a single Redis hash'''
+    def __init__(self, fields: Dict[str, str]):
+        self.game_count = int(fields.get('game_count', 0))
+        self.character_count = int(fields.get('character_count', 0))
+        self.channel_count = int(fields.get('channel_count', 0))
+        self.category_count = int(fields.get('category_count', 0))
+        last_activity_ts = fields.get('last_activity_ts')
+        self.last_activity_ts: Optional[datetime.datetime] = \
+            datetime.datetime.fromtimestamp(float(last_activity_ts), datetime.timezone.utc) if last_activity_ts else None
+
+# Read models kept next to the Game and Character documents so summaries never need to load every document
+class SummaryService(commands.Cog):
+    def __init__(self):
+        self._delete_game = Game.primary_db().register_script(DELETE_GAME_SCRIPT)
+
+    def guild_key(self, guild_id: int) -> str:
+        return f'{SUMMARY_KEY_PREFIX}:guild:{guild_id}'
+
+    def game_key(self, game_id: str) -> str:
+        return f'{SUMMARY_KEY_PREFIX}:game:{game_id}'
+
+    def version_key(self, guild_id: int) -> str:
+        # Kept out of the guild hash so rebuilds, which replace the hash, can't reset it to an earlier value
+        return f'{SUMMARY_KEY_PREFIX}:version:{guild_id}'
+
+    def find_by_guild(self, guild_id: int) -> Summary:
+        '''The guild's summary, computed from the documents first if it has never been built'''
+        fields = self._db().hgetall(self.guild_key(guild_id))
+        if BUILT_FIELD not in fields:
+            return self.rebuild_guild(guild_id)
+        return Summary(fields)
+
+    def find_by_game(self, game: Game) -> Summary:
+        '''The game's summary, computed from the documents first if its guild's summaries have never been built'''
+        pipeline = self._db().pipeline(transaction=False)
+        pipeline.hexists(self.guild_key(game.guild_id), BUILT_FIELD)
+        pipeline.hgetall(self.game_key(game.pk))
+        is_built, fields = pipeline.execute()
+        if not is_built:
+            self.rebuild_guild(game.guild_id)
+            fields = Game.primary_db().hgetall(self.game_key(game.pk))
+        return Summary(fields)
+
+    async def find_version(self, guild_id: int) -> int:
+        '''
+        Counter bumped by every change to the guild's games, for caching anything built from them.
+        Read from the primary with the async client, since it's read before every cacheable command
+        '''
+        return int(await get_async_redis().get(self.version_key(guild_id)) or 0)
+
+    def record_change(self, pipeline: Pipeline, game: Game, games: int = 0, characters: int = 0, channels: int = 0, categories: int = 0):
+        '''
+        Queue count changes for the game and its guild on the pipeline, and mark both as active now.
+        Add these to the same transaction pipeline as the document writes so the counts can't drift from the documents
+        '''
+        now = time.time()
+        game_changes = {'character_count': characters, 'channel_count': channels, 'category_count': categories}
+        guild_changes = {'game_count': games, **game_changes}
+        for key, changes in ((self.guild_key(game.guild_id), guild_changes), (self.game_key(game.pk), game_changes)):
+            for field, amount in changes.items():
+                if amount:
+                    pipeline.hincrby(key, field, amount)
+            pipeline.hset(key, 'last_activity_ts', now)
+        pipeline.incr(self.version_key(game.guild_id))
+        # Every game and character write comes through here, so this is where reads switch to read-your-writes
+        read_router.note_write(game.guild_id, game.pk)
+
+    def record_game_activity(self, pipeline: Pipeline, game_pk: str):
+        '''Queue marking the game as active now, for writes that don't change any counts such as attribute changes'''
+        pipeline.hset(self.game_key(game_pk), 'last_activity_ts', time.time())
+        read_router.note_write(game_pk)
+
+    def record_game_deleted(self, pipeline: Pipeline, game: Game):
+        '''Queue removal of the game's summary and its share of the guild counts on the pipeline'''
+        self._delete_game(keys=[self.guild_key(game.guild_id), self.game_key(game.pk), self.version_key(game.guild_id)],
+            args=[time.time()], client=pipeline)
+        read_router.note_write(game.guild_id, game.pk)
+
+    def rebuild_guild(self, guild_id: int) -> Summary:
+        '''
+        Recompute the guild's summary and the summary of each of its games from the documents.
+        Starts over if the guild changes while it is being counted
+        '''
+        db = Game.primary_db()
+        with db.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(self.version_key(guild_id))
+                    guild_fields = self._count_guild(pipeline, guild_id)
+                    pipeline.execute()
+                    break
+                except WatchError:
+                    continue
+        read_router.note_write(guild_id)
+        return Summary(guild_fields)
+
+    def rebuild_all(self) -> int:
+        '''Rebuild the summaries of every guild that has a game. Returns the number of guilds rebuilt'''
+        response = self._db().execute_command('FT.AGGREGATE', Game.Meta.index_name, '*', 'GROUPBY', 1, '@guild_id')
+        # First entry is the number of groups, each following entry is a ['guild_id', id] row
+        guild_ids = [int(row[1]) for row in response[1:]]
+        for guild_id in guild_ids:
+            self.rebuild_guild(guild_id)
+        return len(guild_ids)
+
+    def _count_guild(self, pipeline: Pipeline, guild_id: int) -> Dict[str, int]:
+        '''Count the guild's games and characters, then queue replacing its summaries on the watching pipeline'''
+        db = Game.primary_db()
+        games: List[Game] = Game.find(Game.guild_id == guild_id).all()
+        guild_fields = dict.fromkeys(COUNT_FIELDS, 0)
+        guild_fields['game_count'] = len(games)
+        guild_fields[BUILT_FIELD] = 1
+
+        game_fields = {}
+        for game in games:
+            num_characters = self._count(Character, Character.find(Character.game_id == game.pk).query)
+            game_fields[game.pk] = {
+                'character_count': num_characters,
+                'channel_count': len(game.text_channel_ids or []),
+                'category_count': len(game.category_ids or []),
+                'last_activity_ts': self._last_activity(self.game_key(game.pk), game)
+            }
+            for field in COUNT_FIELDS[1:]:
+                guild_fields[field] += game_fields[game.pk][field]
+
+        last_activity = db.hget(self.guild_key(guild_id), 'last_activity_ts')
+        if last_activity:
+            guild_fields['last_activity_ts'] = last_activity
+
+        pipeline.multi()
+        for game_pk, fields in game_fields.items():
+            pipeline.delete(self.game_key(game_pk))
+            pipeline.hset(self.game_key(game_pk), mapping=fields)
+        pipeline.delete(self.guild_key(guild_id))
+        pipeline.hset(self.guild_key(guild_id), mapping=guild_fields)
+        pipeline.incr(self.version_key(guild_id))
+        return guild_fields
+
+    def _count(self, model, query: str) -> int:
+        with query_tracer.trace(model.__name__, query, 'LIMIT 0 0') as trace:
+            trace.num_results = self._db().execute_command('FT.SEARCH', model.Meta.index_name, query, 'LIMIT', 0, 0)[0]
+        return trace.num_results
+
+    def _last_activity(self, key: str, game: Game) -> float:
+        last_activity = self._db().hget(key, 'last_activity_ts')
+        if last_activity:
+            return float(last_activity)
+        return game.created_ts.timestamp() if game.created_ts else time.time()
+
+    def _db(self) -> Redis:
+        return Game.db()
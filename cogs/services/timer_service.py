@@ -0,0 +1,152 @@
+'''
+One scheduler for every timer in the bot (turn timeouts, reminders, expirations)
+
+Deadlines are persisted in a Redis sorted set (pr:timers, scored by deadline) with their payloads in a hash, so timers survive
+restarts. In memory, timers due within the next TIMER_LOOKAHEAD seconds sit in a heap and a single background task sleeps
+until the earliest one, so thousands of pending timers cost one task rather than one sleeping coroutine each.
+Timers further out stay only in Redis and are picked up by the periodic lookahead, which also picks up timers scheduled by
+other processes. Firing claims the timer in Redis first, so each timer fires once even with several workers running.
+'''
+import asyncio
+import heapq
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from discord.ext import commands
+from redis import Redis
+from models.base_model import BaseModel
+from util.metrics import metrics
+
+TIMER_KEY = 'pr:timers'
+TIMER_DATA_KEY = 'pr:timers:data'
+TIMER_LOOKAHEAD = float(os.getenv('TIMER_LOOKAHEAD', 30))  # Seconds
+
+# Removes and returns the timer only if it is still set for the deadline this process knows about.
+# A timer rescheduled by another process in the meantime is left alone
+CLAIM_SCRIPT = '''
+local deadline = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not deadline or math.abs(tonumber(deadline) - tonumber(ARGV[2])) > 0.001 then
+    return false
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+local data = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return data
+'''
+
+TimerHandler = Callable[[dict], Awaitable[None]]
+
+class TimerService(commands.Cog):
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}  # Timer ID -> deadline of timers in the heap. Heap entries not matching are stale
+        self._handlers: Dict[str, TimerHandler] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._claim = self._db().register_script(CLAIM_SCRIPT)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def cog_unload(self):
+        self.stop()
+
+    def stop(self):
+        '''Stop firing timers. Pending timers stay in Redis and fire after the next start'''
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def register_handler(self, kind: str, handler: TimerHandler):
+        '''handler is awaited with the timer's payload when a timer of this kind fires'''
+        self._handlers[kind] = handler
+
+    def schedule(self, timer_id: str, kind: str, payload: dict, deadline: float):
+        '''Set a timer to fire at deadline (a Unix timestamp). Scheduling an existing timer ID moves it'''
+        pipeline = self._db().pipeline()
+        pipeline.zadd(TIMER_KEY, {timer_id: deadline})
+        pipeline.hset(TIMER_DATA_KEY, timer_id, json.dumps({'kind': kind, 'payload': payload}))
+        pipeline.execute()
+        metrics.increment('timers.scheduled')
+        if deadline <= time.time() + TIMER_LOOKAHEAD:
+            self._push(timer_id, deadline)
+
+    def cancel(self, *timer_ids: str):
+        pipeline = self._db().pipeline()
+        pipeline.zrem(TIMER_KEY, *timer_ids)
+        pipeline.hdel(TIMER_DATA_KEY, *timer_ids)
+        pipeline.execute()
+        for timer_id in timer_ids:
+            self._deadlines.pop(timer_id, None)
+
+    def _push(self, timer_id: str, deadline: float):
+        self._deadlines[timer_id] = deadline
+        heapq.heappush(self._heap, (deadline, timer_id))
+        if self._heap[0][1] == timer_id:
+            self._wakeup.set()  # New earliest timer, the loop needs to sleep for less
+        metrics.gauge('timers.pending', len(self._deadlines))
+
+    async def _run(self):
+        next_lookahead = 0.0
+        while True:
+            now = time.time()
+            if now >= next_lookahead:
+                self._load_due_soon(now)
+                next_lookahead = now + TIMER_LOOKAHEAD
+
+            while self._heap and self._heap[0][0] <= now:
+                deadline, timer_id = heapq.heappop(self._heap)
+                if self._deadlines.get(timer_id) != deadline:
+                    continue  # Cancelled or moved
+                del self._deadlines[timer_id]
+                self._fire(timer_id, deadline)
+            metrics.gauge('timers.pending', len(self._deadlines))
+
+            wake_at = min(next_lookahead, self._heap[0][0]) if self._heap else next_lookahead
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(wake_at - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def _load_due_soon(self, now: float):
+        '''Move timers due before the next lookahead from Redis into the heap, including ones left over from before a restart'''
+        try:
+            due = self._db().zrangebyscore(TIMER_KEY, '-inf', now + TIMER_LOOKAHEAD, withscores=True)
+        except Exception as error:
+            print(f'Error! Could not load timers: {error}')
+            return
+        for timer_id, deadline in due:
+            if self._deadlines.get(timer_id) != deadline:
+                self._push(timer_id, deadline)
+
+    def _fire(self, timer_id: str, deadline: float):
+        try:
+            data = self._claim(keys=[TIMER_KEY, TIMER_DATA_KEY], args=[timer_id, deadline])
+        except Exception as error:
+            print(f'Error! Could not claim timer {timer_id}: {error}')
+            return
+        if not data:
+            return  # Fired by another process, cancelled or moved
+
+        timer = json.loads(data)
+        handler = self._handlers.get(timer['kind'])
+        if handler is None:
+            print(f'Error! No handler for timer {timer_id} of kind {timer["kind"]}')
+            return
+        metrics.increment('timers.fired')
+        metrics.observe('timers.lateness', max(time.time() - deadline, 0))
+        # Handlers run as their own tasks so a slow one doesn't hold up other timers
+        asyncio.get_running_loop().create_task(self._call_handler(timer_id, handler, timer['payload']))
+
+    async def _call_handler(self, timer_id: str, handler: TimerHandler, payload: dict):
+        try:
+            await handler(payload)
+        except Exception as error:
+            print(f'Error! Timer {timer_id} failed: {error}')
+
+    def _db(self) -> Redis:
+        return BaseModel.db()
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from discord import TextChannel
 from discord.ext.commands import Bot, Context, Converter, CommandError
 
@@ -5,20 +6,23 @@ from cogs.services import GameService
 from models import Game
 from util.embed_builder import COMMAND_PREFIX, error_embed
 
-async def send_game_not_found(ctx: Context, name: str):
+async def send_game_not_found(ctx: Context, name: str, suggestions: Optional[List[str]] = None):
     '''Send user-friendly error'''
     embed = error_embed(title='Game not found!',
             description='Sorry! We could not find a game with the name **{}**.\nTry `{}game list` to see all available games.'.format(name, COMMAND_PREFIX))
+    if suggestions:
+        embed.add_field(name='Did you mean:', value='\n'.join(f'- {suggestion}' for suggestion in suggestions), inline=False)
     return await ctx.send(embed=embed)
 
 class GameNotFoundError(CommandError):
-    def __init__(self, name: str):
+    def __init__(self, name: str, suggestions: Optional[List[str]] = None):
         super().__init__(f'Could not find a game with the name {name}')
         self.name = name
+        self.suggestions = suggestions or []
 
     async def send_error(self, ctx: Context):
         '''Send user-friendly error'''
-        return await send_game_not_found(ctx, self.name)
+        return await send_game_not_found(ctx, self.name, suggestions=self.suggestions)
 
 class GameConverter(Converter):
     async def convert(self, ctx: Context, arg: str) -> Game:
@@ -37,20 +41,13 @@ class GameConverter(Converter):
             if game:
                 return game
             else:
-                raise GameNotFoundError(arg)
+                raise GameNotFoundError(arg, suggestions=game_service.suggest_names(guild=ctx.guild, name=arg))
 
-        # Try searching by channel
-        channel = ctx.channel
-        game = game_service.find_by_channel(channel=channel)
+        # Try searching by channel, falling back to the category. Both are fetched together
+        game = await game_service.find_by_channel_or_category(channel=ctx.channel)
         if game:
             return game
 
-        # Fallback to searching by category
-        if not isinstance(channel, TextChannel):
+        if not isinstance(ctx.channel, TextChannel):
             raise CommandError('Expected GameConverter to be used inside guild')
-
-        if channel.category == None:
-            return None
-
-        game = game_service.find_by_category(category=ctx.channel.category)
-        return game
+        return None
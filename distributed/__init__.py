@@ -0,0 +1,9 @@
+'''
+Optional split of the bot into a thin gateway process and a pool of worker processes (set PRISM_MODE=gateway or PRISM_MODE=worker)
+
+The gateway holds the Discord connection and pushes raw events onto Redis Streams, partitioned by guild.
+Workers lease partitions, replay the events into their own copy of the bot so the usual cogs run unchanged, and reply over REST.
+Each partition is handled by one worker at a time, so events from the same guild are handled in order.
+'''
+from .event_stream import *
+# Import .gateway or .worker directly, so a gateway process doesn't pull in the whole bot through the worker
@@ -0,0 +1,33 @@
+import os
+
+EVENT_PARTITIONS = int(os.getenv('EVENT_PARTITIONS', 16))
+EVENT_STREAM_MAX_LENGTH = int(os.getenv('EVENT_STREAM_MAX_LENGTH', 10000))
+EVENT_STREAM_PREFIX = 'pr:events'
+EVENT_CONSUMER_GROUP = 'workers'
+
+# Raw gateway events replayed on workers. Besides commands, workers need reactions for confirmations and channel/guild changes to keep their cache fresh
+FORWARDED_EVENTS = {
+    'MESSAGE_CREATE',
+    'MESSAGE_REACTION_ADD',
+    'MESSAGE_REACTION_REMOVE',
+    'CHANNEL_CREATE',
+    'CHANNEL_UPDATE',
+    'CHANNEL_DELETE',
+    'GUILD_UPDATE',
+    'GUILD_ROLE_CREATE',
+    'GUILD_ROLE_UPDATE',
+    'GUILD_ROLE_DELETE',
+}
+
+def partition_of(guild_id: int | None) -> int:
+    '''All events from one guild land in one partition. Direct messages share partition 0'''
+    return guild_id % EVENT_PARTITIONS if guild_id else 0
+
+def stream_key(partition: int) -> str:
+    return f'{EVENT_STREAM_PREFIX}:{partition}'
+
+def lease_key(partition: int) -> str:
+    return f'{EVENT_STREAM_PREFIX}:{partition}:owner'
+
+def workers_key() -> str:
+    return f'{EVENT_STREAM_PREFIX}:workers'
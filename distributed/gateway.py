@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import signal
+from typing import List
+from discord import Client
+from distributed.event_stream import EVENT_STREAM_MAX_LENGTH, FORWARDED_EVENTS, partition_of, stream_key
+from util.async_redis import close_async_redis, get_async_redis
+from util.metrics import metrics
+
+PUBLISH_RETRY_SECONDS = float(os.getenv('PUBLISH_RETRY_SECONDS', 0.5))  # First wait after a failed publish, doubled on every failure
+PUBLISH_RETRY_MAX_SECONDS = float(os.getenv('PUBLISH_RETRY_MAX_SECONDS', 10))
+
+class GatewayClient(Client):
+    '''
+    Holds the Discord gateway connection and publishes raw events for workers. Runs no commands itself,
+    so heartbeats are never delayed by slow command handlers
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._unpublished: List[dict] = []  # Taken off the queue but not in Redis yet
+        self._publisher: asyncio.Task | None = None
+
+    def dispatch(self, event: str, *args, **kwargs):
+        # dispatch is called synchronously in the order events arrive, so queueing here keeps them in order.
+        # Listener tasks would be scheduled separately and could reach Redis out of order
+        if event == 'socket_response':
+            message = args[0]
+            if message.get('op') == 0 and message.get('t') in FORWARDED_EVENTS:
+                self._events.put_nowait(message)
+        super().dispatch(event, *args, **kwargs)
+
+    async def on_connect(self):
+        if self._publisher is None:
+            self._publisher = self.loop.create_task(self._publish_events())
+
+    async def _publish_events(self):
+        '''Publish queued events in order. Failed publishes are retried until Redis is back, events keep queueing meanwhile'''
+        while True:
+            self._unpublished = [await self._events.get()]
+            while not self._events.empty():
+                self._unpublished.append(self._events.get_nowait())
+            retry_seconds = PUBLISH_RETRY_SECONDS
+            while self._unpublished:
+                try:
+                    await self._publish(self._unpublished)
+                    self._unpublished = []
+                except Exception as error:
+                    metrics.increment('gateway.publish_failures')
+                    print(f'Error! Could not publish {len(self._unpublished)} events, retrying in {retry_seconds:.1f} seconds: {error}')
+                    await asyncio.sleep(retry_seconds)
+                    retry_seconds = min(retry_seconds * 2, PUBLISH_RETRY_MAX_SECONDS)
+
+    async def _publish(self, messages: List[dict]):
+        '''
+        Append events to their partitions in one round trip. It is a transaction, so a publish that fails has normally added
+        none of the events and retrying it doesn't publish them twice
+        '''
+        pipeline = get_async_redis().pipeline(transaction=True)
+        for message in messages:
+            data = message['d']
+            guild_id = int(data['guild_id']) if data.get('guild_id') else None
+            event = {'t': message['t'], 'd': json.dumps(data)}
+            pipeline.xadd(stream_key(partition_of(guild_id)), event, maxlen=EVENT_STREAM_MAX_LENGTH, approximate=True)
+        await pipeline.execute()
+        metrics.increment('gateway.events_published', len(messages))
+
+    def run_gateway(self, token: str):
+        loop = self.loop
+        for shutdown_signal in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(shutdown_signal, lambda: loop.create_task(self.close()))
+            except NotImplementedError:
+                pass
+
+        try:
+            loop.run_until_complete(self.start(token))
+        finally:
+            if self._publisher:
+                self._publisher.cancel()
+            # Publish whatever arrived before the connection closed so workers don't miss it
+            remaining = self._unpublished
+            while not self._events.empty():
+                remaining.append(self._events.get_nowait())
+            if remaining:
+                try:
+                    loop.run_until_complete(self._publish(remaining))
+                except Exception as error:
+                    print(f'Error! Could not publish {len(remaining)} events before exiting: {error}')
+            loop.run_until_complete(close_async_redis())
+            loop.close()
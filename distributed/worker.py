@@ -0,0 +1,201 @@
+import asyncio
+import json
+import math
+import os
+import time
+import uuid
+from typing import Dict, Set
+from aioredis import ResponseError
+from discord import ClientUser
+from prism_bot import EventHandlers, PrismBot, event_handlers
+from distributed.event_stream import EVENT_CONSUMER_GROUP, EVENT_PARTITIONS, lease_key, stream_key, workers_key
+from util.async_redis import get_async_redis
+from util.metrics import metrics
+
+WORKER_LEASE_SECONDS = int(os.getenv('WORKER_LEASE_SECONDS', 15))
+WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', 100))
+WORKER_BLOCK_MS = int(os.getenv('WORKER_BLOCK_MS', 1000))
+WORKER_GUILD_CACHE_SECONDS = int(os.getenv('WORKER_GUILD_CACHE_SECONDS', 600))
+
+# Only the owner may renew or give up a lease, checked and changed in one step so a lease that just expired and was taken
+# by another worker is left alone
+RENEW_LEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+RELEASE_LEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+class EventWorker:
+    '''
+    Consumes events published by the gateway and replays them into the bot, which only talks to Discord over REST.
+
+    Each partition has one owner at a time, decided by a lease key that the owner keeps renewing.
+    A partition's events are handled one at a time in order, and each is acknowledged once its handlers have finished.
+    The consumer group member is named after the partition rather than the process, so a worker taking over a partition
+    from a crashed worker first replays the events that worker never acknowledged.
+    Workers only keep their fair share of partitions, so adding workers spreads the load.
+    '''
+    def __init__(self, bot: PrismBot):
+        self.bot = bot
+        self.worker_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.partitions: Set[int] = set()
+        self._consumers: Dict[int, asyncio.Task] = {}  # Partition -> task handling its events
+        self._guilds_fetched_at: Dict[int, float] = {}
+        redis = get_async_redis()
+        self._renew_lease = redis.register_script(RENEW_LEASE_SCRIPT)
+        self._release_lease = redis.register_script(RELEASE_LEASE_SCRIPT)
+
+    def run_worker(self, token: str):
+        loop = self.bot.loop
+        self.bot.add_shutdown_handlers()
+
+        try:
+            loop.run_until_complete(self._run(token))
+        finally:
+            self.bot.request_shutdown()
+            loop.run_until_complete(self.bot._shutdown_task)
+            loop.close()
+
+    async def _run(self, token: str):
+        user_data = await self.bot.http.static_login(token.strip(), bot=True)
+        self.bot._connection.user = ClientUser(state=self.bot._connection, data=user_data)
+        self.bot.dispatch('ready')  # Lets cogs start their background tasks
+
+        # Counts as running work, so the shutdown drain waits for the partitions to be handed back
+        with self.bot.in_flight():
+            try:
+                while self.bot.accepting_commands:
+                    await self._balance_partitions()
+                    self._consumers = {partition: task for partition, task in self._consumers.items() if not task.done()}
+                    for partition in self.partitions - self._consumers.keys():
+                        self._consumers[partition] = asyncio.create_task(self._consume_partition(partition))
+                    try:
+                        await asyncio.wait_for(self.bot.wait_until_shutdown(), timeout=WORKER_LEASE_SECONDS / 3)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                # Consumers stop after the event they are handling, events they haven't started are left to the next owner
+                await get_async_redis().zrem(workers_key(), self.worker_id)
+                for partition in list(self.partitions):
+                    await self._release(partition)
+                await asyncio.gather(*self._consumers.values(), return_exceptions=True)
+
+    async def _balance_partitions(self):
+        '''Renew owned leases, then grab free partitions or give some back until this worker holds its fair share'''
+        redis = get_async_redis()
+        now = time.time()
+        await redis.zadd(workers_key(), {self.worker_id: now})
+        await redis.zremrangebyscore(workers_key(), 0, now - WORKER_LEASE_SECONDS)
+        fair_share = math.ceil(EVENT_PARTITIONS / max(await redis.zcard(workers_key()), 1))
+
+        for partition in list(self.partitions):
+            if not await self._renew_lease(keys=[lease_key(partition)], args=[self.worker_id, WORKER_LEASE_SECONDS]):
+                self.partitions.discard(partition)  # Lease expired and another worker took over
+
+        while len(self.partitions) > fair_share:
+            await self._release(self.partitions.pop())
+
+        for partition in range(EVENT_PARTITIONS):
+            if len(self.partitions) >= fair_share:
+                break
+            if partition not in self.partitions and await redis.set(lease_key(partition), self.worker_id, nx=True, ex=WORKER_LEASE_SECONDS):
+                await self._acquire(partition)
+
+    async def _acquire(self, partition: int):
+        try:
+            await get_async_redis().xgroup_create(stream_key(partition), EVENT_CONSUMER_GROUP, id='0', mkstream=True)
+        except ResponseError:
+            pass  # Group already exists
+        self.partitions.add(partition)
+
+    async def _release(self, partition: int):
+        self.partitions.discard(partition)
+        consumer = self._consumers.pop(partition, None)
+        if consumer:
+            # Let it finish the event it is handling, so the next owner doesn't replay it while it still runs here
+            await asyncio.gather(consumer, return_exceptions=True)
+        await self._release_lease(keys=[lease_key(partition)], args=[self.worker_id])
+
+    async def _consume_partition(self, partition: int):
+        '''Handle the partition's events one at a time until the lease is lost or the bot shuts down'''
+        redis = get_async_redis()
+        # Unacknowledged events are replayed before reading new ones (id >) to keep guild order
+        read_from = '0'
+        while partition in self.partitions and self.bot.accepting_commands:
+            response = await redis.xreadgroup(EVENT_CONSUMER_GROUP, f'partition-{partition}', {stream_key(partition): read_from},
+                count=WORKER_BATCH_SIZE, block=None if read_from != '>' else WORKER_BLOCK_MS)
+            entries = response[0][1] if response else []
+            if read_from != '>':
+                # Replayed events stay pending until handled, so carry on after the last one rather than from the start
+                read_from = entries[-1][0] if entries else '>'
+
+            for entry_id, fields in entries:
+                if partition not in self.partitions or not self.bot.accepting_commands:
+                    return  # The next owner replays whatever is left
+                await self._handle_in_order(partition, entry_id, fields)
+
+    async def _handle_in_order(self, partition: int, entry_id: str, fields: dict):
+        '''
+        Returns once the event's handlers have finished, or once one of them waits for the user since the reply it waits
+        for is a later event in the same partition. The event is acknowledged when the handlers finish either way
+        '''
+        with self.bot.in_flight():
+            handlers = EventHandlers()
+            token = event_handlers.set(handlers)
+            try:
+                await self._handle(fields['t'], json.loads(fields['d']))
+            except Exception as error:
+                print(f'Error! Could not handle event {fields["t"]} {entry_id}: {error}')
+            finally:
+                event_handlers.reset(token)
+
+            finished = asyncio.create_task(self._acknowledge_when_handled(partition, entry_id, handlers))
+            waiting = asyncio.create_task(handlers.waiting_for_user.wait())
+            await asyncio.wait({finished, waiting}, return_when=asyncio.FIRST_COMPLETED)
+            waiting.cancel()
+
+    async def _acknowledge_when_handled(self, partition: int, entry_id: str, handlers: EventHandlers):
+        '''A worker that stops before the handlers finish leaves the event unacknowledged, for the next owner to replay'''
+        with self.bot.in_flight():
+            # Handlers can start more handlers (e.g. on_command), which are added to the list while waiting
+            while handlers.tasks:
+                tasks, handlers.tasks = handlers.tasks, []
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await get_async_redis().xack(stream_key(partition), EVENT_CONSUMER_GROUP, entry_id)
+            metrics.increment('worker.events_handled')
+
+    async def _handle(self, event_type: str, data: dict):
+        '''
+        Feed a raw gateway event into the bot's connection state, exactly as if it had arrived over the gateway.
+        Parsing dispatches the usual events (on_message, reaction waits, ...) which run as their own tasks, collected in event_handlers
+        '''
+        state = self.bot._connection
+        if data.get('guild_id'):
+            await self._ensure_guild(int(data['guild_id']), int(data['channel_id']) if data.get('channel_id') else None)
+        elif event_type == 'MESSAGE_CREATE' and not state._get_private_channel(int(data['channel_id'])):
+            state.add_dm_channel(await self.bot.http.get_channel(data['channel_id']))
+
+        state.parsers[event_type](data)
+
+    async def _ensure_guild(self, guild_id: int, channel_id: int | None):
+        '''Workers have no gateway cache, so fetch guilds over REST when first seen, when stale, or when a channel is missing'''
+        guild = self.bot.get_guild(guild_id)
+        fetched_at = self._guilds_fetched_at.get(guild_id, 0)
+        if guild and time.time() - fetched_at < WORKER_GUILD_CACHE_SECONDS and (channel_id is None or guild.get_channel(channel_id)):
+            return
+
+        state = self.bot._connection
+        data = await self.bot.http.get_guild(guild_id)
+        data['channels'] = await self.bot.http.get_all_guild_channels(guild_id)
+        if guild:
+            state._remove_guild(guild)
+        state._add_guild_from_data(data)
+        self._guilds_fetched_at[guild_id] = time.time()
+        metrics.increment('worker.guilds_fetched')
@@ -1,43 +1,58 @@
 import os
 from dotenv import load_dotenv
 from discord import Intents
-from discord.ext.commands import Bot, Context, CommandError, NoPrivateMessage
-from cogs.controllers import GameController, CharacterController, MessageController
-from cogs.services.game_service import GameService
-from cogs.services.character_service import CharacterService
-from cogs.services.sentiment_service import SentimentService
-from util.embed_builder import send_guild_only_error
+from discord.ext.commands import Context, CommandError, NoPrivateMessage
 
 load_dotenv()
 
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 COMMAND_PREFIX = os.getenv('COMMAND_PREFIX')
-
-# TODO: Migration to discord.py 2.0.0 will require await keyword for all add_cog calls
-def add_cogs(bot: Bot):
-    game_service = GameService()
-    bot.add_cog(game_service)
-    character_service = CharacterService(bot)
-    bot.add_cog(character_service)
-
-    sentiment_service = SentimentService(bot)
-    bot.add_cog(sentiment_service)
-
-    bot.add_cog(GameController(bot, game_service))
-    bot.add_cog(CharacterController(bot, game_service, character_service))
-    bot.add_cog(MessageController(bot, sentiment_service))
-
-bot = Bot(command_prefix=COMMAND_PREFIX, intents=Intents.default())
-# TODO: Add async with bot:  to make call this line async and await (discord.py 2.0.0)
-add_cogs(bot)
-
-@bot.command(name='ping')
-async def test(ctx: Context):
-    await ctx.channel.send('Pong!')
-
-@bot.event
-async def on_command_error(ctx: Context, error: CommandError):
-    if isinstance(error, NoPrivateMessage):
-        return await send_guild_only_error(ctx)
-
-bot.run(DISCORD_TOKEN)
\ No newline at end of file
+PRISM_MODE = os.getenv('PRISM_MODE', 'standalone')
+
+# Loaded in order, services first since controllers look them up with get_cog
+EXTENSIONS = [
+    'cogs.services',
+    'cogs.controllers.game_controller',
+    'cogs.controllers.character_controller',
+    'cogs.controllers.message_controller',
+    'cogs.controllers.encounter_controller',
+    'cogs.controllers.profiler_controller',
+    'cogs.controllers.query_controller',
+]
+
+def create_bot():
+    # Imported here so the gateway process never loads the bot, models or cogs
+    from prism_bot import PrismBot
+    from util.embed_builder import send_guild_only_error
+
+    bot = PrismBot(command_prefix=COMMAND_PREFIX, intents=Intents.default())
+    # TODO: Migration to discord.py 2.0.0 will require await keyword for all load_extension calls
+    for extension in EXTENSIONS:
+        bot.load_extension(extension)
+
+    @bot.command(name='ping')
+    async def test(ctx: Context):
+        await ctx.channel.send('Pong!')
+
+    @bot.event
+    async def on_command_error(ctx: Context, error: CommandError):
+        if isinstance(error, NoPrivateMessage):
+            return await send_guild_only_error(ctx)
+
+    return bot
+
+# PRISM_MODE=gateway and PRISM_MODE=worker split the bot across processes (see the distributed package)
+if PRISM_MODE == 'gateway':
+    from distributed.gateway import GatewayClient
+    GatewayClient(intents=Intents.default()).run_gateway(DISCORD_TOKEN)
+else:
+    from models.migrations import run_migrations_in_background
+    run_migrations_in_background()
+    bot = create_bot()
+
+    if PRISM_MODE == 'worker':
+        from distributed.worker import EventWorker
+        EventWorker(bot).run_worker(DISCORD_TOKEN)
+    else:
+        # Drains running commands and flushes buffered writes before exiting (see PrismBot)
+        bot.run_until_shutdown(DISCORD_TOKEN)
@@ -0,0 +1,107 @@
+'''
+Command line maintenance tasks that run against the bot's Redis database without starting the bot
+Usage: python manage.py <command> --help
+'''
+import argparse
+import gzip
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from cogs.services.archive_service import ARCHIVE_AFTER_DAYS, ArchiveService
+from cogs.services.backup_service import BackupService
+from cogs.services.ranking_service import RankingService
+from cogs.services.summary_service import SummaryService
+from models.attribute_store import HashAttributeStore
+from models.game import Game
+from models.migrations import run_migrations
+
+def _open_backup(path: str, mode: str, compress: bool = False):
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    if compress or path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def export_command(args: argparse.Namespace):
+    with _open_backup(args.output, 'w', compress=args.gzip) as out:
+        num_documents = BackupService(SummaryService(), archive_service=ArchiveService(SummaryService())).export_guild(args.guild_id, out)
+    print(f'Exported {num_documents} documents for guild {args.guild_id}', file=sys.stderr)
+
+def import_command(args: argparse.Namespace):
+    with _open_backup(args.input, 'r') as lines:
+        summary_service = SummaryService()
+        result = BackupService(summary_service, ranking_service=RankingService(), archive_service=ArchiveService(summary_service)).import_guild(lines, guild_id=args.guild_id)
+    for name, display_name in result.renamed:
+        print(f'Renamed {name} to {display_name} because the name was taken', file=sys.stderr)
+    for error in result.errors:
+        print(error, file=sys.stderr)
+    print(f'Imported {result.games} games and {result.characters} characters with {len(result.errors)} errors', file=sys.stderr)
+
+def rebuild_summaries_command(args: argparse.Namespace):
+    summary_service = SummaryService()
+    if args.guild_id is not None:
+        summary = summary_service.rebuild_guild(args.guild_id)
+        print(f'Rebuilt summary for guild {args.guild_id}: {summary.game_count} games, {summary.character_count} characters', file=sys.stderr)
+    else:
+        num_guilds = summary_service.rebuild_all()
+        print(f'Rebuilt summaries for {num_guilds} guilds', file=sys.stderr)
+
+def rebuild_rankings_command(args: argparse.Namespace):
+    ranking_service = RankingService()
+    games = Game.find(Game.guild_id == args.guild_id).all() if args.guild_id is not None else Game.find().all()
+    num_characters = sum(ranking_service.rebuild_game(game.pk) for game in games)
+    print(f'Rebuilt rankings for {len(games)} games with {num_characters} characters', file=sys.stderr)
+
+def archive_command(args: argparse.Namespace):
+    result = ArchiveService(SummaryService(), ranking_service=RankingService()).archive_inactive(args.days, guild_id=args.guild_id)
+    print(f'Archived {result.games} games inactive for {args.days:g} days, reclaiming {result.bytes_reclaimed / 1024:.1f} KiB', file=sys.stderr)
+
+def migrate_command(args: argparse.Namespace):
+    run_migrations()
+
+def compact_attributes_command(args: argparse.Namespace):
+    num_characters = HashAttributeStore().compact_all()
+    print(f'Moved the attributes of {num_characters} characters into hashes', file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Prism bot maintenance tasks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Export a guild's games and characters as newline-delimited JSON")
+    export_parser.add_argument('guild_id', type=int)
+    export_parser.add_argument('-o', '--output', default='-', help='File to write to. Use .gz to compress. Defaults to stdout')
+    export_parser.add_argument('-z', '--gzip', action='store_true', help='Compress the output even without a .gz extension')
+    export_parser.set_defaults(func=export_command)
+
+    import_parser = subparsers.add_parser('import', help='Import games and characters from an export')
+    import_parser.add_argument('input', help='File to read from. Files ending in .gz are decompressed. Use - for stdin')
+    import_parser.add_argument('-g', '--guild-id', type=int, default=None, help='Move the games into this guild instead of the original one')
+    import_parser.set_defaults(func=import_command)
+
+    rebuild_parser = subparsers.add_parser('rebuild-summaries', help='Recompute guild and game summaries from the stored games and characters')
+    rebuild_parser.add_argument('guild_id', type=int, nargs='?', default=None, help='Only rebuild this guild. Defaults to every guild')
+    rebuild_parser.set_defaults(func=rebuild_summaries_command)
+
+    rankings_parser = subparsers.add_parser('rebuild-rankings', help='Recompute the per-game attribute rankings from the stored characters')
+    rankings_parser.add_argument('guild_id', type=int, nargs='?', default=None, help='Only rebuild games in this guild. Defaults to every game')
+    rankings_parser.set_defaults(func=rebuild_rankings_command)
+
+    archive_parser = subparsers.add_parser('archive', help='Move games with no recent activity into compressed cold storage')
+    archive_parser.add_argument('guild_id', type=int, nargs='?', default=None, help='Only archive games in this guild. Defaults to every guild')
+    archive_parser.add_argument('-d', '--days', type=float, default=ARCHIVE_AFTER_DAYS, help='Days without activity. Defaults to ARCHIVE_AFTER_DAYS')
+    archive_parser.set_defaults(func=archive_command)
+
+    migrate_parser = subparsers.add_parser('migrate', help='Create or update search indexes and wait for them to finish building')
+    migrate_parser.set_defaults(func=migrate_command)
+
+    compact_parser = subparsers.add_parser('compact-attributes',
+        help='Move character attributes out of the documents into hashes. Run after setting ATTRIBUTE_STORAGE=hash')
+    compact_parser.set_defaults(func=compact_attributes_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
 from .base_model import *
 from .game import *
-from .character import *
\ No newline at end of file
+from .character import *
+from .encounter import *
\ No newline at end of file
@@ -0,0 +1,143 @@
+'''
+Where character attributes are saved, chosen with ATTRIBUTE_STORAGE
+
+- document (default): inside the character's JSON document, as a dict of Attribute models. Every attribute repeats its
+  field names and redis_om metadata, and loading a character validates every attribute through pydantic
+- hash: in one Redis hash per character (pr:attributes:<character pk>), one field per attribute holding
+  "value|max value|display name". Hashes of up to a few hundred short fields use Redis' compact listpack encoding,
+  changing one attribute is a single HSET instead of rewriting the whole document, and loading skips validation since
+  values were validated when they were set
+
+Stores merge hash fields over whatever is in the document, so characters saved before switching to hash storage keep working.
+Run python manage.py compact-attributes to move them over. Use tools/attribute_storage_bench.py to compare the two.
+'''
+import json
+import os
+from typing import Iterable, List, Optional
+from redis.client import Pipeline
+from models.character import Attribute, Character
+
+ATTRIBUTE_STORAGE = os.getenv('ATTRIBUTE_STORAGE', 'document').casefold()
+ATTRIBUTE_KEY_PREFIX = 'pr:attributes'
+PACKED_SEPARATOR = '|'
+
+class DocumentAttributeStore:
+    '''Attributes saved inside the character document'''
+    saves_whole_character = True  # Saving attributes needs the whole character, loaded with its other attributes
+
+    def load(self, characters: List[Character]) -> List[Character]:
+        return characters
+
+    def save(self, character: Character, pipeline: Optional[Pipeline] = None):
+        character.save(pipeline=pipeline)
+
+    def save_attribute(self, character: Character, attribute: Attribute, pipeline: Optional[Pipeline] = None):
+        character.save(pipeline=pipeline)
+
+    def save_attributes(self, character: Character, attributes: Iterable[Attribute], pipeline: Optional[Pipeline] = None):
+        character.save(pipeline=pipeline)
+
+    def fill_documents(self, documents: List[str]) -> List[str]:
+        '''Raw character JSON documents with their attributes included, for exports'''
+        return documents
+
+class HashAttributeStore:
+    '''Attributes saved in a Redis hash per character, with the character document holding none'''
+    saves_whole_character = False
+
+    def key(self, character_pk: str) -> str:
+        return f'{ATTRIBUTE_KEY_PREFIX}:{character_pk}'
+
+    def load(self, characters: List[Character]) -> List[Character]:
+        '''Fill in attributes for all characters in one pipelined round trip'''
+        if not characters:
+            return characters
+        pipeline = Character.db().pipeline(transaction=False)
+        for character in characters:
+            pipeline.hgetall(self.key(character.pk))
+        for character, fields in zip(characters, pipeline.execute()):
+            for search_name, packed in fields.items():
+                character.attributes[search_name] = self.unpack(search_name, packed)
+        return characters
+
+    def save(self, character: Character, pipeline: Optional[Pipeline] = None):
+        execute = pipeline is None
+        pipeline = pipeline if pipeline is not None else Character.db().pipeline()
+
+        attributes = character.attributes
+        character.attributes = {}
+        try:
+            character.save(pipeline=pipeline)
+        finally:
+            character.attributes = attributes
+        if attributes:
+            pipeline.hset(self.key(character.pk), mapping={name: self.pack(attribute) for name, attribute in attributes.items()})
+
+        if execute:
+            pipeline.execute()
+
+    def save_attribute(self, character: Character, attribute: Attribute, pipeline: Optional[Pipeline] = None):
+        '''Only writes the one attribute, the character document is left alone'''
+        (pipeline or Character.db()).hset(self.key(character.pk), attribute.search_name, self.pack(attribute))
+
+    def save_attributes(self, character: Character, attributes: Iterable[Attribute], pipeline: Optional[Pipeline] = None):
+        '''Only writes the given attributes, in one HSET'''
+        mapping = {attribute.search_name: self.pack(attribute) for attribute in attributes}
+        if mapping:
+            (pipeline or Character.db()).hset(self.key(character.pk), mapping=mapping)
+
+    def fill_documents(self, documents: List[str]) -> List[str]:
+        parsed = [json.loads(document) for document in documents]
+        pipeline = Character.db().pipeline(transaction=False)
+        for document in parsed:
+            pipeline.hgetall(self.key(document['pk']))
+
+        filled = []
+        for document, raw_document, fields in zip(parsed, documents, pipeline.execute()):
+            if not fields:
+                filled.append(raw_document)
+                continue
+            attributes = document.setdefault('attributes', {})
+            for search_name, packed in fields.items():
+                attributes[search_name] = self.unpack(search_name, packed).dict(exclude={'pk'})
+            filled.append(json.dumps(document))
+        return filled
+
+    def compact_all(self, batch_size: int = 100) -> int:
+        '''Move attributes out of every character document into hashes. Returns the number of characters moved'''
+        num_moved = 0
+        offset = 0
+        while True:
+            characters = Character.find().copy(offset=offset, limit=batch_size).execute(exhaust_results=False)
+            if not characters:
+                return num_moved
+
+            to_move = [character for character in characters if character.attributes]
+            if to_move:
+                # Load first so attributes already in a hash, which are newer, win over the document's copies
+                self.load(to_move)
+                pipeline = Character.db().pipeline()
+                for character in to_move:
+                    self.save(character, pipeline)
+                pipeline.execute()
+                num_moved += len(to_move)
+            offset += batch_size
+
+    def pack(self, attribute: Attribute) -> str:
+        max_value = '' if attribute.max_value is None else attribute.max_value
+        return f'{attribute.value}{PACKED_SEPARATOR}{max_value}{PACKED_SEPARATOR}{attribute.display_name}'
+
+    def unpack(self, search_name: str, packed: str) -> Attribute:
+        # Display name goes last since it is the only part that could contain the separator
+        value, max_value, display_name = packed.split(PACKED_SEPARATOR, 2)
+        return Attribute.construct(display_name=display_name, search_name=search_name, value=int(value),
+            max_value=int(max_value) if max_value else None)
+
+ATTRIBUTE_STORES = {
+    'document': DocumentAttributeStore,
+    'hash': HashAttributeStore,
+}
+
+if ATTRIBUTE_STORAGE not in ATTRIBUTE_STORES:
+    raise ValueError(f'ATTRIBUTE_STORAGE must be one of {", ".join(ATTRIBUTE_STORES)}, not {ATTRIBUTE_STORAGE}')
+attribute_store = ATTRIBUTE_STORES[ATTRIBUTE_STORAGE]()
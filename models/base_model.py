@@ -1,9 +1,42 @@
 from abc import ABC
+from typing import Any, Union
 from redis_om import JsonModel
+from redis_om.model.model import Expression, FindQuery
+from util.query_tracer import query_tracer
+from util.read_replicas import read_router
+
+class TracedFindQuery(FindQuery):
+    '''FindQuery that reports each query it runs, with its generated RediSearch query string, to util.query_tracer'''
+    def copy(self, **kwargs):
+        # FindQuery.copy builds a plain FindQuery, which first(), all() and pagination would then run untraced
+        original = self.dict()
+        original.update(**kwargs)
+        return TracedFindQuery(**original)
+
+    def execute(self, exhaust_results=True):
+        options = f'LIMIT {self.offset} {self.limit}'
+        if self.sort_fields:
+            options += f' SORTBY {" ".join(self.sort_fields)}'
+        with query_tracer.trace(self.model.__name__, self.query, options) as trace:
+            results = super().execute(exhaust_results=exhaust_results)
+            trace.num_results = len(results)
+        return results
 
 class BaseModel(JsonModel, ABC):
     class Meta:
         global_key_prefix = 'pr'
 
-# from redis_om import Migrator
-# Migrator().run()
\ No newline at end of file
+    @classmethod
+    def db(cls):
+        '''A replica inside read_router.replica_reads (see util.read_replicas), otherwise the primary'''
+        return read_router.db(cls._meta.database)
+
+    @classmethod
+    def primary_db(cls):
+        return cls._meta.database
+
+    @classmethod
+    def find(cls, *expressions: Union[Any, Expression]) -> FindQuery:
+        return TracedFindQuery(expressions=expressions, model=cls)
+
+# Indexes are created and migrated by models.migrations, which runs in the background at startup
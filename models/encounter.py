@@ -0,0 +1,32 @@
+from typing import List, Optional
+from redis_om import EmbeddedJsonModel, Field
+import datetime
+
+from models.base_model import BaseModel
+
+class Combatant(EmbeddedJsonModel):
+    display_name: str
+    initiative: int
+    player_id: Optional[int] = None  # Player to mention when it is their turn
+
+class Encounter(BaseModel):
+    '''A fight or other turn-based scene in a channel. Each channel has at most one encounter'''
+    created_ts: Optional[datetime.datetime] = Field(default_factory=lambda: datetime.datetime.now(datetime.timezone.utc))  # Creation timestamp
+    guild_id: int = Field(index=True)
+    channel_id: int = Field(index=True)
+
+    combatants: List[Combatant] = []
+    '''In turn order, highest initiative first'''
+
+    turn_index: int = 0
+    round: int = 1
+
+    turn_count: int = 0
+    '''Goes up on every turn change. Timers remember the turn they were set for, so timers for an earlier turn do nothing'''
+
+    turn_seconds: int = 0
+    '''Time limit per turn. 0 for no limit'''
+
+    @property
+    def current(self) -> Optional[Combatant]:
+        return self.combatants[self.turn_index] if self.combatants else None
@@ -0,0 +1,123 @@
+'''
+Online RediSearch index migrations
+
+Every model's index is created under a versioned name (<index name>:v:<schema hash>) and queries go through an alias with the
+model's usual index name, so redis_om queries don't need to know about versions. When a Field(index=True) definition changes,
+the new index is created next to the old one and RediSearch backfills it in the background while queries keep using the old one.
+Once the backfill finishes the alias is switched over and the old index is dropped (documents are kept).
+Processes starting together take turns through a Redis lock per index, so only one of them creates, switches or drops it.
+'''
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Type
+from redis import ResponseError
+from models.base_model import BaseModel
+from models.character import Character
+from models.encounter import Encounter
+from models.game import Game
+
+MIGRATED_MODELS: List[Type[BaseModel]] = [Game, Character, Encounter]
+MIGRATION_POLL_INTERVAL = float(os.getenv('MIGRATION_POLL_INTERVAL', 1.0))  # Seconds between backfill progress checks
+MIGRATION_LOCK_TIMEOUT = 60  # Seconds, so a process that dies holding the lock doesn't block the others for good
+
+class IndexMigration:
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.schema = model.redisearch_schema()
+        self.schema_hash = hashlib.sha1(self.schema.encode('utf-8')).hexdigest()[:12]  # nosec - not used for security
+        self.alias = model.Meta.index_name
+        self.versioned_name = f'{self.alias}:v:{self.schema_hash}'
+
+    def is_current(self) -> bool:
+        info = self._info(self.alias)
+        return info is not None and info['index_name'] == self.versioned_name
+
+    def needs_backfill(self) -> bool:
+        '''Whether queries have a previous index to keep using while the new one backfills'''
+        return self._info(self.alias) is not None
+
+    def run(self):
+        '''Create the new index, wait for the backfill and switch the alias. Blocks until done'''
+        if self.is_current():
+            return
+
+        db = self.model.primary_db()
+        with self._lock():
+            if self._info(self.versioned_name) is None:
+                self._create()
+            needs_backfill = self.needs_backfill()
+
+        if needs_backfill:
+            while self._info(self.versioned_name)['indexing'] not in (0, '0'):
+                time.sleep(MIGRATION_POLL_INTERVAL)
+
+        with self._lock():
+            # Another process may have finished the same migration while this one waited
+            if self.is_current():
+                return
+            self._switch_alias()
+            db.set(f'{self.alias}:hash', self.schema_hash)
+        print(f'Index for {self.model.__name__} is now {self.versioned_name}')
+
+    def _lock(self):
+        return self.model.primary_db().lock(f'{self.alias}:migration', timeout=MIGRATION_LOCK_TIMEOUT)
+
+    def _create(self):
+        try:
+            self.model.primary_db().execute_command(f'FT.CREATE {self.versioned_name} {self.schema}')
+        except ResponseError as error:
+            # Created by a process that doesn't take the lock, which is just as good
+            if 'already exists' not in str(error).casefold():
+                raise
+            return
+        print(f'Creating index {self.versioned_name} for {self.model.__name__}')
+
+    def _switch_alias(self):
+        db = self.model.primary_db()
+        current = self._info(self.alias)
+        if current is None:
+            db.execute_command('FT.ALIASADD', self.alias, self.versioned_name)
+        elif current['index_name'] == self.alias:
+            # Unversioned index from before migrations existed. Its name is taken, so it has to go before the alias can be added.
+            # Queries fail only for the moment between these two commands
+            db.execute_command('FT.DROPINDEX', self.alias)
+            db.execute_command('FT.ALIASADD', self.alias, self.versioned_name)
+        else:
+            db.execute_command('FT.ALIASUPDATE', self.alias, self.versioned_name)
+            db.execute_command('FT.DROPINDEX', current['index_name'])
+
+    def _info(self, name: str) -> Optional[Dict]:
+        '''FT.INFO as a dict, or None if there is no index or alias with this name'''
+        try:
+            response = self.model.primary_db().execute_command('FT.INFO', name)
+        except ResponseError:
+            return None
+        return dict(zip(response[::2], response[1::2]))
+
+def run_migrations(models: List[Type[BaseModel]] = MIGRATED_MODELS):
+    for model in models:
+        IndexMigration(model).run()
+
+def _run_migrations_and_report(models: List[Type[BaseModel]]):
+    for model in models:
+        try:
+            IndexMigration(model).run()
+        except Exception as error:
+            print(f'Error! Could not migrate the index for {model.__name__}: {error}')
+
+def run_migrations_in_background(models: List[Type[BaseModel]] = MIGRATED_MODELS) -> threading.Thread:
+    '''
+    Run migrations without holding up startup. Indexes that don't exist at all are created straight away, since there is nothing
+    to backfill from, and queries keep using the previous index version until the new one is ready
+    '''
+    migrations = [IndexMigration(model) for model in models]
+    for migration in migrations:
+        if not migration.needs_backfill():
+            migration.run()  # Returns without waiting for the backfill
+
+    thread = threading.Thread(target=_run_migrations_and_report, args=([migration.model for migration in migrations if not migration.is_current()],),
+        name='index-migrations', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import signal
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+from discord.ext.commands import Bot, Command, Context, Group
+from models.base_model import BaseModel
+from util.async_redis import close_async_redis
+from util.embed_builder import warning_embed
+from util.read_replicas import read_router
+from util.response_cache import RecordingContext, response_cache
+from util.scheduler import COMMAND_LIMITS, CommandRejected, scheduler
+
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 25))  # Seconds to wait for running commands on shutdown
+
+class EventHandlers:
+    '''Tasks started by one gateway event, and whether one of them is waiting for the user (e.g. a game delete confirmation)'''
+    def __init__(self):
+        self.tasks: List[asyncio.Task] = []
+        self.waiting_for_user = asyncio.Event()
+
+# Set while a worker replays an event (see distributed.worker), so it can tell when the event has been handled
+event_handlers: ContextVar[Optional[EventHandlers]] = ContextVar('event_handlers', default=None)
+
+class PrismBot(Bot):
+    '''
+    Bot that shuts down gracefully on SIGTERM or SIGINT:
+    1. Stop accepting new commands
+    2. Wait up to SHUTDOWN_DRAIN_TIMEOUT seconds for running commands (and their replies) to finish. Commands waiting on
+       the user (game delete confirmations) are cancelled with a reply instead, see wait_until_shutdown
+    3. Flush buffered writes
+    4. Close Redis and Discord connections
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accepting_commands = True
+        self._num_in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._shutting_down = asyncio.Event()
+        self._shutdown_task: asyncio.Task | None = None
+
+    async def invoke(self, ctx: Context):
+        if not self.accepting_commands:
+            if ctx.command:
+                await ctx.send(embed=warning_embed(title="I'm restarting!", description='Please try that again in a few seconds'))
+            return
+
+        command = self.resolve_command(ctx) if ctx.command else None
+        limit = COMMAND_LIMITS.get(command.qualified_name) if command else None
+        # Commands in DMs are limited per user instead
+        scheduler_key = ctx.guild.id if ctx.guild else ctx.author.id
+        cache_key = response_cache.key_for(ctx, command) if command else None
+
+        with self.in_flight():
+            if cache_key:
+                # Read before running the command, so a write made while it runs leaves the reply cached under an old version
+                version = await self.get_cog('SummaryService').find_version(ctx.guild.id)
+                embed = response_cache.get(cache_key, version)
+                if embed:
+                    return await ctx.send(embed=embed)
+
+            if limit:
+                try:
+                    await scheduler.acquire(scheduler_key, command.qualified_name, limit)
+                except CommandRejected as error:
+                    return await self._send_rejected(ctx, error)
+
+            try:
+                await super().invoke(ctx)
+                if cache_key:
+                    response_cache.put(cache_key, version, ctx)
+            finally:
+                if limit:
+                    scheduler.release(scheduler_key)
+
+    @contextmanager
+    def in_flight(self):
+        '''Work the shutdown drain waits for'''
+        self._num_in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._num_in_flight -= 1
+            if self._num_in_flight == 0:
+                self._idle.set()
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        handlers = event_handlers.get()
+        if handlers:
+            handlers.tasks.append(task)
+        return task
+
+    def wait_for(self, event, *, check=None, timeout=None):
+        handlers = event_handlers.get()
+        if handlers:
+            handlers.waiting_for_user.set()
+        return super().wait_for(event, check=check, timeout=timeout)
+
+    async def wait_until_shutdown(self):
+        '''Returns once a shutdown starts. Race it against interactive waits so they end before the drain deadline'''
+        await self._shutting_down.wait()
+
+    async def get_context(self, message, *, cls=RecordingContext):
+        return await super().get_context(message, cls=cls)
+
+    def resolve_command(self, ctx: Context) -> Command:
+        '''
+        The subcommand that will actually run (e.g. game list rather than game). ctx.command is only the top level group
+        until the group has been invoked, this looks ahead without consuming any arguments
+        '''
+        command = ctx.command
+        view = ctx.view
+        index, previous = view.index, view.previous
+        while isinstance(command, Group):
+            view.skip_ws()
+            subcommand = command.all_commands.get(view.get_word())
+            if subcommand is None:
+                break
+            command = subcommand
+        view.index, view.previous = index, previous
+        return command
+
+    async def _send_rejected(self, ctx: Context, error: CommandRejected):
+        if error.retry_after:
+            description = f'This server is using that command a lot, try again in {max(error.retry_after, 1):.0f} seconds'
+        else:
+            description = 'This server has a lot of commands running, try again in a few seconds'
+        await ctx.send(embed=warning_embed(title='Slow down!', description=description))
+
+    def run_until_shutdown(self, token: str):
+        '''Like run, but SIGTERM and SIGINT trigger a graceful shutdown instead of stopping the event loop immediately'''
+        loop = self.loop
+        self.add_shutdown_handlers()
+
+        try:
+            loop.run_until_complete(self.start(token))
+        finally:
+            if self._shutdown_task is None:
+                # The bot stopped without a signal (e.g. lost login), still save anything buffered
+                self._shutdown_task = loop.create_task(self.shutdown())
+            # start() returns as soon as the bot closes, let the rest of the shutdown finish
+            loop.run_until_complete(self._shutdown_task)
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def add_shutdown_handlers(self):
+        for shutdown_signal in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self.loop.add_signal_handler(shutdown_signal, self.request_shutdown)
+            except NotImplementedError:
+                pass  # Signal handlers are not available on Windows, Ctrl+C will stop the bot without draining
+
+    def request_shutdown(self):
+        if self._shutdown_task is None:
+            self._shutdown_task = self.loop.create_task(self.shutdown())
+
+    async def shutdown(self):
+        self.accepting_commands = False
+        self._shutting_down.set()
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f'Warning! Shutting down with {self._num_in_flight} commands still running')
+
+        timer_service = self.get_cog('TimerService')
+        if timer_service:
+            timer_service.stop()
+        await self._flush_buffers()
+
+        if not self.is_closed():
+            await self.close()
+        BaseModel.db().connection_pool.disconnect()
+        await close_async_redis()
+        await read_router.close()
+
+    async def _flush_buffers(self):
+        write_buffer = self.get_cog('CharacterWriteBuffer')
+        if write_buffer:
+            write_buffer.flush_loop.cancel()
+            await self.loop.run_in_executor(None, write_buffer.flush)
+
+        audit_service = self.get_cog('AuditService')
+        if audit_service:
+            audit_service.flush_loop.cancel()
+            await audit_service.flush()
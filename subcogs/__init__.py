@@ -3,4 +3,5 @@ Cogs do not support nesting in other cogs (see https://github.com/Rapptz/discord
 This leads to oversized cog files
 Workaround is to manually call functions from a POPO from the original cog. Those POPOs are "subcogs"
 '''
-from .game_channel_controller import *
\ No newline at end of file
+from .game_channel_controller import *
+from .game_backup_controller import *
\ No newline at end of file
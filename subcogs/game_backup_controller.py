@@ -0,0 +1,60 @@
+import gzip
+import os
+import tempfile
+from contextvars import copy_context
+from discord import File
+from discord.ext.commands import Bot, Context, CommandError, MissingPermissions
+from cogs.services import BackupService, BackupFormatError
+from util.attachments import save_attachment
+from util.embed_builder import COMMAND_PREFIX, info_embed, error_embed, send_generic_error
+
+MAX_IMPORT_ERRORS_SHOWN = 10
+
+class GameBackupController:
+    def __init__(self, bot: Bot, backup_service: BackupService):
+        self.bot = bot
+        self.backup_service = backup_service
+
+    async def export_games(self, ctx: Context):
+        # Write to a temporary file first so the whole backup never has to sit in memory
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'prism-{ctx.guild.id}.ndjson.gz')
+            with gzip.open(path, 'wt', encoding='utf-8') as out:
+                num_documents = await self.bot.loop.run_in_executor(None, self.backup_service.export_guild, ctx.guild.id, out)
+
+            embed = info_embed(title=f'Exported {num_documents} games and characters from {ctx.guild.name}',
+                description=f'Keep this file safe! You can restore it later with `{COMMAND_PREFIX}game import` and the file attached')
+            return await ctx.send(embed=embed, file=File(path))
+
+    async def import_games(self, ctx: Context):
+        if not ctx.message.attachments:
+            embed = error_embed(title='Error! Missing backup file', description=f'Attach a file made with `{COMMAND_PREFIX}game export` to your message')
+            return await ctx.send(embed=embed)
+
+        attachment = ctx.message.attachments[0]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, os.path.basename(attachment.filename))
+            await save_attachment(attachment, path)
+
+            open_backup = gzip.open if attachment.filename.endswith('.gz') else open
+            with open_backup(path, 'rt', encoding='utf-8') as lines:
+                try:
+                    result = await self.bot.loop.run_in_executor(None, copy_context().run, self.backup_service.import_guild, lines, ctx.guild.id)
+                except BackupFormatError as error:
+                    return await ctx.send(embed=error_embed(title='Error! Could not read the backup file', description=str(error)))
+
+        embed = info_embed(title=f'Imported {result.games} games and {result.characters} characters',
+            description='Welcome back, adventurers!' if not result.errors else f'{len(result.errors)} entries could not be imported')
+        if result.renamed:
+            renamed = [f'- {name} → **{display_name}**' for name, display_name in result.renamed]
+            embed.add_field(name='Renamed because the name was taken:', value='\n'.join(renamed)[:1000], inline=False)
+        if result.errors:
+            embed.add_field(name='Errors:', value='\n'.join(result.errors[:MAX_IMPORT_ERRORS_SHOWN])[:1000], inline=False)
+        return await ctx.send(embed=embed)
+
+    async def backup_error(self, ctx: Context, error: CommandError):
+        if isinstance(error, MissingPermissions):
+            embed = error_embed(title='Error! Only server administrators can export or import games')
+            return await ctx.send(embed=embed)
+        else:
+            return await send_generic_error(ctx, error=error)
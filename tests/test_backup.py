@@ -0,0 +1,27 @@
+'''
+Backup files that can't be read are rejected by BackupService.import_guild before anything is saved.
+Runs without Redis: a rejected file never gets as far as a Redis call
+'''
+import gzip
+
+import pytest
+
+from cogs.services.backup_service import BACKUP_FORMAT, BACKUP_VERSION, BackupFormatError, BackupService
+
+def backup_bytes(num_lines: int) -> bytes:
+    header = f'{{"format": "{BACKUP_FORMAT}", "version": {BACKUP_VERSION}, "guild_id": 1}}\n'
+    return (header + '{"model": "game", "document": {}}\n' * num_lines).encode()
+
+@pytest.mark.parametrize('content, compressed', [
+    (gzip.compress(backup_bytes(5000))[:-20], True),  # Truncated upload
+    (b'not gzipped', True),
+    (backup_bytes(10) + b'\xff\xfe\n', False),
+])
+def test_unreadable_file_is_rejected_before_saving(tmp_path, content, compressed):
+    path = tmp_path / 'backup'
+    path.write_bytes(content)
+    open_backup = gzip.open if compressed else open
+    with open_backup(path, 'rt', encoding='utf-8') as lines:
+        with pytest.raises(BackupFormatError):
+            # Anything past reading the file would reach Redis and fail with a different error
+            BackupService(summary_service=None).import_guild(lines, guild_id=1)
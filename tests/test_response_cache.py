@@ -0,0 +1,94 @@
+'''
+Cached replies of read-only commands (util/response_cache.py) must not outlive the data they were built from.
+The tests that run commands need the Redis in REDIS_OM_URL and are skipped without it
+'''
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from discord.ext.commands.view import StringView
+
+from prism_bot import PrismBot
+from util.response_cache import RecordingContext, ResponseCache
+
+GUILD_ID = 1
+CHANNEL_ID = 3
+
+class LocalContext(RecordingContext):
+    '''Records replies like RecordingContext, without sending them to Discord'''
+    async def send(self, content=None, **kwargs):
+        self.num_sent += 1
+        if content is None and kwargs.get('embed') and len(kwargs) == 1:
+            self.sent_embeds.append(kwargs['embed'])
+
+def make_bot(loop: asyncio.AbstractEventLoop) -> PrismBot:
+    bot = PrismBot(command_prefix='!', loop=loop)
+    bot.load_extension('cogs.services')
+    bot.load_extension('cogs.controllers.game_controller')
+    return bot
+
+def make_context(bot: PrismBot, text: str) -> LocalContext:
+    view = StringView(text)
+    name = view.get_word()
+    message = SimpleNamespace(_state=None, content=f'!{text}', guild=SimpleNamespace(id=GUILD_ID, name='Test'),
+        author=SimpleNamespace(id=2), channel=SimpleNamespace(id=CHANNEL_ID))
+    return LocalContext(message=message, bot=bot, prefix='!', view=view, invoked_with=name, command=bot.get_command(name))
+
+def field_value(ctx: LocalContext, name: str) -> str | None:
+    return next((field.value for field in ctx.sent_embeds[0].fields if field.name == name), None)
+
+def test_game_show_is_not_cached():
+    loop = asyncio.new_event_loop()
+    try:
+        bot = make_bot(loop)
+        cache = ResponseCache()
+        ctx = make_context(bot, 'game list')
+        assert cache.key_for(ctx, bot.get_command('game list')) == (GUILD_ID, CHANNEL_ID, 'game list', '')
+        ctx = make_context(bot, 'game show MyGame')
+        assert cache.key_for(ctx, bot.get_command('game show')) is None
+    finally:
+        loop.close()
+
+def test_game_show_is_rebuilt_after_an_attribute_change():
+    try:
+        from models import Character, Game
+        from models.attribute_store import ATTRIBUTE_KEY_PREFIX
+        from models.migrations import IndexMigration
+        Game.db().ping()
+    except Exception:
+        pytest.skip('Redis is not running')
+    IndexMigration(Game).run()
+    IndexMigration(Character).run()
+
+    loop = asyncio.new_event_loop()
+    bot = make_bot(loop)
+    game_service = bot.get_cog('GameService')
+    character_service = bot.get_cog('CharacterService')
+    game = game_service.create(SimpleNamespace(id=GUILD_ID), f'Cache{uuid.uuid4().hex[:8]}')
+    try:
+        character = character_service.create(game, 'Hero')
+
+        async def show_twice():
+            first = make_context(bot, f'game show {game.display_name}')
+            await bot.invoke(first)
+            # Last active is shown to the second
+            await asyncio.sleep(1.1)
+            character_service.set_attribute(character, 'hp', 10)
+            write_buffer = bot.get_cog('CharacterWriteBuffer')
+            if write_buffer:
+                write_buffer.flush()
+            second = make_context(bot, f'game show {game.display_name}')
+            await bot.invoke(second)
+            return first, second
+
+        first, second = loop.run_until_complete(show_twice())
+        assert len(first.sent_embeds) == 1 and len(second.sent_embeds) == 1
+        assert second.sent_embeds[0] is not first.sent_embeds[0]
+        assert field_value(second, 'Last active') > field_value(first, 'Last active')
+    finally:
+        game_service.delete(game)
+        for character in Character.find(Character.game_id == game.pk).all():
+            Character.db().delete(character.key(), f'{ATTRIBUTE_KEY_PREFIX}:{character.pk}')
+        loop.close()
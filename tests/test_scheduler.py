@@ -0,0 +1,71 @@
+'''
+Fairness and limits of the command scheduler (util/scheduler.py), driven by the load generator in tools/scheduler_load.py.
+The Redis variant needs the Redis in REDIS_OM_URL and is skipped without it
+'''
+import asyncio
+
+import pytest
+
+import util.scheduler
+from tools import scheduler_load
+from util.scheduler import COMMAND_LIMITS, CommandLimit, CommandRejected, CommandScheduler
+
+NOISY_COMMANDS = 200
+QUIET_GUILDS = 10
+QUIET_COMMANDS = 3
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    '''A fresh scheduler where the global in-flight cap, not the per-guild limits, decides who runs'''
+    scheduler = CommandScheduler()
+    monkeypatch.setattr(scheduler_load, 'scheduler', scheduler)
+    monkeypatch.setattr(util.scheduler, 'SCHEDULER_MAX_IN_FLIGHT', 4)
+    monkeypatch.setattr(util.scheduler, 'GUILD_MAX_CONCURRENCY', 4)
+    monkeypatch.setattr(util.scheduler, 'GUILD_MAX_QUEUED', NOISY_COMMANDS)
+    monkeypatch.setattr(util.scheduler, 'SCHEDULER_QUEUE_TIMEOUT', 60)
+    monkeypatch.setitem(COMMAND_LIMITS, scheduler_load.COMMAND_NAME, CommandLimit(rate=1000, burst=NOISY_COMMANDS))
+    return scheduler
+
+def check_fairness(scheduler: CommandScheduler, command):
+    results, waits = asyncio.run(scheduler_load.generate_load(command, NOISY_COMMANDS, QUIET_GUILDS, QUIET_COMMANDS))
+
+    quiet_guild_ids = [guild_id for guild_id in waits if guild_id != scheduler_load.NOISY_GUILD_ID]
+    assert len(quiet_guild_ids) == QUIET_GUILDS
+    assert all(results[(guild_id, 'completed')] == QUIET_COMMANDS for guild_id in quiet_guild_ids)
+    assert results[(scheduler_load.NOISY_GUILD_ID, 'completed')] == NOISY_COMMANDS
+
+    # Quiet guilds queued behind 200 noisy commands, taking turns gets them through long before the noisy guild is done
+    worst_quiet_wait = max(wait for guild_id in quiet_guild_ids for wait in waits[guild_id])
+    worst_noisy_wait = max(waits[scheduler_load.NOISY_GUILD_ID])
+    assert worst_quiet_wait < worst_noisy_wait / 2
+
+    assert scheduler.in_flight == 0 and scheduler.num_waiting == 0
+
+def test_quiet_guilds_are_not_starved(scheduler):
+    check_fairness(scheduler, scheduler_load.sleep_command(0.005))
+
+def test_quiet_guilds_are_not_starved_querying_redis(scheduler):
+    try:
+        from models.game import Game
+        from models.migrations import IndexMigration
+        Game.db().ping()
+    except Exception:
+        pytest.skip('Redis is not running')
+    IndexMigration(Game).run()
+    check_fairness(scheduler, scheduler_load.redis_command())
+
+def test_rejected_commands_get_their_token_back(monkeypatch):
+    scheduler = CommandScheduler()
+    monkeypatch.setattr(util.scheduler, 'GUILD_MAX_CONCURRENCY', 1)
+    monkeypatch.setattr(util.scheduler, 'GUILD_MAX_QUEUED', 0)
+    limit = CommandLimit(rate=1e-9, burst=2)
+
+    async def run():
+        await scheduler.acquire(1, 'game list', limit)
+        with pytest.raises(CommandRejected, match='queue full'):
+            await scheduler.acquire(1, 'game list', limit)
+        tokens = scheduler._guilds[1].buckets['game list'].tokens
+        scheduler.release(1)
+        return tokens
+
+    assert asyncio.run(run()) == pytest.approx(1)
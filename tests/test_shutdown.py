@@ -0,0 +1,118 @@
+'''
+SIGTERM under synthetic load (see PrismBot.shutdown): running commands finish, new ones are turned away, a command waiting
+on the user is cancelled with a reply and no command is left with only some of its writes applied.
+Needs the Redis in REDIS_OM_URL, skipped without it
+'''
+import asyncio
+import os
+import random
+import signal
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from discord.ext.commands import Context
+from discord.ext.commands.view import StringView
+
+from models.base_model import BaseModel
+from prism_bot import SHUTDOWN_DRAIN_TIMEOUT, PrismBot
+
+NUM_COMMANDS = 200
+WRITE_GAP = 0.5  # Seconds between the two writes of a command, standing in for the reply sent in between
+
+class LoadContext(Context):
+    '''Keeps replies instead of sending them to Discord'''
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        self.replies = []
+
+    async def send(self, content=None, **kwargs):
+        self.replies.append(kwargs.get('embed') or content)
+
+@pytest.fixture
+def db():
+    db = BaseModel.db()
+    try:
+        db.ping()
+    except Exception:
+        pytest.skip('Redis is not running')
+    return db
+
+def make_bot(loop: asyncio.AbstractEventLoop, db, prefix: str) -> PrismBot:
+    bot = PrismBot(command_prefix='!', loop=loop)
+
+    @bot.command(name='move')
+    async def move(ctx: Context, number: int):
+        db.set(f'{prefix}:{number}:first', 1)
+        await ctx.send('saved')
+        await asyncio.sleep(WRITE_GAP)
+        db.set(f'{prefix}:{number}:second', 1)
+
+    @bot.command(name='confirm')
+    async def confirm(ctx: Context):
+        '''Waits for the user like game delete does'''
+        reply_task = asyncio.create_task(bot.wait_for('message'))
+        shutdown_task = asyncio.create_task(bot.wait_until_shutdown())
+        done_tasks, pending_tasks = await asyncio.wait({reply_task, shutdown_task}, timeout=30, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending_tasks:
+            task.cancel()
+        await ctx.send('cancelled' if shutdown_task in done_tasks else 'timed out')
+
+    return bot
+
+def make_context(bot: PrismBot, text: str) -> LoadContext:
+    view = StringView(text)
+    name = view.get_word()
+    message = SimpleNamespace(_state=None, content=f'!{text}', guild=SimpleNamespace(id=1), author=SimpleNamespace(id=2),
+        channel=SimpleNamespace(id=3))
+    return LoadContext(message=message, bot=bot, prefix='!', view=view, invoked_with=name, command=bot.get_command(name))
+
+def test_sigterm_drains_running_commands(db):
+    prefix = f'shutdown-test:{uuid.uuid4().hex}'
+    loop = asyncio.new_event_loop()
+    bot = make_bot(loop, db, prefix)
+    bot.add_shutdown_handlers()
+
+    async def load():
+        rng = random.Random(0)
+        confirm = make_context(bot, 'confirm')
+        running = [loop.create_task(bot.invoke(confirm))]
+        moves = []
+        signalled_at = None
+        for number in range(NUM_COMMANDS):
+            if number == NUM_COMMANDS // 2:
+                signalled_at = time.perf_counter()
+                os.kill(os.getpid(), signal.SIGTERM)
+            ctx = make_context(bot, f'move {number}')
+            moves.append(ctx)
+            running.append(loop.create_task(bot.invoke(ctx)))
+            await asyncio.sleep(rng.uniform(0, 0.005))
+        await asyncio.gather(*running)
+        await bot._shutdown_task
+        return confirm, moves, time.perf_counter() - signalled_at
+
+    try:
+        confirm, moves, shutdown_seconds = loop.run_until_complete(load())
+    finally:
+        for shutdown_signal in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(shutdown_signal)
+        loop.close()
+
+    try:
+        first = {key.split(':')[-2] for key in db.keys(f'{prefix}:*:first')}
+        second = {key.split(':')[-2] for key in db.keys(f'{prefix}:*:second')}
+        assert first == second, f'Half applied commands: {sorted(first - second)}'
+
+        refused = [ctx for ctx in moves if any(getattr(reply, 'title', None) == "I'm restarting!" for reply in ctx.replies)]
+        assert refused and len(refused) < len(moves)
+        assert not {ctx.view.buffer.split()[1] for ctx in refused} & first
+        assert len(first) + len(refused) == len(moves)
+
+        # The confirmation doesn't hold the shutdown up until the drain deadline
+        assert confirm.replies == ['cancelled']
+        assert shutdown_seconds < min(SHUTDOWN_DRAIN_TIMEOUT, WRITE_GAP + 5)
+    finally:
+        keys = db.keys(f'{prefix}:*')
+        if keys:
+            db.delete(*keys)
@@ -0,0 +1,79 @@
+'''
+Measure what archiving a game (cogs/services/archive_service.py) reclaims and how long restoring it takes
+Usage: python tools/archive_bench.py [--sizes 10 100 500] [--repeat N]
+
+For each game size, saves a throwaway game with that many characters against the Redis in REDIS_OM_URL, archives it and
+restores it repeat times. Everything is deleted afterwards
+'''
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.services.archive_service import ArchiveService
+from cogs.services.ranking_service import RankingService
+from cogs.services.summary_service import SummaryService
+from models.attribute_store import attribute_store
+from models.character import Attribute, Character
+from models.game import Game
+
+ATTRIBUTES = ['hp', 'initiative', 'strength', 'dexterity', 'wisdom']
+
+def create_game(summary_service: SummaryService, ranking_service: RankingService, guild_id: int, num_characters: int) -> Game:
+    name = f'archive-bench-{uuid.uuid4().hex[:8]}'
+    game = Game(guild_id=guild_id, display_name=name, search_name=name, text_channel_ids=[], category_ids=[])
+    pipeline = Game.db().pipeline(transaction=False)
+    game.save(pipeline=pipeline)
+    for i in range(num_characters):
+        attributes = {search_name: Attribute(display_name=search_name.title(), search_name=search_name, value=random.randint(1, 30))
+            for search_name in ATTRIBUTES}
+        character = Character(game_id=game.pk, display_name=f'Bench {i}', search_name=f'bench {i}', attributes=attributes)
+        attribute_store.save(character, pipeline=pipeline)
+        ranking_service.record_character(pipeline, character)
+    summary_service.record_change(pipeline, game, games=1, characters=num_characters)
+    pipeline.execute()
+    return game
+
+def delete_game(summary_service: SummaryService, ranking_service: RankingService, game: Game):
+    pipeline = Game.db().pipeline(transaction=False)
+    for character in Character.find(Character.game_id == game.pk).all():
+        pipeline.delete(character.key())
+    pipeline.delete(game.key())
+    summary_service.record_game_deleted(pipeline, game)
+    ranking_service.record_game_deleted(pipeline, game)
+    pipeline.execute()
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory reclaimed by archiving a game and time to restore it')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500], help='Numbers of characters in the game')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    summary_service = SummaryService()
+    ranking_service = RankingService()
+    archive_service = ArchiveService(summary_service, ranking_service=ranking_service)
+    guild_id = random.randint(10 ** 17, 10 ** 18)  # Unused guild so benchmark games never mix with real ones
+    print(f'{"characters":>10} {"reclaimed (KiB)":>16} {"restore median (ms)":>20} {"restore max (ms)":>17}')
+    for num_characters in args.sizes:
+        game = create_game(summary_service, ranking_service, guild_id, num_characters)
+        try:
+            reclaimed = []
+            restore_ms = []
+            for _ in range(args.repeat):
+                reclaimed.append(archive_service.archive(game))
+                start = time.perf_counter()
+                game = archive_service.restore(guild_id, game.pk)
+                restore_ms.append((time.perf_counter() - start) * 1000)
+            print(f'{num_characters:>10} {statistics.median(reclaimed) / 1024:>16.1f} {statistics.median(restore_ms):>20.2f} {max(restore_ms):>17.2f}')
+        finally:
+            archive_service.discard(guild_id, [game.pk])
+            delete_game(summary_service, ranking_service, game)
+    Game.db().delete(summary_service.guild_key(guild_id), summary_service.version_key(guild_id), archive_service.guild_key(guild_id))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+Compare character attribute storage formats (models/attribute_store.py)
+Usage: python tools/attribute_storage_bench.py [--sizes 10 100 1000] [--repeat N]
+
+For each number of attributes, saves a throwaway character with each store against the Redis in REDIS_OM_URL and reports
+the memory used by its keys (MEMORY USAGE) and the average time to save it and to load it back. Characters are deleted afterwards
+'''
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.attribute_store import DocumentAttributeStore, HashAttributeStore
+from models.character import Attribute, Character
+
+def make_character(num_attributes: int) -> Character:
+    attributes = {}
+    for i in range(num_attributes):
+        attribute = Attribute(display_name=f'Stat {i}', search_name=f'stat {i}', value=i, max_value=i * 2 if i % 2 else None)
+        attributes[attribute.search_name] = attribute
+    return Character(game_id='attribute-storage-bench', display_name='Bench', search_name='bench', attributes=attributes)
+
+def attribute_values(character: Character) -> dict:
+    return {name: attribute.dict(exclude={'pk'}) for name, attribute in character.attributes.items()}
+
+def average_ms(action: Callable, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        action()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def memory_usage(keys: List[str]) -> int:
+    db = Character.db()
+    return sum(db.memory_usage(key, samples=0) or 0 for key in keys)
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory and latency of character attribute storage formats')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Numbers of attributes to try')
+    parser.add_argument('--repeat', type=int, default=50, help='Saves and loads to average over')
+    args = parser.parse_args()
+
+    stores = {'document': DocumentAttributeStore(), 'hash': HashAttributeStore()}
+    print(f'{"attributes":>10} {"store":>9} {"memory (bytes)":>15} {"save (ms)":>10} {"load (ms)":>10}')
+    for num_attributes in args.sizes:
+        for name, store in stores.items():
+            character = make_character(num_attributes)
+            keys = [character.key()] + ([store.key(character.pk)] if isinstance(store, HashAttributeStore) else [])
+            try:
+                save_ms = average_ms(lambda: store.save(character), args.repeat)
+                load_ms = average_ms(lambda: store.load([Character.get(character.pk)]), args.repeat)
+                loaded = store.load([Character.get(character.pk)])[0]
+                assert attribute_values(loaded) == attribute_values(character), f'{name} store did not load back what it saved'
+                print(f'{num_attributes:>10} {name:>9} {memory_usage(keys):>15} {save_ms:>10.2f} {load_ms:>10.2f}')
+            finally:
+                Character.db().delete(*keys)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Measure the cost of audit history (cogs/services/audit_service.py): record() on the command path, and flush latency and
+throughput for different numbers of buffered entries, against writing each entry with its own XADD
+Usage: python tools/audit_bench.py [--batches 1 10 100 1000] [--repeat N]
+
+Writes to the audit streams of throwaway guilds in the Redis in REDIS_OM_URL, which are deleted afterwards
+'''
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.services.audit_service import AUDIT_MAX_LENGTH, AuditService
+from util.async_redis import close_async_redis, get_async_redis
+
+NUM_GUILDS = 20
+
+async def one_by_one(audit_service: AuditService, guild_ids: list, num_entries: int) -> float:
+    redis = get_async_redis()
+    start = time.perf_counter()
+    for i in range(num_entries):
+        await redis.xadd(audit_service.key(guild_ids[i % len(guild_ids)]), {'action': 'game.rename', 'details': 'bench'},
+            maxlen=AUDIT_MAX_LENGTH, approximate=True)
+    return time.perf_counter() - start
+
+async def buffered(audit_service: AuditService, guild_ids: list, num_entries: int):
+    start = time.perf_counter()
+    for i in range(num_entries):
+        audit_service.record(guild_ids[i % len(guild_ids)], 'game.rename', details='bench')
+    record_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await audit_service.flush()
+    return record_seconds, time.perf_counter() - start
+
+async def run(batches: list, repeat: int):
+    audit_service = AuditService()
+    guild_ids = [random.randint(10 ** 17, 10 ** 18) for _ in range(NUM_GUILDS)]
+    try:
+        print(f'{"entries":>8} {"record us/entry":>16} {"flush ms":>9} {"flush entries/s":>16} {"one XADD each ms":>17}')
+        for num_entries in batches:
+            record_us, flush_ms, throughput, direct_ms = [], [], [], []
+            for _ in range(repeat):
+                record_seconds, flush_seconds = await buffered(audit_service, guild_ids, num_entries)
+                record_us.append(record_seconds * 1e6 / num_entries)
+                flush_ms.append(flush_seconds * 1000)
+                throughput.append(num_entries / flush_seconds)
+                direct_ms.append(await one_by_one(audit_service, guild_ids, num_entries) * 1000)
+            print(f'{num_entries:>8} {statistics.median(record_us):>16.2f} {statistics.median(flush_ms):>9.2f} '
+                f'{statistics.median(throughput):>16.0f} {statistics.median(direct_ms):>17.2f}')
+    finally:
+        await get_async_redis().delete(*(audit_service.key(guild_id) for guild_id in guild_ids))
+        await close_async_redis()
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit record and flush cost')
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.batches, args.repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Run the benchmark suite: every benchmark and load check in tools/ with its default options, one after another
+Usage: python tools/benchmarks.py [names ...] [--list]
+
+Start-up import time comes first since it needs nothing running. The rest use the Redis in REDIS_OM_URL, and replica_check
+only runs when REDIS_REPLICA_URLS is set. A benchmark that fails is reported and the suite carries on
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Name -> script, in the order they run
+BENCHMARKS = {
+    'importtime': 'importtime_report.py',
+    'scheduler': 'scheduler_load.py',
+    'converter': 'converter_burst.py',
+    'audit': 'audit_bench.py',
+    'attribute_storage': 'attribute_storage_bench.py',
+    'write_buffer': 'write_buffer_bench.py',
+    'ranking': 'ranking_bench.py',
+    'archive': 'archive_bench.py',
+    'player_characters': 'player_characters_bench.py',
+    'replica': 'replica_check.py',
+}
+
+def selected(names: list) -> list:
+    if names:
+        return names
+    return [name for name in BENCHMARKS if name != 'replica' or os.getenv('REDIS_REPLICA_URLS')]
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmarks in tools/')
+    parser.add_argument('names', nargs='*', help='Benchmarks to run, all of them by default')
+    parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, script in BENCHMARKS.items():
+            print(f'{name:>18}  tools/{script}')
+        return
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'Unknown benchmarks: {", ".join(unknown)}. Use --list to see them')
+
+    failed = []
+    for name in selected(args.names):
+        print(f'#### {name} (tools/{BENCHMARKS[name]})', flush=True)
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, os.path.join(TOOLS_DIR, BENCHMARKS[name])])
+        if result.returncode != 0:
+            failed.append(name)
+            print(f'Error! {name} exited with {result.returncode}')
+        print(f'#### {name} took {time.perf_counter() - start:.1f}s\n', flush=True)
+
+    if failed:
+        print(f'Failed: {", ".join(failed)}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
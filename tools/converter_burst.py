@@ -0,0 +1,71 @@
+'''
+Redis round trips per command when many commands in one channel resolve their default game at the same time
+Usage: python tools/converter_burst.py [--commands N]
+
+Creates a throwaway game mapped to a category in the Redis in REDIS_OM_URL, then resolves the game for a burst of commands
+sent in a channel of that category, first the way GameConverter used to (channel lookup, then category lookup) and then with
+GameService.find_by_channel_or_category. The game is deleted afterwards
+'''
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.services import AuditService, GameService, SummaryService
+from models.game import Game
+from util.async_redis import close_async_redis
+from util.metrics import metrics
+
+GUILD_ID = 1000000000000000001
+CATEGORY_ID = 1000000000000000002
+CHANNEL_ID = 1000000000000000003
+
+async def sequential_lookups(game_service: GameService, channel, num_commands: int) -> int:
+    '''Round trips made resolving the game the old way, one synchronous query after another'''
+    round_trips = 0
+    for _ in range(num_commands):
+        round_trips += 1
+        if game_service.find_by_channel(channel) is None:
+            round_trips += 1
+            game_service.find_by_category(channel.category)
+    return round_trips
+
+async def burst_lookups(game_service: GameService, channel, num_commands: int) -> int:
+    before = metrics.counters.get('game_service.channel_lookup_round_trips', 0)
+    games = await asyncio.gather(*(game_service.find_by_channel_or_category(channel) for _ in range(num_commands)))
+    assert all(game and game.guild_id == GUILD_ID for game in games), 'Burst resolved the wrong game'
+    return metrics.counters.get('game_service.channel_lookup_round_trips', 0) - before
+
+async def compare(game_service: GameService, channel, num_commands: int):
+    try:
+        for label, lookups in (('channel then category', sequential_lookups), ('pipelined, single flight', burst_lookups)):
+            start = time.perf_counter()
+            round_trips = await lookups(game_service, channel, num_commands)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f'{label:>25}: {round_trips} round trips for {num_commands} commands '
+                f'({round_trips / num_commands:.2f} per command) in {elapsed:.0f}ms')
+    finally:
+        await close_async_redis()
+
+def main():
+    parser = argparse.ArgumentParser(description='Count Redis round trips for a burst of game lookups in one channel')
+    parser.add_argument('--commands', type=int, default=100)
+    args = parser.parse_args()
+
+    guild = SimpleNamespace(id=GUILD_ID)
+    category = SimpleNamespace(id=CATEGORY_ID, guild=guild)
+    channel = SimpleNamespace(id=CHANNEL_ID, guild=guild, category=category)
+    game = Game(guild_id=GUILD_ID, display_name='Burst test', search_name='burst test', category_ids=[str(CATEGORY_ID)])
+    game.save()
+
+    try:
+        asyncio.run(compare(GameService(SummaryService(), AuditService()), channel, args.commands))
+    finally:
+        Game.delete(game.pk)
+
+if __name__ == '__main__':
+    main()
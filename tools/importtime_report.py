@@ -0,0 +1,52 @@
+'''
+Report where process start time goes, using python -X importtime
+Usage: python tools/importtime_report.py [--top N]
+
+Measures what each run mode imports before it can connect, so regressions in start-to-ready time show up before a deploy
+'''
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each PRISM_MODE imports before connecting to Discord (see main.py)
+MODES = {
+    'standalone/worker': 'import prism_bot, models.migrations, cogs.services, cogs.controllers',
+    'gateway': 'import distributed.gateway',
+}
+
+def measure(code: str) -> List[Tuple[int, int, str]]:
+    '''Returns (self us, cumulative us, module) for every module imported by code'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Could not import {code}:\n{result.stderr}')
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        timings.append((int(self_us), int(cumulative_us), module.rstrip()))
+    return timings
+
+def report(mode: str, code: str, top: int):
+    timings = measure(code)
+    total_ms = sum(self_us for self_us, _, _ in timings) / 1000
+    print(f'== {mode}: {len(timings)} modules, {total_ms:.1f} ms total import time')
+    for self_us, cumulative_us, module in sorted(timings, key=lambda timing: timing[1], reverse=True)[:top]:
+        print(f'{cumulative_us / 1000:9.1f} ms  {self_us / 1000:8.1f} ms self  {module}')
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time report for each run mode')
+    parser.add_argument('--top', type=int, default=25, help='Number of slowest modules to show per mode')
+    args = parser.parse_args()
+
+    for mode, code in MODES.items():
+        report(mode, code, args.top)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+Compare the batched "my characters" lookup (CharacterService.find_by_player) with loading each character's game one by one
+Usage: python tools/player_characters_bench.py [--characters 100] [--games 30] [--repeat N]
+
+Saves a throwaway player's characters spread over games in several guilds against the Redis in REDIS_OM_URL, then reports
+round trips and average latency of both lookups. Games and characters are deleted afterwards
+'''
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.services.audit_service import AuditService
+from cogs.services.character_service import CharacterService
+from cogs.services.ranking_service import RankingService
+from cogs.services.summary_service import SummaryService
+from models.character import Character
+from models.game import Game
+from util.async_redis import close_async_redis
+from util.metrics import metrics
+
+NUM_GUILDS = 5
+
+class RoundTripCounter:
+    '''Counts commands sent on redis-py connections, each of which is one round trip'''
+    def __init__(self, *dbs):
+        self.count = 0
+        for db in {id(db): db for db in dbs}.values():
+            db.execute_command = self._counting(db.execute_command)
+
+    def _counting(self, execute_command):
+        def counting(*args, **kwargs):
+            self.count += 1
+            return execute_command(*args, **kwargs)
+        return counting
+
+def one_by_one(player_id: int) -> list:
+    characters = Character.find(Character.player_id == player_id).all()
+    return [(Game.get(character.game_id), character) for character in characters]
+
+def create_player(player_id: int, num_characters: int, num_games: int):
+    guild_ids = [random.randint(10 ** 17, 10 ** 18) for _ in range(NUM_GUILDS)]
+    games = [Game(guild_id=guild_ids[i % NUM_GUILDS], display_name=f'Bench {i}', search_name=f'bench {i}', text_channel_ids=[], category_ids=[])
+        for i in range(num_games)]
+    characters = [Character(game_id=games[i % num_games].pk, player_id=player_id, display_name=f'Bench {i}', search_name=f'bench {i}', attributes={})
+        for i in range(num_characters)]
+    pipeline = Game.db().pipeline(transaction=False)
+    for model in games + characters:
+        model.save(pipeline=pipeline)
+    pipeline.execute()
+    return games, characters
+
+async def batched(character_service: CharacterService, player_id: int, repeat: int):
+    before = metrics.counters.get('character_service.player_lookup_round_trips', 0)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        entries = await character_service.find_by_player(player_id)
+    elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+    round_trips = (metrics.counters.get('character_service.player_lookup_round_trips', 0) - before) / repeat
+    await close_async_redis()
+    return len(entries), round_trips, elapsed_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched vs one by one lookup of a player's characters and their games")
+    parser.add_argument('--characters', type=int, default=100)
+    parser.add_argument('--games', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    player_id = random.randint(10 ** 17, 10 ** 18)
+    games, characters = create_player(player_id, args.characters, args.games)
+    character_service = CharacterService(None, SummaryService(), AuditService(), RankingService())
+    try:
+        counter = RoundTripCounter(Game.primary_db(), Character.primary_db())
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            found = one_by_one(player_id)
+        one_by_one_ms = (time.perf_counter() - start) * 1000 / args.repeat
+        print(f'One by one: {len(found)} characters, {counter.count / args.repeat:.0f} round trips, {one_by_one_ms:.2f}ms')
+
+        num_found, round_trips, batched_ms = asyncio.run(batched(character_service, player_id, args.repeat))
+        print(f'Batched:    {num_found} characters, {round_trips:.0f} round trips, {batched_ms:.2f}ms')
+    finally:
+        Game.primary_db().delete(*(model.key() for model in games + characters))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Compare attribute rankings (cogs/services/ranking_service.py) with loading every character and sorting in Python
+Usage: python tools/ranking_bench.py [--sizes 100 500] [--repeat N]
+
+For each game size, saves throwaway characters with a random initiative against the Redis in REDIS_OM_URL and times
+top 10, rank of one character and a value range both ways. Characters and rankings are deleted afterwards
+'''
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.services.ranking_service import RankingService
+from models.attribute_store import attribute_store
+from models.character import Attribute, Character
+
+ATTRIBUTE = 'initiative'
+
+def average_ms(action: Callable, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        action()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def load_and_sort(game_pk: str):
+    characters = attribute_store.load(Character.find(Character.game_id == game_pk).all())
+    ranked = [character for character in characters if ATTRIBUTE in character.attributes]
+    ranked.sort(key=lambda character: character.attributes[ATTRIBUTE].value, reverse=True)
+    return ranked
+
+def create_characters(ranking_service: RankingService, game_pk: str, num_characters: int) -> list:
+    characters = []
+    pipeline = Character.db().pipeline(transaction=False)
+    for i in range(num_characters):
+        attribute = Attribute(display_name='Initiative', search_name=ATTRIBUTE, value=random.randint(1, 30))
+        character = Character(game_id=game_pk, display_name=f'Bench {i}', search_name=f'bench {i}', attributes={ATTRIBUTE: attribute})
+        attribute_store.save(character, pipeline=pipeline)
+        ranking_service.record_character(pipeline, character)
+        characters.append(character)
+    pipeline.execute()
+    return characters
+
+def main():
+    parser = argparse.ArgumentParser(description='Attribute rankings vs loading and sorting every character')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500], help='Numbers of characters in the game')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    ranking_service = RankingService()
+    print(f'{"characters":>10} {"query":>8} {"load and sort (ms)":>19} {"sorted set (ms)":>16}')
+    for num_characters in args.sizes:
+        game = SimpleNamespace(pk=f'ranking-bench-{uuid.uuid4().hex}')
+        characters = create_characters(ranking_service, game.pk, num_characters)
+        target = random.choice(characters)
+        try:
+            queries = {
+                'top 10': (lambda: load_and_sort(game.pk)[:10],
+                    lambda: ranking_service.find_top(game, ATTRIBUTE, limit=10)),
+                'rank': (lambda: next(i for i, c in enumerate(load_and_sort(game.pk)) if c.pk == target.pk),
+                    lambda: ranking_service.find_rank(game, ATTRIBUTE, target)),
+                '10-20': (lambda: [c for c in load_and_sort(game.pk) if 10 <= c.attributes[ATTRIBUTE].value <= 20][:25],
+                    lambda: ranking_service.find_in_range(game, ATTRIBUTE, 10, 20)),
+            }
+            for name, (baseline, ranked) in queries.items():
+                print(f'{num_characters:>10} {name:>8} {average_ms(baseline, args.repeat):>19.2f} {average_ms(ranked, args.repeat):>16.2f}')
+        finally:
+            pipeline = Character.db().pipeline(transaction=False)
+            for character in characters:
+                pipeline.delete(character.key())
+            ranking_service.record_game_deleted(pipeline, game)
+            pipeline.execute()
+
+if __name__ == '__main__':
+    main()
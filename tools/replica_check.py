@@ -0,0 +1,64 @@
+'''
+Check read/write splitting (util/read_replicas.py) against a primary and its replicas
+Usage: REDIS_REPLICA_URLS=redis://localhost:6380 python tools/replica_check.py [--rounds N]
+
+Start a local pair with e.g. `redis-stack-server --port 6380 --replicaof localhost 6379` next to the primary in REDIS_OM_URL.
+Each round saves a throwaway game on the primary and looks it up by name straight away without and with read-your-writes,
+then again once the write is older than the staleness bound. Games are deleted afterwards
+'''
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.game import Game
+from util.read_replicas import read_router
+
+def find_by_name(guild_id: int, search_name: str, scope) -> bool:
+    with read_router.replica_reads(scope):
+        return bool(Game.find((Game.guild_id == guild_id) & (Game.search_name == search_name)).all())
+
+def main():
+    parser = argparse.ArgumentParser(description='Replica lag and read-your-writes against local replicas')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    if not read_router.enabled:
+        sys.exit('Set REDIS_REPLICA_URLS to the replicas to check')
+    primary = Game.primary_db()
+    read_router.check(primary)
+    time.sleep(0.1)
+    read_router.check(primary)
+    for replica in read_router.replicas:
+        print(f'{replica.url}: {replica.lag * 1000:.1f}ms behind, {"healthy" if replica.healthy else "not used"}')
+
+    guild_id = random.randint(10 ** 17, 10 ** 18)  # Unused guild so test games never mix with real ones
+    games = []
+    found_unsticky = found_sticky = found_later = 0
+    try:
+        for _ in range(args.rounds):
+            name = f'replica-check-{uuid.uuid4().hex[:8]}'
+            game = Game(guild_id=guild_id, display_name=name, search_name=name, text_channel_ids=[], category_ids=[])
+            game.save()
+            games.append(game)
+            # Scoped to something that wasn't written, so this read goes to a replica right after the write
+            found_unsticky += find_by_name(guild_id, name, scope=uuid.uuid4().hex)
+            read_router.note_write(guild_id)
+            found_sticky += find_by_name(guild_id, name, scope=guild_id)
+
+        time.sleep(read_router.sticky_seconds)
+        read_router.check(primary)
+        found_later = sum(find_by_name(guild_id, game.search_name, scope=guild_id) for game in games)
+    finally:
+        if games:
+            primary.delete(*(game.key() for game in games))
+
+    print(f'Found right after the write: {found_unsticky}/{args.rounds} from a replica, {found_sticky}/{args.rounds} with read-your-writes')
+    print(f'Found from a replica after {read_router.sticky_seconds:g}s: {found_later}/{args.rounds}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Load generator for the command scheduler (util/scheduler.py)
+Usage: python tools/scheduler_load.py [--noisy-commands N] [--quiet-guilds N] [--redis]
+
+One noisy guild floods a command while quiet guilds send a few each. Reports how many commands each guild got through,
+how many were rejected and how long quiet guilds waited, which shows whether the noisy guild starves the others.
+By default commands just sleep. With --redis each command runs the same query as game list against the Redis in REDIS_OM_URL
+'''
+import argparse
+import asyncio
+import collections
+import os
+import sys
+import time
+from typing import Callable, Counter, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.metrics import metrics
+from util.scheduler import COMMAND_LIMITS, CommandRejected, scheduler
+
+NOISY_GUILD_ID = 1
+COMMAND_NAME = 'game list'
+
+def sleep_command(seconds: float) -> Callable:
+    async def command(guild_id: int):
+        await asyncio.sleep(seconds)
+    return command
+
+def redis_command() -> Callable:
+    from models.game import Game
+
+    async def command(guild_id: int):
+        Game.find(Game.guild_id == guild_id).all()  # Synchronous, like in GameService
+        await asyncio.sleep(0)  # Replying to Discord
+    return command
+
+async def run_command(command: Callable, guild_id: int, results: Counter, waits: Dict[int, List[float]]):
+    start = time.perf_counter()
+    try:
+        await scheduler.acquire(guild_id, COMMAND_NAME, COMMAND_LIMITS[COMMAND_NAME])
+    except CommandRejected as error:
+        results[(guild_id, error.reason)] += 1
+        return
+    waits[guild_id].append(time.perf_counter() - start)
+    try:
+        await command(guild_id)
+        results[(guild_id, 'completed')] += 1
+    finally:
+        scheduler.release(guild_id)
+
+async def generate_load(command: Callable, noisy_commands: int, quiet_guilds: int, quiet_commands: int):
+    results: Counter = collections.Counter()
+    waits: Dict[int, List[float]] = collections.defaultdict(list)
+    tasks = [asyncio.create_task(run_command(command, NOISY_GUILD_ID, results, waits)) for _ in range(noisy_commands)]
+    await asyncio.sleep(0)  # Noisy guild gets its commands in first
+    for guild_id in range(NOISY_GUILD_ID + 1, NOISY_GUILD_ID + 1 + quiet_guilds):
+        tasks += [asyncio.create_task(run_command(command, guild_id, results, waits)) for _ in range(quiet_commands)]
+    await asyncio.gather(*tasks)
+    return results, waits
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the command scheduler is fair across guilds')
+    parser.add_argument('--noisy-commands', type=int, default=500, help='Commands sent at once by the noisy guild')
+    parser.add_argument('--quiet-guilds', type=int, default=20)
+    parser.add_argument('--quiet-commands', type=int, default=3, help='Commands sent by each quiet guild')
+    parser.add_argument('--command-ms', type=float, default=20, help='How long each simulated command takes')
+    parser.add_argument('--redis', action='store_true', help='Query Redis instead of sleeping')
+    args = parser.parse_args()
+
+    command = redis_command() if args.redis else sleep_command(args.command_ms / 1000)
+    start = time.perf_counter()
+    results, waits = asyncio.run(generate_load(command, args.noisy_commands, args.quiet_guilds, args.quiet_commands))
+    elapsed = time.perf_counter() - start
+
+    print(f'Finished in {elapsed:.2f}s')
+    for label, guild_ids in (('noisy guild', [NOISY_GUILD_ID]), ('quiet guilds', [g for g in waits if g != NOISY_GUILD_ID])):
+        outcomes = collections.Counter()
+        for (guild_id, outcome), count in results.items():
+            if guild_id in guild_ids:
+                outcomes[outcome] += count
+        guild_waits = sorted(wait for guild_id in guild_ids for wait in waits[guild_id])
+        worst_wait = guild_waits[-1] * 1000 if guild_waits else 0
+        print(f'{label:>12}: {dict(outcomes)}, worst wait {worst_wait:.0f}ms')
+    print({name: value for name, value in metrics.snapshot().items() if name.startswith('scheduler.')})
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+'''
+Measure write amplification of attribute changes in a simulated combat, saved straight away and through the write-behind
+buffer (cogs/services/character_write_buffer.py)
+Usage: python tools/write_buffer_bench.py [--characters 6] [--rounds 10] [--changes 4] [--flushes-per-round 1]
+
+Every round each character has --changes attribute changes (hit points mostly, sometimes initiative or spell slots), made
+with CharacterService.set_attribute like the char set command. The buffer is flushed --flushes-per-round times per round, which
+stands in for ATTRIBUTE_FLUSH_INTERVAL. Commands Redis executed are read from INFO commandstats, so run it against a Redis
+nothing else is using. Characters, rankings and summaries are deleted afterwards
+'''
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.services.audit_service import AuditService
+from cogs.services.character_service import CharacterService
+from cogs.services.character_write_buffer import CharacterWriteBuffer
+from cogs.services.ranking_service import RankingService
+from cogs.services.summary_service import SummaryService
+from models.attribute_store import HashAttributeStore, attribute_store
+from models.character import Attribute, Character
+from models.game import Game
+
+ATTRIBUTES = ['HP', 'HP', 'HP', 'Initiative', 'Spell slots']  # Hit points change most
+
+def executed_commands(db) -> int:
+    return sum(stats['calls'] for name, stats in db.info('commandstats').items() if name != 'cmdstat_info')
+
+def create_characters(game_pk: str, num_characters: int) -> List[Character]:
+    characters = []
+    pipeline = Character.db().pipeline(transaction=False)
+    for i in range(num_characters):
+        attributes = {name.casefold(): Attribute(display_name=name, search_name=name.casefold(), value=10, max_value=20)
+            for name in set(ATTRIBUTES)}
+        character = Character(game_id=game_pk, display_name=f'Bench {i}', search_name=f'bench {i}', attributes=attributes)
+        attribute_store.save(character, pipeline=pipeline)
+        characters.append(character)
+    pipeline.execute()
+    return characters
+
+def fight(character_service: CharacterService, write_buffer: Optional[CharacterWriteBuffer], game_pk: str, rounds: int, changes: int,
+        flushes_per_round: int, seed: int):
+    '''Returns (commands executed, milliseconds, attribute changes requested, final attribute values by character name)'''
+    game = Game.construct(pk=game_pk, guild_id=0)
+    rng = random.Random(seed)
+    db = Character.db()
+    commands_before = executed_commands(db)
+    start = time.perf_counter()
+    num_changes = 0
+    for _ in range(rounds):
+        # Characters are looked up for every change, like separate commands would
+        for change in range(changes):
+            for character in sorted(character_service.find_by_game(game), key=lambda character: character.search_name):
+                name = rng.choice(ATTRIBUTES)
+                character_service.set_attribute(character, name, character.attributes[name.casefold()].value + rng.randint(-5, 3))
+                num_changes += 1
+            if write_buffer and (change + 1) % max(changes // flushes_per_round, 1) == 0:
+                write_buffer.flush()
+    if write_buffer:
+        write_buffer.flush()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    commands = executed_commands(db) - commands_before
+    # Read the final values back from Redis, with nothing left in the buffer
+    stored = {character.search_name: {name: attribute.value for name, attribute in character.attributes.items()}
+        for character in attribute_store.load(Character.find(Character.game_id == game_pk).all())}
+    return commands, elapsed_ms, num_changes, stored
+
+def clean_up(ranking_service: RankingService, summary_service: SummaryService, game_pk: str, characters: List[Character]):
+    pipeline = Character.db().pipeline(transaction=False)
+    for character in characters:
+        pipeline.delete(character.key(), HashAttributeStore().key(character.pk))
+    pipeline.delete(summary_service.game_key(game_pk))
+    ranking_service.record_game_deleted(pipeline, Game.construct(pk=game_pk, guild_id=0))
+    pipeline.execute()
+
+def lookups_only(character_service: CharacterService, game_pk: str, rounds: int, changes: int) -> int:
+    '''Commands executed by the character lookups of a fight alone'''
+    game = Game.construct(pk=game_pk, guild_id=0)
+    db = Character.db()
+    before = executed_commands(db)
+    for _ in range(rounds * changes):
+        character_service.find_by_game(game)
+    return executed_commands(db) - before
+
+def main():
+    parser = argparse.ArgumentParser(description='Attribute writes in a simulated combat, with and without the write-behind buffer')
+    parser.add_argument('--characters', type=int, default=6)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--changes', type=int, default=4, help='Attribute changes per character per round')
+    parser.add_argument('--flushes-per-round', type=int, default=1)
+    args = parser.parse_args()
+
+    summary_service = SummaryService()
+    ranking_service = RankingService()
+    audit_service = AuditService()
+    seed = random.randrange(1 << 30)
+    results = {}
+    for mode in ('immediate', 'buffered'):
+        game_pk = f'write-buffer-bench-{uuid.uuid4().hex}'
+        characters = create_characters(game_pk, args.characters)
+        write_buffer = CharacterWriteBuffer(ranking_service, summary_service) if mode == 'buffered' else None
+        character_service = CharacterService(None, summary_service, audit_service, ranking_service, write_buffer)
+        try:
+            # Lookups are the same in both modes, so they are counted on their own and taken out to leave only writes
+            lookups = lookups_only(character_service, game_pk, args.rounds, args.changes)
+            commands, elapsed_ms, num_changes, results[mode] = fight(character_service, write_buffer, game_pk, args.rounds, args.changes,
+                args.flushes_per_round, seed)
+            print(f'{mode:>10}: {num_changes} changes, {commands - lookups} write commands '
+                f'({(commands - lookups) / num_changes:.2f} per change), {elapsed_ms:.1f}ms')
+        finally:
+            clean_up(ranking_service, summary_service, game_pk, characters)
+
+    # Both fights roll the same dice, so they must end with the same values
+    print('Final attribute values match' if results['immediate'] == results['buffered'] else 'Error! Final attribute values differ')
+
+if __name__ == '__main__':
+    main()
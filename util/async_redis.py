@@ -0,0 +1,25 @@
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import aioredis
+
+_redis: 'aioredis.Redis | None' = None
+
+def get_async_redis() -> 'aioredis.Redis':
+    '''
+    Shared asyncio Redis client for work that should not block the event loop (streams, background flushes).
+    Connects to the same database as redis_om, using REDIS_OM_URL
+    '''
+    global _redis
+    if _redis is None:
+        # Imported on first use, so importing models and services doesn't load the asyncio client
+        import aioredis
+        _redis = aioredis.from_url(os.getenv('REDIS_OM_URL', 'redis://localhost:6379'), decode_responses=True)
+    return _redis
+
+async def close_async_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.close()
+        _redis = None
@@ -0,0 +1,16 @@
+import aiohttp
+from discord import Attachment
+
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
+async def save_attachment(attachment: Attachment, path: str):
+    '''
+    Stream a message attachment to a file chunk by chunk.
+    Attachment.save and Attachment.read hold the whole file in memory first
+    '''
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as out:
+                async for chunk in response.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    out.write(chunk)
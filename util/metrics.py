@@ -0,0 +1,65 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+class Timing:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+class Metrics:
+    '''In-process counters and timings. Cheap enough to update on every command, and safe to update from executor threads'''
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.timings: Dict[str, Timing] = {}
+        self.gauges: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name: str, value: float):
+        '''Record the current value of something that goes up and down, like a queue length'''
+        self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = Timing()
+            timing.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, float]:
+        '''Flatten all metrics into name -> value, with timings reported in milliseconds'''
+        with self._lock:
+            values: Dict[str, float] = dict(self.counters)
+            values.update(self.gauges)
+            for name, timing in self.timings.items():
+                values[f'{name}.count'] = timing.count
+                values[f'{name}.avg_ms'] = timing.average * 1000
+                values[f'{name}.max_ms'] = timing.max * 1000
+        return values
+
+metrics = Metrics()
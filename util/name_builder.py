@@ -1,7 +1,11 @@
 import uuid
 
-def create_unique_name(name_attempt: str, existing_names: set[str]):
-    lower_names = {name.casefold() for name in existing_names}
+def create_unique_name(name_attempt: str, existing_names: set[str], casefolded: bool = False):
+    '''
+    If casefolded is True, existing_names must already be casefolded.
+    This skips copying the set, for callers that create many names against the same set
+    '''
+    lower_names = existing_names if casefolded else {name.casefold() for name in existing_names}
 
     if _is_name_free(name_attempt=name_attempt, existing_names=lower_names):
         return name_attempt
@@ -0,0 +1,107 @@
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import pylev
+
+MAX_SUGGESTION_DISTANCE = int(os.getenv('MAX_SUGGESTION_DISTANCE', 2))
+MAX_SUGGESTIONS = int(os.getenv('MAX_SUGGESTIONS', 3))
+SUGGESTION_TIME_BUDGET_MS = float(os.getenv('SUGGESTION_TIME_BUDGET_MS', 20))
+
+class _Node:
+    __slots__ = ('search_name', 'children')
+
+    def __init__(self, search_name: str):
+        self.search_name = search_name
+        self.children: Dict[int, _Node] = {}
+
+class NameIndex:
+    '''
+    BK-tree of search names for "did you mean" suggestions.
+    Lookups only visit subtrees that can hold a name within the requested edit distance, so big guilds stay cheap to search.
+    Removed names are kept as tombstones until they outnumber the live names, then the tree is rebuilt.
+    '''
+    def __init__(self, names: Iterable[str] = ()):
+        self._root: Optional[_Node] = None
+        self._display_names: Dict[str, str] = {}  # search_name -> display_name for all live names
+        self._tombstones = 0
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self._display_names)
+
+    def __contains__(self, name: str) -> bool:
+        return name.casefold() in self._display_names
+
+    def add(self, display_name: str):
+        search_name = display_name.casefold()
+        if search_name in self._display_names:
+            self._display_names[search_name] = display_name
+            return
+
+        self._display_names[search_name] = display_name
+        if self._root is None:
+            self._root = _Node(search_name)
+            return
+
+        node = self._root
+        while True:
+            if node.search_name == search_name:
+                # Name was previously removed and is now back, reuse the tombstoned node
+                self._tombstones -= 1
+                return
+
+            distance = pylev.levenshtein(search_name, node.search_name)
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _Node(search_name)
+                return
+            node = child
+
+    def remove(self, display_name: str):
+        search_name = display_name.casefold()
+        if self._display_names.pop(search_name, None) is None:
+            return
+
+        self._tombstones += 1
+        if self._tombstones > len(self._display_names):
+            self._rebuild()
+
+    def rename(self, old_display_name: str, new_display_name: str):
+        self.remove(old_display_name)
+        self.add(new_display_name)
+
+    def suggest(self, name: str, max_distance: int = MAX_SUGGESTION_DISTANCE, limit: int = MAX_SUGGESTIONS,
+            time_budget_ms: float = SUGGESTION_TIME_BUDGET_MS) -> List[str]:
+        '''
+        Return up to limit display names within max_distance edits of name, closest first.
+        Stops searching once time_budget_ms has elapsed and returns the best matches found so far
+        '''
+        if self._root is None:
+            return []
+
+        search_name = name.casefold()
+        deadline = time.perf_counter() + time_budget_ms / 1000
+        matches: List[Tuple[int, str]] = []
+        to_visit = [self._root]
+
+        while to_visit and time.perf_counter() < deadline:
+            node = to_visit.pop()
+            distance = pylev.levenshtein(search_name, node.search_name)
+            if distance <= max_distance and node.search_name in self._display_names:
+                matches.append((distance, node.search_name))
+
+            for child_distance, child in node.children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    to_visit.append(child)
+
+        matches.sort()
+        return [self._display_names[search_name] for _, search_name in matches[:limit]]
+
+    def _rebuild(self):
+        display_names = list(self._display_names.values())
+        self._root = None
+        self._display_names = {}
+        self._tombstones = 0
+        for display_name in display_names:
+            self.add(display_name)
@@ -0,0 +1,136 @@
+'''
+Sampling profiler for individual commands, switched on at runtime by the profile admin commands.
+Commands of controllers extending ProfiledCog can be profiled, through its cog_before_invoke and cog_after_invoke hooks
+
+A background thread samples the event loop thread's stack every PROFILER_INTERVAL_MS while a profiled command is running.
+Only samples taken while the command's own callback is on the stack are kept, so other commands running at the same time
+don't pollute the profile. Time spent waiting on I/O (await) is not on the stack and doesn't show up, only CPU time does.
+Stacks are written in the collapsed format ("frame;frame;frame count") read by flamegraph.pl and speedscope.
+'''
+import asyncio
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+from typing import Counter, Dict, List, Optional, Tuple
+from discord import Embed
+from discord.ext import commands
+from discord.ext.commands import Command, Context
+from util.embed_builder import info_embed
+
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 5))
+PROFILE_OUTPUT_DIR = os.getenv('PROFILE_OUTPUT_DIR', 'profiles')
+
+class CommandProfiler:
+    def __init__(self):
+        self.enabled = False  # The only thing checked on every command while no profile is running
+        self.target: Optional[str] = None
+        self.remaining = 0
+        self.num_profiled = 0
+        self.stacks: Counter[str] = collections.Counter()
+        self._running: Dict[int, object] = {}  # id(ctx) -> code object of the command callback being profiled
+        self._lock = threading.Lock()
+        self._loop_thread_id: Optional[int] = None
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self, target: str, invocations: int):
+        '''Profile the next invocations of the command with this qualified name, or of any command in the cog with this name'''
+        self.target = target.casefold()
+        self.remaining = invocations
+        self.num_profiled = 0
+        self.stacks = collections.Counter()
+        self._loop_thread_id = threading.get_ident()
+        self.enabled = True
+
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample_loop, name='command-profiler', daemon=True)
+            self._sampler.start()
+
+    async def stop(self) -> Optional[str]:
+        '''Stop profiling and write the collapsed stacks. Returns the file path, or None if nothing was sampled'''
+        self.enabled = False
+        loop = asyncio.get_running_loop()
+        if self._sampler:
+            # Sampler exits within one interval, after which stacks are no longer written
+            await loop.run_in_executor(None, self._sampler.join)
+        with self._lock:
+            self._running.clear()
+        return await loop.run_in_executor(None, self.dump) if self.stacks else None
+
+    def before_invoke(self, ctx: Context, command: Command):
+        if not self.remaining or not self._matches(command):
+            return
+        self.remaining -= 1
+        with self._lock:
+            self._running[id(ctx)] = command.callback.__code__
+
+    async def after_invoke(self, ctx: Context) -> Optional[str]:
+        '''Returns the dump path once the last requested invocation has finished'''
+        with self._lock:
+            if self._running.pop(id(ctx), None) is None:
+                return None
+            self.num_profiled += 1
+            finished = not self.remaining and not self._running
+        return await self.stop() if finished else None
+
+    def top_frames(self, limit: int = 10) -> List[Tuple[str, int]]:
+        '''Frames most often at the top of the stack (where CPU time was actually spent)'''
+        leaf_counts: Counter[str] = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaf_counts[stack.rsplit(';', 1)[-1]] += count
+        return leaf_counts.most_common(limit)
+
+    def dump(self) -> str:
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(PROFILE_OUTPUT_DIR, f'{self.target.replace(" ", "_")}-{timestamp}.collapsed')
+        with open(path, 'w') as out:
+            for stack, count in self.stacks.items():
+                out.write(f'{stack} {count}\n')
+        return path
+
+    def _matches(self, command: Command) -> bool:
+        return command.qualified_name.casefold() == self.target or (command.cog_name or '').casefold() == self.target
+
+    def _sample_loop(self):
+        interval = PROFILER_INTERVAL_MS / 1000
+        while self.enabled:
+            time.sleep(interval)
+            with self._lock:
+                callbacks = set(self._running.values())
+            if not callbacks:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            frames = []
+            in_command = False
+            while frame is not None:
+                frames.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})')
+                in_command = in_command or frame.f_code in callbacks
+                frame = frame.f_back
+
+            if in_command:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+profiler = CommandProfiler()
+
+def profile_summary_embed(path: str) -> Embed:
+    embed = info_embed(title='Profile finished', description=f'{profiler.num_profiled} runs of {profiler.target} written to {path}')
+    top_frames = '\n'.join(f'{count} {frame}' for frame, count in profiler.top_frames(limit=10))
+    embed.add_field(name='Top frames (samples)', value=f'```{top_frames[:1000]}```', inline=False)
+    return embed
+
+class ProfiledCog(commands.Cog):
+    '''Base for controllers whose commands can be profiled. Costs one flag check per command while no profile is running'''
+    async def cog_before_invoke(self, ctx: Context):
+        # Groups run their hooks before their subcommand does, only the command that actually runs is profiled
+        if profiler.enabled and ctx.bot.resolve_command(ctx) is ctx.command:
+            profiler.before_invoke(ctx, ctx.command)
+
+    async def cog_after_invoke(self, ctx: Context):
+        if profiler.enabled:
+            path = await profiler.after_invoke(ctx)
+            if path:
+                await ctx.send(embed=profile_summary_embed(path))
@@ -0,0 +1,123 @@
+'''
+Tracing for the RediSearch queries redis_om generates (see TracedFindQuery in models.base_model)
+
+Every query is timed into the query.search metrics and grouped by shape, which is the query with its values replaced by ?,
+so `@guild_id:[42 42]` and `@guild_id:[7 7]` count as the same query. Queries slower than QUERY_SLOW_MS are also kept with
+their full text in a ring buffer of the last QUERY_TRACE_SIZE. Owners can read both with the queries command.
+'''
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, NamedTuple
+from util.metrics import metrics
+
+QUERY_SLOW_MS = float(os.getenv('QUERY_SLOW_MS', 50))
+QUERY_TRACE_SIZE = int(os.getenv('QUERY_TRACE_SIZE', 100))
+QUERY_MAX_SHAPES = 500  # Shapes come from code, not user input, so this is only a safety net
+
+# Numeric ranges, tag sets and quoted text, in that order, then any bare numbers left
+VALUE_PATTERNS = [(re.compile(r'\[[^\]]*\]'), '[?]'), (re.compile(r'\{[^}]*\}'), '{?}'), (re.compile(r'"[^"]*"'), '"?"'),
+    (re.compile(r'\b\d+(\.\d+)?\b'), '?')]
+
+class SlowQuery(NamedTuple):
+    timestamp: float
+    model: str
+    query: str
+    options: str  # Pagination and sorting
+    num_results: int
+    duration: float  # Seconds
+
+class QueryShape:
+    __slots__ = ('model', 'shape', 'count', 'total', 'max', 'num_results')
+
+    def __init__(self, model: str, shape: str):
+        self.model = model
+        self.shape = shape
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.num_results = 0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+class QueryTrace:
+    '''Filled in by the traced code once the results are known'''
+    __slots__ = ('num_results',)
+
+    def __init__(self):
+        self.num_results = 0
+
+class QueryTracer:
+    def __init__(self, slow_ms: float = QUERY_SLOW_MS, size: int = QUERY_TRACE_SIZE):
+        self.slow_seconds = slow_ms / 1000
+        self.slow: Deque[SlowQuery] = deque(maxlen=size)
+        self.shapes: Dict[str, QueryShape] = {}
+        self._lock = threading.Lock()  # Queries also run on executor threads (imports, exports, archiving)
+        self._local = threading.local()
+
+    @contextmanager
+    def trace(self, model: str, query: str, options: str = ''):
+        '''
+        Time the block as one query. Queries run inside another traced query (redis_om fetching further pages) are counted
+        as part of the outer one
+        '''
+        depth = getattr(self._local, 'depth', 0)
+        trace = QueryTrace()
+        if depth:
+            yield trace
+            return
+
+        self._local.depth = 1
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            self._local.depth = 0
+            self.record(model, query, options, trace.num_results, time.perf_counter() - start)
+
+    def record(self, model: str, query: str, options: str, num_results: int, duration: float):
+        metrics.observe('query.search', duration)
+        metrics.observe(f'query.search.{model}', duration)
+        query_shape = self.shape(query)
+        shape_key = f'{model} {query_shape}'
+        is_slow = duration >= self.slow_seconds
+        with self._lock:
+            shape = self.shapes.get(shape_key)
+            if shape is None and len(self.shapes) < QUERY_MAX_SHAPES:
+                shape = self.shapes[shape_key] = QueryShape(model, query_shape)
+            if shape is not None:
+                shape.count += 1
+                shape.total += duration
+                shape.max = max(shape.max, duration)
+                shape.num_results += num_results
+            if is_slow:
+                self.slow.append(SlowQuery(time.time(), model, query, options, num_results, duration))
+        if is_slow:
+            metrics.increment('query.slow')
+
+    def shape(self, query: str) -> str:
+        for pattern, replacement in VALUE_PATTERNS:
+            query = pattern.sub(replacement, query)
+        return query
+
+    def slowest(self, limit: int = 10) -> List[SlowQuery]:
+        '''Slow queries in the ring buffer, slowest first'''
+        with self._lock:
+            return sorted(self.slow, key=lambda query: query.duration, reverse=True)[:limit]
+
+    def top_shapes(self, limit: int = 10, key: str = 'total') -> List[QueryShape]:
+        '''Query shapes with the most total time, or the highest average or max with key='average' or key='max' '''
+        with self._lock:
+            return sorted(self.shapes.values(), key=lambda shape: getattr(shape, key), reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.slow.clear()
+            self.shapes.clear()
+
+query_tracer = QueryTracer()
@@ -0,0 +1,134 @@
+'''
+Read/write splitting across Redis replicas, turned on by listing replicas in REDIS_REPLICA_URLS (comma separated)
+
+Reads inside `with read_router.replica_reads(guild_id, ...)` go to a healthy replica, everything else goes to the primary
+in REDIS_OM_URL. BaseModel.db() asks the router which connection to use, so redis_om queries inside the block are routed
+without any other changes.
+
+Staleness: every REPLICA_CHECK_INTERVAL the router writes a timestamp to the primary and reads it back from each replica.
+Replicas more than REPLICA_MAX_LAG seconds behind, or not answering, get no reads until they catch up.
+Read-your-writes: writes note the guilds and games they touch (SummaryService does this for every write). For the next
+REPLICA_MAX_LAG seconds, plus two check intervals, reads for those scopes stay on the primary. Workers own whole guilds, so
+the process that wrote is the one that reads next.
+'''
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, Hashable, List, Optional
+from redis import Redis
+from util.async_redis import get_async_redis
+from util.metrics import metrics
+
+if TYPE_CHECKING:
+    import aioredis
+
+REDIS_REPLICA_URLS = [url.strip() for url in os.getenv('REDIS_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 1.0))  # Seconds
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 0.25))  # Seconds
+REPLICA_TIMEOUT = float(os.getenv('REPLICA_TIMEOUT', 0.5))  # Seconds before a replica that isn't answering fails the read
+HEARTBEAT_KEY = 'pr:replication:heartbeat'
+
+_use_replica: ContextVar[bool] = ContextVar('use_replica', default=False)
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.redis = Redis.from_url(url, decode_responses=True, socket_timeout=REPLICA_TIMEOUT, socket_connect_timeout=REPLICA_TIMEOUT)
+        self._async_redis: Optional['aioredis.Redis'] = None
+        self.lag = float('inf')  # Seconds behind the primary at the last check
+
+    @property
+    def healthy(self) -> bool:
+        return self.lag <= REPLICA_MAX_LAG
+
+    @property
+    def async_redis(self) -> 'aioredis.Redis':
+        if self._async_redis is None:
+            import aioredis  # Imported on first use, like util.async_redis
+            self._async_redis = aioredis.from_url(self.url, decode_responses=True, socket_timeout=REPLICA_TIMEOUT)
+        return self._async_redis
+
+class ReadRouter:
+    def __init__(self, urls: List[str] = REDIS_REPLICA_URLS):
+        self.replicas = [Replica(url) for url in urls]
+        self._rotation = itertools.count()
+        self._written_at: Dict[Hashable, float] = {}  # Guild ID or game pk -> time.monotonic() of its last write
+        self.sticky_seconds = REPLICA_MAX_LAG + 2 * REPLICA_CHECK_INTERVAL
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def note_write(self, *scopes: Hashable):
+        '''Keep reads for these guilds or games on the primary until replicas have surely caught up'''
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        for scope in scopes:
+            self._written_at[scope] = now
+
+    def is_sticky(self, scopes) -> bool:
+        now = time.monotonic()
+        return any(now - self._written_at.get(scope, float('-inf')) < self.sticky_seconds for scope in scopes)
+
+    @contextmanager
+    def replica_reads(self, *scopes: Hashable):
+        '''
+        Route reads in the block to a replica, unless one of the scopes was written to recently.
+        Only wrap reads: a write sent to a replica fails
+        '''
+        use_replica = self.enabled and not self.is_sticky(scopes)
+        if self.enabled:
+            metrics.increment('read_router.replica_reads' if use_replica else 'read_router.sticky_reads')
+        token = _use_replica.set(use_replica)
+        try:
+            yield
+        finally:
+            _use_replica.reset(token)
+
+    def db(self, primary: Redis) -> Redis:
+        '''The connection for the current context: a healthy replica inside replica_reads, otherwise the primary'''
+        replica = self._pick() if _use_replica.get() else None
+        return replica.redis if replica else primary
+
+    def async_db(self, *scopes: Hashable) -> 'aioredis.Redis':
+        '''Async client for a read about the given scopes. Calls are usually awaited too late for a context manager'''
+        replica = self._pick() if self.enabled and not self.is_sticky(scopes) else None
+        if self.enabled:
+            metrics.increment('read_router.replica_reads' if replica else 'read_router.sticky_reads')
+        return replica.async_redis if replica else get_async_redis()
+
+    def check(self, primary: Redis):
+        '''Measure each replica's lag with a heartbeat written to the primary'''
+        primary.set(HEARTBEAT_KEY, time.time())
+        for i, replica in enumerate(self.replicas):
+            try:
+                heartbeat = replica.redis.get(HEARTBEAT_KEY)
+                replica.lag = time.time() - float(heartbeat) if heartbeat else float('inf')
+            except Exception as error:
+                if replica.lag != float('inf'):
+                    print(f'Error! Replica {i} is not answering, reading from the primary: {error}')
+                replica.lag = float('inf')
+            metrics.gauge(f'read_router.replica.{i}.lag_ms', min(replica.lag, 3600) * 1000)
+
+        # Forget writes too old to matter. Writes can be noted from executor threads meanwhile, hence the copy
+        cutoff = time.monotonic() - self.sticky_seconds
+        for scope in [scope for scope, written_at in list(self._written_at.items()) if written_at < cutoff]:
+            self._written_at.pop(scope, None)
+
+    async def close(self):
+        for replica in self.replicas:
+            replica.redis.connection_pool.disconnect()
+            if replica._async_redis is not None:
+                await replica._async_redis.close()
+                replica._async_redis = None
+
+    def _pick(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._rotation) % len(healthy)]
+
+read_router = ReadRouter()
@@ -0,0 +1,94 @@
+'''
+Cache of the embeds sent by read-only commands
+
+Entries are keyed by guild, channel, command and argument text, and remember the guild's data version (see
+SummaryService.find_version) they were built from. Every write to a guild's games bumps that version, so an entry is reused
+until the data behind it changes, without anything having to find and delete stale entries. The least recently used entries
+are evicted once there are more than RESPONSE_CACHE_SIZE.
+'''
+import collections
+import os
+from typing import Dict, List, NamedTuple, Optional, OrderedDict, Tuple
+from discord import Embed
+from discord.ext.commands import Command, Context
+from util.metrics import metrics
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 2048))
+
+# Commands whose reply only depends on the guild's games, the channel it was sent in and the arguments.
+# game show isn't one of them: it shows when the game was last active, which attribute changes update without bumping the version
+CACHED_COMMANDS = {'game list', 'game channel show', 'game category show'}
+
+CacheKey = Tuple[int, int, str, str]
+
+class CachedResponse(NamedTuple):
+    version: int
+    embed: Embed
+
+class RecordingContext(Context):
+    '''Context that remembers what it sent, so a command's reply can be cached'''
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        self.sent_embeds: List[Embed] = []
+        self.num_sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.num_sent += 1
+        if content is None and kwargs.get('embed') and len(kwargs) == 1:
+            self.sent_embeds.append(kwargs['embed'])
+        return await super().send(content, **kwargs)
+
+class ResponseCache:
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[CacheKey, CachedResponse] = collections.OrderedDict()
+        self.hits: Dict[str, int] = collections.defaultdict(int)
+        self.misses: Dict[str, int] = collections.defaultdict(int)
+
+    def key_for(self, ctx: Context, command: Command) -> Optional[CacheKey]:
+        '''
+        Cache key for this invocation, or None if it can't be cached.
+        Only called before the command is invoked, when ctx.view is just past the top level command name
+        '''
+        if command.qualified_name not in CACHED_COMMANDS or not ctx.guild or not isinstance(ctx, RecordingContext):
+            return None
+
+        # Group aliases can change the reply (game cat adds a reaction), so only the canonical group names are cached
+        groups = list(reversed(command.parents))
+        words = ctx.view.buffer[ctx.view.index:].split()
+        if [ctx.invoked_with] + words[:len(groups) - 1] != [group.name for group in groups]:
+            return None
+        arguments = ' '.join(words[len(groups):])
+        return (ctx.guild.id, ctx.channel.id, command.qualified_name, arguments)
+
+    def get(self, key: CacheKey, version: int) -> Optional[Embed]:
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            self._record(key[2], hit=False)
+            return None
+        self._entries.move_to_end(key)
+        self._record(key[2], hit=True)
+        return entry.embed
+
+    def put(self, key: CacheKey, version: int, ctx: RecordingContext):
+        '''Cache the reply if the command sent exactly one embed and nothing else'''
+        if ctx.command_failed or ctx.num_sent != 1 or len(ctx.sent_embeds) != 1:
+            return
+        self._entries[key] = CachedResponse(version, ctx.sent_embeds[0])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            metrics.increment('response_cache.evictions')
+
+    def hit_rate(self, command_name: str) -> float:
+        lookups = self.hits[command_name] + self.misses[command_name]
+        return self.hits[command_name] / lookups if lookups else 0.0
+
+    def _record(self, command_name: str, hit: bool):
+        if hit:
+            self.hits[command_name] += 1
+        else:
+            self.misses[command_name] += 1
+        metrics.gauge(f'response_cache.hit_rate.{command_name.replace(" ", "_")}', self.hit_rate(command_name))
+
+response_cache = ResponseCache()
@@ -0,0 +1,223 @@
+'''
+Fair share scheduling for commands that hit Redis hard
+
+Commands listed in COMMAND_LIMITS go through the scheduler before they run:
+1. Each guild has a token bucket per command. An empty bucket rejects the command straight away
+2. Each guild runs at most GUILD_MAX_CONCURRENCY scheduled commands at a time, and at most SCHEDULER_MAX_IN_FLIGHT run in total
+3. Commands that can't start yet wait in their guild's queue. When a slot frees up, guilds with waiting commands take turns,
+   so one busy guild can't starve the others however many commands it queues
+
+Most Redis queries run on the event loop, so the in-flight cap bounds both event loop time and the number of Redis connections
+held by commands that hand their work to an executor (imports and exports). Limits apply per process, so per worker.
+'''
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional
+from discord.ext.commands import CommandError
+from util.metrics import metrics
+
+GUILD_MAX_CONCURRENCY = int(os.getenv('GUILD_MAX_CONCURRENCY', 2))
+GUILD_MAX_QUEUED = int(os.getenv('GUILD_MAX_QUEUED', 10))
+SCHEDULER_MAX_IN_FLIGHT = int(os.getenv('SCHEDULER_MAX_IN_FLIGHT', 16))
+SCHEDULER_QUEUE_TIMEOUT = float(os.getenv('SCHEDULER_QUEUE_TIMEOUT', 10))  # Seconds a command can wait for a slot
+
+class CommandLimit(NamedTuple):
+    rate: float  # Tokens added per second
+    burst: int  # Bucket size, how many commands can run back to back
+
+READ_LIMIT = CommandLimit(rate=1, burst=5)
+WRITE_LIMIT = CommandLimit(rate=0.5, burst=3)
+BULK_LIMIT = CommandLimit(rate=1 / 60, burst=1)
+
+# Commands not listed here (ping, profile, ...) are not scheduled. Nor are commands that wait for the user: game delete waits
+# up to 30 seconds for a confirmation and would hold its slots all that time, blocking the guild's other commands
+COMMAND_LIMITS: Dict[str, CommandLimit] = {
+    'game list': READ_LIMIT,
+    'game show': READ_LIMIT,
+    'game stats': READ_LIMIT,
+    'game history': READ_LIMIT,
+    'game channel show': READ_LIMIT,
+    'game category show': READ_LIMIT,
+    'game create': WRITE_LIMIT,
+    'game channel use': WRITE_LIMIT,
+    'game channel delete': WRITE_LIMIT,
+    'game category use': WRITE_LIMIT,
+    'game category delete': WRITE_LIMIT,
+    'game export': BULK_LIMIT,
+    'game import': BULK_LIMIT,
+    'char list': READ_LIMIT,
+    'char show': READ_LIMIT,
+    'char create': WRITE_LIMIT,
+    'char import': BULK_LIMIT,
+    'char set': READ_LIMIT,  # A single attribute write, made many times a round during combat
+    'char top': READ_LIMIT,
+    'char bottom': READ_LIMIT,
+    'char rank': READ_LIMIT,
+    'char range': READ_LIMIT,
+    'char mine': READ_LIMIT,
+    'encounter start': WRITE_LIMIT,
+    'encounter add': WRITE_LIMIT,
+    'encounter next': WRITE_LIMIT,
+    'encounter show': READ_LIMIT,
+    'encounter end': WRITE_LIMIT,
+}
+
+class CommandRejected(CommandError):
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f'Command rejected: {reason}')
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, limit: CommandLimit):
+        self.rate = limit.rate
+        self.burst = limit.burst
+        self.tokens = float(limit.burst)
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self) -> bool:
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def refund(self):
+        '''Give back the token of a command that was turned away without running'''
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def retry_after(self) -> float:
+        return (1 - self.tokens) / self.rate
+
+class GuildQueue:
+    __slots__ = ('running', 'waiting', 'buckets', 'in_rotation')
+
+    def __init__(self):
+        self.running = 0
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.in_rotation = False
+
+    def is_idle(self) -> bool:
+        if self.running or self.waiting or self.in_rotation:
+            return False
+        for bucket in self.buckets.values():
+            bucket.refill()
+            if bucket.tokens < bucket.burst:
+                return False
+        return True
+
+class CommandScheduler:
+    def __init__(self):
+        self.in_flight = 0
+        self.num_waiting = 0
+        self._guilds: Dict[int, GuildQueue] = {}
+        self._rotation: Deque[int] = deque()  # Guilds with waiting commands and a free guild slot, in turn order
+
+    async def acquire(self, guild_id: int, command_name: str, limit: CommandLimit):
+        '''Wait for a slot to run the command in. Raises CommandRejected if the guild is over its limits. Pair with release'''
+        guild = self._guilds.get(guild_id)
+        if guild is None:
+            guild = self._guilds[guild_id] = GuildQueue()
+
+        bucket = guild.buckets.get(command_name)
+        if bucket is None:
+            bucket = guild.buckets[command_name] = TokenBucket(limit)
+        if not bucket.take():
+            metrics.increment('scheduler.rejected.rate_limited')
+            raise CommandRejected('rate limited', retry_after=bucket.retry_after())
+
+        if self.in_flight < SCHEDULER_MAX_IN_FLIGHT and guild.running < GUILD_MAX_CONCURRENCY and not guild.waiting:
+            self._start(guild)
+            metrics.increment('scheduler.admitted')
+            return
+
+        if len(guild.waiting) >= GUILD_MAX_QUEUED:
+            bucket.refund()
+            metrics.increment('scheduler.rejected.queue_full')
+            raise CommandRejected('queue full')
+
+        future = asyncio.get_running_loop().create_future()
+        guild.waiting.append(future)
+        self.num_waiting += 1
+        metrics.gauge('scheduler.queued', self.num_waiting)
+        if guild.running < GUILD_MAX_CONCURRENCY:
+            self._add_to_rotation(guild_id, guild)
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, timeout=SCHEDULER_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._abandon(guild_id, guild, future)
+            bucket.refund()
+            metrics.increment('scheduler.rejected.queue_timeout')
+            raise CommandRejected('timed out waiting for a slot')
+        except asyncio.CancelledError:
+            self._abandon(guild_id, guild, future)
+            raise
+        metrics.observe('scheduler.wait', time.perf_counter() - start)
+        metrics.increment('scheduler.admitted')
+
+    def release(self, guild_id: int):
+        guild = self._guilds[guild_id]
+        guild.running -= 1
+        self.in_flight -= 1
+        if guild.waiting:
+            self._add_to_rotation(guild_id, guild)
+        self._dispatch()
+        metrics.gauge('scheduler.in_flight', self.in_flight)
+
+        if guild.is_idle():
+            del self._guilds[guild_id]
+
+    def _start(self, guild: GuildQueue):
+        guild.running += 1
+        self.in_flight += 1
+        metrics.gauge('scheduler.in_flight', self.in_flight)
+
+    def _add_to_rotation(self, guild_id: int, guild: GuildQueue):
+        if not guild.in_rotation:
+            guild.in_rotation = True
+            self._rotation.append(guild_id)
+
+    def _dispatch(self):
+        '''Hand free slots to waiting commands, one per guild per turn'''
+        while self._rotation and self.in_flight < SCHEDULER_MAX_IN_FLIGHT:
+            guild_id = self._rotation.popleft()
+            guild = self._guilds[guild_id]
+            guild.in_rotation = False
+            if not guild.waiting or guild.running >= GUILD_MAX_CONCURRENCY:
+                continue  # Rejoins the rotation when one of its commands finishes
+
+            future = guild.waiting.popleft()
+            self.num_waiting -= 1
+            if future.cancelled():
+                # Timed out, its wait is still unwinding. Keep the guild's turn for its next command
+                if guild.waiting:
+                    guild.in_rotation = True
+                    self._rotation.appendleft(guild_id)
+                continue
+            self._start(guild)
+            future.set_result(None)
+            if guild.waiting and guild.running < GUILD_MAX_CONCURRENCY:
+                self._add_to_rotation(guild_id, guild)
+        metrics.gauge('scheduler.queued', self.num_waiting)
+
+    def _abandon(self, guild_id: int, guild: GuildQueue, future: asyncio.Future):
+        if future in guild.waiting:
+            guild.waiting.remove(future)
+            self.num_waiting -= 1
+            metrics.gauge('scheduler.queued', self.num_waiting)
+        elif future.done() and not future.cancelled():
+            self.release(guild_id)  # Given a slot just as the wait gave up, pass it on
+
+scheduler = CommandScheduler()
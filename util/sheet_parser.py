@@ -0,0 +1,167 @@
+import csv
+import json
+import re
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+NAME_COLUMNS = {'name', 'character', 'character name'}
+PLAYER_COLUMNS = {'player', 'player id', 'player_id'}
+JSON_SEPARATORS = re.compile(r'[\s\[\],]*')  # Whitespace, enclosing array brackets and commas between characters
+
+class SheetRowError(Exception):
+    pass
+
+class SheetRow:
+    '''One character parsed from a character sheet. attributes maps display name to (value, max_value)'''
+    def __init__(self, line_number: int, name: str, player_id: Optional[int], attributes: Dict[str, Tuple[int, Optional[int]]]):
+        self.line_number = line_number
+        self.name = name
+        self.player_id = player_id
+        self.attributes = attributes
+
+def parse_sheet(lines: Iterable[str], filename: str) -> Iterator[SheetRow | SheetRowError]:
+    '''
+    Lazily parse characters from a CSV or JSON character sheet, picking the format from the filename.
+    Rows that cannot be parsed are yielded as SheetRowError instead of stopping the whole sheet
+    '''
+    if filename.casefold().endswith(('.json', '.jsonl', '.ndjson')):
+        return parse_json_sheet(lines)
+    return parse_csv_sheet(lines)
+
+def parse_csv_sheet(lines: Iterable[str]) -> Iterator[SheetRow | SheetRowError]:
+    '''
+    First row is the header. One column holds the character name, an optional column holds the player ID, every other column is an attribute.
+    Attribute cells are either a value like 12 or a value and max like 12/20. Empty cells are skipped
+    '''
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if not header:
+        return
+
+    columns = [column.strip() for column in header]
+    folded_columns = [column.casefold() for column in columns]
+    name_index = next((i for i, column in enumerate(folded_columns) if column in NAME_COLUMNS), 0)
+    player_index = next((i for i, column in enumerate(folded_columns) if column in PLAYER_COLUMNS), None)
+
+    for cells in reader:
+        line_number = reader.line_num
+        if not any(cell.strip() for cell in cells):
+            continue
+
+        try:
+            name = cells[name_index].strip() if name_index < len(cells) else ''
+            player_id = _parse_player_id(cells[player_index]) if player_index is not None and player_index < len(cells) else None
+            attributes = {}
+            for i, cell in enumerate(cells):
+                if i in (name_index, player_index) or i >= len(columns) or not cell.strip():
+                    continue
+                attributes[columns[i]] = _parse_attribute_value(columns[i], cell)
+            yield SheetRow(line_number=line_number, name=name, player_id=player_id, attributes=attributes)
+        except SheetRowError as error:
+            yield SheetRowError(f'Line {line_number}: {error}')
+
+def parse_json_sheet(lines: Iterable[str]) -> Iterator[SheetRow | SheetRowError]:
+    '''
+    Accepts either a JSON array of characters or one character per line.
+    Each character looks like {"name": "Bob", "player_id": 123, "attributes": {"HP": "12/20", "STR": 15, "MP": {"value": 3, "max_value": 5}}}
+    '''
+    for number, entry in enumerate(_iter_json_objects(lines), start=1):
+        if isinstance(entry, SheetRowError):
+            yield entry
+            continue
+
+        try:
+            if not isinstance(entry, dict):
+                raise SheetRowError('expected a JSON object')
+
+            name = str(entry.get('name') or entry.get('display_name') or '').strip()
+            player_id = _parse_player_id(entry.get('player_id') or entry.get('player'))
+            attributes = {}
+            for attribute_name, raw_value in (entry.get('attributes') or {}).items():
+                if isinstance(raw_value, dict):
+                    raw_value = f"{raw_value.get('value')}/{raw_value.get('max_value')}" if raw_value.get('max_value') is not None else raw_value.get('value')
+                attributes[str(attribute_name).strip()] = _parse_attribute_value(attribute_name, str(raw_value))
+            yield SheetRow(line_number=number, name=name, player_id=player_id, attributes=attributes)
+        except SheetRowError as error:
+            yield SheetRowError(f'Character {number}: {error}')
+
+def _iter_json_objects(lines: Iterable[str]) -> Iterator[object]:
+    '''
+    Decode JSON values one at a time as soon as enough text has been read, skipping any enclosing array brackets and commas.
+    A value that isn't valid JSON is yielded as a SheetRowError, and decoding picks up again at the next line starting a
+    character. Also yields a SheetRowError if the sheet ends partway through a value
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    start_line = 1  # Line of the sheet the buffer starts on
+    skipping = False  # After a syntax error, until a line starts a new character
+
+    def decode(at_end: bool) -> Iterator[object]:
+        nonlocal buffer, start_line, skipping
+        position = 0
+        while True:
+            next_position = JSON_SEPARATORS.match(buffer, position).end()
+            start_line += buffer.count('\n', position, next_position)
+            position = next_position
+            if position == len(buffer):
+                break
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                # Errors at the very end of the text only mean the value continues on later lines
+                truncated = error.pos >= len(buffer.rstrip()) or error.msg.startswith('Unterminated string')
+                if truncated and not at_end:
+                    break
+                if truncated:
+                    yield SheetRowError(f'Line {start_line}: JSON sheet ended in the middle of a character')
+                else:
+                    error_line = start_line + buffer.count('\n', position, error.pos)
+                    yield SheetRowError(f'Line {start_line}: invalid JSON on line {error_line}, {error.msg[:1].lower()}{error.msg[1:]}')
+
+                # Resync at the next line that starts a new character
+                next_position = buffer.find('\n', position) + 1
+                while next_position and not _starts_object(buffer, next_position):
+                    next_position = buffer.find('\n', next_position) + 1
+                if not next_position:
+                    position = len(buffer)
+                    skipping = True
+                    break
+                start_line += buffer.count('\n', position, next_position)
+                position = next_position
+                continue
+            yield value
+            start_line += buffer.count('\n', position, end)
+            position = end
+        buffer = buffer[position:]
+
+    for line_number, line in enumerate(lines, start=1):
+        if skipping:
+            if not _starts_object(line, 0):
+                continue
+            skipping = False
+        if not buffer:
+            start_line = line_number
+        buffer += line
+        # A character can only be complete once a line closes an object, so other lines are not worth decoding
+        if line.rstrip(' \t\r\n,').endswith(('}', ']')):
+            yield from decode(at_end=False)
+
+    yield from decode(at_end=True)
+
+def _starts_object(text: str, position: int) -> bool:
+    return text.startswith('{', JSON_SEPARATORS.match(text, position).end())
+
+def _parse_player_id(raw_value) -> Optional[int]:
+    if raw_value is None or not str(raw_value).strip():
+        return None
+    raw_value = str(raw_value).strip().lstrip('<@!').rstrip('>')  # Allow pasted mentions like <@123>
+    try:
+        return int(raw_value)
+    except ValueError:
+        raise SheetRowError(f'player ID {raw_value} is not a number')
+
+def _parse_attribute_value(attribute_name: str, raw_value: str) -> Tuple[int, Optional[int]]:
+    value, _, max_value = raw_value.strip().partition('/')
+    try:
+        return int(value), int(max_value) if max_value.strip() else None
+    except ValueError:
+        raise SheetRowError(f'attribute {attribute_name} has value {raw_value}, expected a number like 12 or 12/20')
@@ -0,0 +1,32 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from util.metrics import metrics
+
+class SingleFlight:
+    '''
+    Coalesces identical lookups that are running at the same time: the first caller for a key starts the lookup and
+    everyone who asks for the same key before it finishes awaits the same result. Nothing is kept once it finishes
+    '''
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, lookup: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            metrics.increment(f'{self.name}.shared')
+            # Shielded so a caller that gets cancelled doesn't cancel the lookup for everyone else
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(lookup())
+        self._in_flight[key] = future
+        metrics.increment(f'{self.name}.started')
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def clear(self):
+        '''Make later callers start fresh lookups, e.g. after a write. Lookups already running still finish for their callers'''
+        self._in_flight.clear()